@@ -50,6 +50,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'store.profiling.ProfilingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -144,6 +145,32 @@ CACHES = {
 DATA_UPLOAD_MAX_NUMBER_FIELDS = 10000
 TEMPLATE_LOADERS_CACHE_TIMEOUT = 600
 
+# Read the home page statistics from the store counters table instead of scanning
+# invoices and purchase orders on every request (rebuild with `manage.py rebuild_totals`).
+# The counters are updated after each write commits, outside its transaction
+STORE_STATS_USE_COUNTERS = True
+
+# Bearer token the storefront sends to the invoice ingestion endpoint; ingestion is
+# disabled while it is empty
+STORE_INGEST_TOKEN = os.environ.get('STORE_INGEST_TOKEN', '')
+
+# Bearer token for the read-only reporting API (/api/v1/); staff sessions work without it
+STORE_API_TOKEN = os.environ.get('STORE_API_TOKEN', '')
+
+# The dashboard's reports run concurrently on a pool of this many threads (each holds a
+# database connection while it runs); a report slower than the timeout, in seconds, is
+# shown as still computing and finishes in the background. 0 runs them one after another
+# instead, on the request's connection while it has a transaction open (the benchmarks do,
+# so the queries are counted).
+STORE_DASHBOARD_WORKERS = 4
+STORE_DASHBOARD_TIMEOUT = 5
+
+# Share of requests whose queries, SQL time and cache use are recorded (0 to 1), sent
+# as Server-Timing headers and logged, and aggregated on the admin's performance page
+# over the last STORE_PROFILING_WINDOW seconds. 0 turns profiling off entirely.
+STORE_PROFILING_SAMPLE_RATE = float(os.environ.get('STORE_PROFILING_SAMPLE_RATE', '0.01'))
+STORE_PROFILING_WINDOW = 60 * 60
+
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/5.1/howto/static-files/
 
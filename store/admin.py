@@ -1,22 +1,70 @@
+from collections import defaultdict
+
+from django import forms
 from django.contrib import admin
+from django.conf import settings
+from django.contrib.admin.views.main import ORDER_VAR
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.core.files.storage import default_storage
+from django.forms.models import BaseInlineFormSet
 from django.db.models import Sum, F, DecimalField
-from django.http import HttpResponse
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
 from django.utils.html import format_html
 from django.contrib import messages
 
-import openpyxl
-from openpyxl.styles import Font, Alignment, PatternFill
-from openpyxl.drawing.image import Image
-from io import BytesIO
-
+from .inventory import (
+    InsufficientStock,
+    ReceivingError,
+    adjust_stock,
+    receive_purchase_orders,
+    sync_invoice_reservations
+)
+from .jobs import enqueue, selection_params
+from . import profiling
+from .pagination import KeysetPaginationMixin
+from .search import search
+from .transitions import TRANSITIONS, record_status_change, transition_invoices
 from .models import (
     Product, 
     PurchaseOrder, 
     PurchaseOrderLineItem, 
     Invoice, 
-    InvoiceLineItem
+    InvoiceLineItem,
+    InvoiceStatusChange,
+    InventoryMovement,
+    Job
 )
 
+
+def enqueue_export(kind, request, queryset, **params):
+    """Queue an export job for the selected rows; the worker rebuilds the selection from the changelist's filters"""
+    return enqueue(kind, params={**selection_params(request, queryset.model), **params}, user=request.user)
+
+class RankedSearchMixin:
+    """
+    Admin search through the full-text index (store.search), best matches first
+    unless a column was clicked; falls back to the icontains search over search_fields
+    """
+
+    def get_search_results(self, request, queryset, search_term):
+        results = search(queryset, search_term)
+        if results is None:
+            return super().get_search_results(request, queryset, search_term)
+        if not request.GET.get(ORDER_VAR):
+            results = results.order_by('-search_tier', '-search_rank', *queryset.query.order_by)
+        return results, False
+
+class ProductImportForm(forms.Form):
+    file = forms.FileField(help_text="CSV or XLSX with sku, name and unit_price columns; description and stock_quantity are optional")
+
+    def clean_file(self):
+        upload = self.cleaned_data['file']
+        if not upload.name.lower().endswith(('.csv', '.xlsx')):
+            raise ValidationError("Upload a .csv or .xlsx file.")
+        return upload
+
 class StockStatusFilter(admin.SimpleListFilter):
     title = 'Stock Status'
     parameter_name = 'stock_status'
@@ -37,7 +85,7 @@ class StockStatusFilter(admin.SimpleListFilter):
             return queryset.filter(stock_quantity__gt=10)
 
 @admin.register(Product)
-class ProductAdmin(admin.ModelAdmin):
+class ProductAdmin(KeysetPaginationMixin, RankedSearchMixin, admin.ModelAdmin):
     list_display = ('product_image_thumbnail', 'name', 'sku', 'unit_price', 'stock_status', 'inventory_value')
     list_filter = ('created_at', StockStatusFilter)
     search_fields = ('name', 'sku', 'description')
@@ -103,6 +151,45 @@ class ProductAdmin(admin.ModelAdmin):
             return format_html('<span class="status-badge in-stock">In Stock ({0})</span>', obj.stock_quantity)
     stock_status.short_description = 'Stock Status'
 
+    def save_model(self, request, obj, form, change):
+        # Product.save() leaves stock_quantity alone on updates. An edited quantity is a
+        # stock count: the difference from the current stock is applied as a ledger adjustment
+        super().save_model(request, obj, form, change)
+        if change and 'stock_quantity' in form.changed_data:
+            try:
+                adjust_stock(obj.pk, obj.stock_quantity - form.initial['stock_quantity'],
+                             reference=f'Admin: {request.user.get_username()}')
+            except InsufficientStock:
+                messages.error(request, f'Stock for {obj.sku} changed while saving; the adjustment was not applied.')
+            obj.refresh_from_db(fields=['stock_quantity'])
+
+    def get_urls(self):
+        return [
+            path('import/', self.admin_site.admin_view(self.import_view), name='store_product_import'),
+        ] + super().get_urls()
+
+    def import_view(self, request):
+        if not self.has_add_permission(request) or not self.has_change_permission(request):
+            raise PermissionDenied
+        form = ProductImportForm(request.POST or None, request.FILES or None)
+        if request.method == 'POST' and form.is_valid():
+            upload = form.cleaned_data['file']
+            # Catalogs can have hundreds of thousands of rows, so the import is done by a worker
+            stored = default_storage.save(f'imports/{upload.name}', upload)
+            job = enqueue('import_products', params={'path': stored, 'filename': upload.name}, user=request.user)
+            messages.success(request, format_html(
+                'Catalog import queued as job #{}. <a href="{}">Follow its progress</a>; rows that could not be imported are listed in its result file.',
+                job.pk, reverse('admin:store_job_changelist')
+            ))
+            return redirect('admin:store_product_changelist')
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Import products',
+            'form': form,
+        }
+        return TemplateResponse(request, 'admin/store/product/import.html', context)
+
     def get_actions(self, request):
         actions = super().get_actions(request)
         actions['export_to_csv'] = (self.export_to_csv, 'export_to_csv', 'Export selected products to CSV')
@@ -110,37 +197,16 @@ class ProductAdmin(admin.ModelAdmin):
 
     def export_to_csv(self, modeladmin, request, queryset):
         try:
-            import csv
-            
-            # Set proper content type and filename
-            filename = "products.csv"
-            content_type = 'text/csv'
-            
-            # Create the response
-            response = HttpResponse(content_type=content_type)
-            response['Content-Disposition'] = f'attachment; filename="{filename}"'
-            
-            # Use csv writer for generating the content
-            writer = csv.writer(response)
-            writer.writerow(['Name', 'SKU', 'Unit Price', 'Stock Quantity', 'Inventory Value'])
-            
-            # Write the data
-            for product in queryset:
-                writer.writerow([
-                    product.name, 
-                    product.sku, 
-                    product.unit_price, 
-                    product.stock_quantity, 
-                    product.get_inventory_value()
-                ])
-                
-            # Add success message
-            messages.success(request, f'{queryset.count()} products exported to CSV successfully.')
-            return response
+            # Large catalogs take longer than a request may run, so the export is done by a worker
+            job = enqueue_export('export_products_csv', request, queryset)
+            messages.success(request, format_html(
+                'Product CSV export queued as job #{}. <a href="{}">Follow its progress</a>.',
+                job.pk, reverse('admin:store_job_changelist')
+            ))
             
         except Exception as e:
             messages.error(request, f'Error exporting products to CSV: {str(e)}')
-            return None
+        return None
             
     export_to_csv.short_description = 'Export to CSV'
 
@@ -149,7 +215,8 @@ class PurchaseOrderLineItemInline(admin.TabularInline):
     min_num = 1
     extra = 0
     fields = ('product', 'quantity', 'cost_per_unit', 'received_quantity', 'subtotal')
-    readonly_fields = ('subtotal',)
+    # Received quantities change only through receiving, which also updates stock
+    readonly_fields = ('received_quantity', 'subtotal')
     
     def subtotal(self, obj):
         if obj.id:
@@ -158,13 +225,14 @@ class PurchaseOrderLineItemInline(admin.TabularInline):
     subtotal.short_description = 'Subtotal'
 
 @admin.register(PurchaseOrder)
-class PurchaseOrderAdmin(admin.ModelAdmin):
+class PurchaseOrderAdmin(KeysetPaginationMixin, admin.ModelAdmin):
     list_display = ('order_number', 'vendor_name', 'order_date', 'status', 'total_cost', 'total_items')
     list_filter = ('status', 'order_date')
     search_fields = ('order_number', 'vendor_name', 'notes')
     readonly_fields = ('created_at', 'updated_at', 'total_cost_display')
     inlines = [PurchaseOrderLineItemInline]
     date_hierarchy = 'order_date'
+    actions = ['mark_as_received']
     
     # Add Media class for custom CSS
     class Media:
@@ -191,17 +259,67 @@ class PurchaseOrderAdmin(admin.ModelAdmin):
     def total_cost(self, obj):
         return f"${obj.get_total_cost()}"
     total_cost.short_description = 'Total Cost'
+    total_cost.admin_order_field = 'total_cost'
     
     def total_items(self, obj):
         return obj.get_total_items()
     total_items.short_description = 'Total Items'
+    total_items.admin_order_field = 'total_items'
     
     def total_cost_display(self, obj):
         return format_html('<div style="font-size: 1.2em; color: #28a745; font-weight: bold;">${}</div>', obj.get_total_cost())
     total_cost_display.short_description = 'Total Cost'
+    
+    def mark_as_received(self, request, queryset):
+        try:
+            received = receive_purchase_orders(queryset)
+        except ReceivingError as e:
+            messages.error(request, f'Error receiving purchase orders: {str(e)}')
+            return
+        
+        if not received:
+            messages.warning(request, 'No outstanding items were received.')
+        else:
+            units = sum(received.values())
+            messages.success(request, f'Received {units} units across {len(received)} products into stock.')
+    mark_as_received.short_description = 'Receive outstanding items into stock'
+
+class InvoiceLineItemFormSet(BaseInlineFormSet):
+    def clean(self):
+        """Check there is enough stock for the quantities added to the invoice"""
+        super().clean()
+        if any(self.errors) or self.instance.status == 'cancelled':
+            return
+        
+        requested = defaultdict(int)
+        for form in self.forms:
+            if not form.cleaned_data or form.cleaned_data.get('DELETE'):
+                continue
+            requested[form.cleaned_data['product'].pk] += form.cleaned_data['quantity']
+        
+        held = {}
+        if self.instance.pk:
+            held = dict(
+                self.instance.reservations.filter(status__in=['reserved', 'committed'])
+                .values('product').annotate(total=Sum('quantity')).values_list('product', 'total')
+            )
+        # The admin validates and saves in one transaction; locking the products here keeps the
+        # stock checked from being taken by someone else before save_related() reserves it
+        products = (
+            Product.objects.select_for_update().filter(pk__in=requested).order_by('pk')
+            .values_list('pk', 'sku', 'stock_quantity')
+        )
+        shortages = [
+            f'{sku} (only {stock_quantity} available)'
+            for product_id, sku, stock_quantity in products
+            if requested[product_id] - held.get(product_id, 0) > stock_quantity
+        ]
+        if shortages:
+            raise ValidationError(f'Insufficient stock for: {", ".join(shortages)}')
 
 class InvoiceLineItemInline(admin.TabularInline):
     model = InvoiceLineItem
+    formset = InvoiceLineItemFormSet
     min_num = 1
     extra = 0
     fields = ('product', 'quantity', 'price_each', 'subtotal')
@@ -213,15 +331,26 @@ class InvoiceLineItemInline(admin.TabularInline):
         return "$0.00"
     subtotal.short_description = 'Subtotal'
 
+class InvoiceStatusChangeInline(admin.TabularInline):
+    model = InvoiceStatusChange
+    extra = 0
+    can_delete = False
+    fields = ('changed_at', 'from_status', 'to_status', 'changed_by', 'source')
+    readonly_fields = fields
+    verbose_name_plural = 'Status history'
+    
+    def has_add_permission(self, request, obj=None):
+        return False
+
 @admin.register(Invoice)
-class InvoiceAdmin(admin.ModelAdmin):
+class InvoiceAdmin(KeysetPaginationMixin, RankedSearchMixin, admin.ModelAdmin):
     list_display = ('invoice_number', 'customer_name', 'invoice_date', 'due_date', 'status_colored', 'total_amount')
     list_filter = ('status', 'invoice_date', 'due_date')
     search_fields = ('invoice_number', 'customer_name', 'customer_email', 'notes')
     readonly_fields = ('created_at', 'updated_at', 'total_amount_display')
-    inlines = [InvoiceLineItemInline]
+    inlines = [InvoiceLineItemInline, InvoiceStatusChangeInline]
     date_hierarchy = 'invoice_date'
-    actions = ['mark_as_paid', 'export_to_xlsx']
+    actions = ['mark_as_paid', 'export_to_xlsx', 'export_to_xlsx_flat']
     
     # Add Media class for custom CSS
     class Media:
@@ -251,11 +380,10 @@ class InvoiceAdmin(admin.ModelAdmin):
     def total_amount(self, obj):
         return f"${obj.get_total_amount()}"
     total_amount.short_description = 'Total Amount'
+    total_amount.admin_order_field = 'total_amount'
     
     def status_colored(self, obj):
-        if obj.is_overdue() and obj.status != 'paid' and obj.status != 'cancelled':
-            return format_html('<span class="status-badge overdue">OVERDUE</span>')
-        
+        # Past-due invoices are moved to 'overdue' by the overdue sweep, so the status says it all
         status_classes = {
             'draft': 'draft',
             'sent': 'sent',
@@ -268,134 +396,181 @@ class InvoiceAdmin(admin.ModelAdmin):
                           status_classes.get(obj.status, 'draft'), 
                           obj.get_status_display())
     status_colored.short_description = 'Status'
+    status_colored.admin_order_field = 'status'
     
     def total_amount_display(self, obj):
         return format_html('<div style="font-size: 1.2em; color: #28a745; font-weight: bold;">${}</div>', obj.get_total_amount())
     total_amount_display.short_description = 'Total Amount'
     
-    def mark_as_paid(self, request, queryset):
-        updated = 0
-        for invoice in queryset:
-            if invoice.status != 'paid':
-                invoice.status = 'paid'
-                invoice.save()
-                updated += 1
-        
+    def changeform_view(self, request, object_id=None, form_url='', extra_context=None, attempts=3):
+        for attempt in range(attempts):
+            try:
+                return super().changeform_view(request, object_id, form_url, extra_context)
+            except InsufficientStock:
+                # Without row locks (SQLite) stock can still be taken between validating and
+                # saving. Nothing was saved; validating again shows the shortage on the form.
+                if attempt == attempts - 1:
+                    raise
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # Reserve (or release) stock to match the saved line items and status. A shortage
+        # here rolls the whole save back (see changeform_view)
+        sync_invoice_reservations(form.instance)
+    
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if change and 'status' in form.changed_data:
+            record_status_change(obj, form.initial['status'], user=request.user, source='admin')
+    
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        # One action per status that invoices can be moved to; 'paid' is mark_as_paid
+        for status, label in Invoice.STATUS_CHOICES:
+            name = f'mark_as_{status}'
+            if status == 'paid' or name in actions or not any(status in targets for targets in TRANSITIONS.values()):
+                continue
+            action = lambda modeladmin, request, queryset, status=status: modeladmin._transition(request, queryset, status)
+            actions[name] = (action, name, f'Mark selected invoices as {label.lower()}')
+        return actions
+    
+    def _transition(self, request, queryset, status):
+        # A single UPDATE however many invoices are selected (see store.transitions)
+        updated = transition_invoices(queryset, status, user=request.user, source='admin action')
+        label = dict(Invoice.STATUS_CHOICES)[status].lower()
         if updated == 0:
-            messages.warning(request, 'No invoices were marked as paid.')
+            messages.warning(request, f'No invoices were marked as {label}.')
         else:
-            messages.success(request, f'{updated} {"invoice was" if updated == 1 else "invoices were"} successfully marked as paid.')
+            messages.success(request, f'{updated} {"invoice was" if updated == 1 else "invoices were"} successfully marked as {label}.')
+    
+    def mark_as_paid(self, request, queryset):
+        self._transition(request, queryset, 'paid')
     mark_as_paid.short_description = 'Mark selected invoices as paid'
     
-    def export_to_xlsx(self, request, queryset):
-        """Export invoice details to XLSX file"""
-        if queryset.count() != 1:
-            messages.warning(request, 'Please select only one invoice to export.')
-            return
-        
-        invoice = queryset.first()
-        
+    def _export_xlsx(self, request, queryset, layout):
         try:
-            # Create workbook and sheet
-            wb = openpyxl.Workbook()
-            ws = wb.active
-            ws.title = f"Invoice {invoice.invoice_number}"
-            
-            # Define styles
-            header_font = Font(bold=True, size=12)
-            header_fill = PatternFill(start_color="DDDDDD", end_color="DDDDDD", fill_type="solid")
-            
-            # Company header
-            ws.merge_cells('A1:F1')
-            ws['A1'] = 'E-COMMERCE MANAGEMENT SYSTEM'
-            ws['A1'].font = Font(bold=True, size=16)
-            ws['A1'].alignment = Alignment(horizontal='center')
-            
-            # Invoice information
-            ws['A3'] = 'Invoice Number:'
-            ws['B3'] = str(invoice.invoice_number)
-            ws['A3'].font = header_font
-            
-            ws['A4'] = 'Date:'
-            ws['B4'] = invoice.invoice_date.strftime('%Y-%m-%d')
-            ws['A4'].font = header_font
-            
-            ws['A5'] = 'Due Date:'
-            ws['B5'] = invoice.due_date.strftime('%Y-%m-%d')
-            ws['A5'].font = header_font
-            
-            ws['A6'] = 'Status:'
-            ws['B6'] = invoice.get_status_display()
-            ws['A6'].font = header_font
-            
-            # Customer information
-            ws['D3'] = 'Customer:'
-            ws['E3'] = invoice.customer_name
-            ws['D3'].font = header_font
-            
-            ws['D4'] = 'Email:'
-            ws['E4'] = invoice.customer_email
-            ws['D4'].font = header_font
-            
-            ws['D5'] = 'Billing Address:'
-            ws['E5'] = invoice.billing_address.replace("\n", ", ")
-            ws['D5'].font = header_font
-            
-            # Line items header
-            row = 8
-            headers = ['Product', 'SKU', 'Quantity', 'Price Each', 'Subtotal']
-            for col, header in enumerate(headers, 1):
-                cell = ws.cell(row=row, column=col, value=header)
-                cell.font = header_font
-                cell.fill = header_fill
-            
-            # Line items
-            row += 1
-            for item in invoice.line_items.all():
-                ws.cell(row=row, column=1, value=item.product.name)
-                ws.cell(row=row, column=2, value=item.product.sku)
-                ws.cell(row=row, column=3, value=item.quantity)
-                ws.cell(row=row, column=4, value=float(item.price_each))
-                ws.cell(row=row, column=5, value=float(item.get_subtotal()))
-                row += 1
-            
-            # Total
-            ws.cell(row=row+1, column=4, value='Total:')
-            ws.cell(row=row+1, column=4).font = header_font
-            ws.cell(row=row+1, column=5, value=float(invoice.get_total_amount()))
-            ws.cell(row=row+1, column=5).font = header_font
-            
-            # Adjust column widths
-            for col in ['A', 'B', 'C', 'D', 'E']:
-                ws.column_dimensions[col].width = 20
-            
-            # Create response
-            buffer = BytesIO()
-            wb.save(buffer)
-            buffer.seek(0)
-            
-            # Set proper content type and filename
-            filename = f"Invoice_{invoice.invoice_number}.xlsx"
-            content_type = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-            
-            # Create the HttpResponse object with proper content-type and headers
-            response = HttpResponse(
-                buffer.getvalue(),
-                content_type=content_type
-            )
-            response['Content-Disposition'] = f'attachment; filename="{filename}"'
-            
-            # Add a success message
-            messages.success(request, f'Invoice {invoice.invoice_number} has been exported successfully.')
-            
-            return response
+            # Month-end exports can cover thousands of invoices, so the workbook is built by a worker
+            job = enqueue_export('export_invoices_xlsx', request, queryset, layout=layout)
+            messages.success(request, format_html(
+                'Invoice export queued as job #{}. <a href="{}">Follow its progress</a>.',
+                job.pk, reverse('admin:store_job_changelist')
+            ))
             
         except Exception as e:
-            messages.error(request, f'Error exporting invoice: {str(e)}')
-            return None
-            
+            messages.error(request, f'Error exporting invoices: {str(e)}')
+        return None
+    
+    def export_to_xlsx(self, request, queryset):
+        """Export the selected invoices to an XLSX file with one sheet per invoice"""
+        return self._export_xlsx(request, queryset, layout='sheets')
     export_to_xlsx.short_description = 'Export to XLSX'
     
-# We don't register these models directly as they are used in inlines
-# admin.site.register(PurchaseOrderLineItem)
-# admin.site.register(InvoiceLineItem)
+    def export_to_xlsx_flat(self, request, queryset):
+        """Export the line items of the selected invoices to a single XLSX sheet"""
+        return self._export_xlsx(request, queryset, layout='flat')
+    export_to_xlsx_flat.short_description = 'Export to XLSX (single sheet)'
+    
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind_display', 'status_colored', 'progress_display', 'created_by', 'created_at', 'finished_at', 'download_link')
+    list_filter = ('status', 'kind')
+    readonly_fields = ('kind', 'params', 'status', 'progress', 'total', 'summary', 'result_file', 'error', 'created_by', 'created_at', 'started_at', 'finished_at')
+    list_per_page = 50
+    list_select_related = ('created_by',)
+    
+    # Add Media class for custom CSS
+    class Media:
+        css = {
+            'all': ('admin/css/custom_admin.css', 'admin/css/action_fixes.css',)
+        }
+    
+    def has_add_permission(self, request):
+        # Jobs are created by the export actions
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def kind_display(self, obj):
+        return obj.get_kind_display()
+    kind_display.short_description = 'Job'
+    kind_display.admin_order_field = 'kind'
+    
+    def status_colored(self, obj):
+        status_classes = {
+            'queued': 'draft',
+            'running': 'sent',
+            'done': 'paid',
+            'failed': 'overdue'
+        }
+        return format_html('<span class="status-badge {}">{}</span>', 
+                          status_classes.get(obj.status, 'draft'), 
+                          obj.get_status_display())
+    status_colored.short_description = 'Status'
+    status_colored.admin_order_field = 'status'
+    
+    def progress_display(self, obj):
+        return format_html('{}% ({} / {})', obj.get_progress_percent(), obj.progress, obj.total)
+    progress_display.short_description = 'Progress'
+    
+    def download_link(self, obj):
+        if obj.status == 'done' and obj.result_file:
+            return format_html('<a href="{}"><i class="fas fa-download"></i> Download</a>',
+                               reverse('store:job_download', args=[obj.pk]))
+        return '-'
+    download_link.short_description = 'Result'
+
+    def get_urls(self):
+        # The request performance page sits with the other operational views, ahead of the object URLs
+        return [
+            path('performance/', self.admin_site.admin_view(self.performance_view), name='store_performance'),
+        ] + super().get_urls()
+
+    def performance_view(self, request):
+        """Slowest endpoints and worst repeated queries among this process's profiled requests"""
+        if request.method == 'POST':
+            profiling.window.reset()
+            messages.success(request, 'The profiled requests were cleared.')
+            return redirect('admin:store_performance')
+        context = {
+            **self.admin_site.each_context(request),
+            'title': 'Request performance',
+            'sample_percent': profiling.sample_rate() * 100,
+            'window_minutes': getattr(settings, 'STORE_PROFILING_WINDOW', profiling.DEFAULT_WINDOW) // 60,
+            'endpoints': profiling.window.slowest_endpoints(),
+            'duplicates': profiling.window.worst_duplicates(),
+        }
+        return TemplateResponse(request, 'admin/store/performance.html', context)
+
+
+@admin.register(InventoryMovement)
+class InventoryMovementAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'product', 'quantity_display', 'reason', 'reference')
+    list_filter = ('reason', 'created_at')
+    search_fields = ('product__sku', 'product__name', 'reference')
+    date_hierarchy = 'created_at'
+    readonly_fields = ('product', 'quantity', 'reason', 'reference', 'created_at')
+    list_per_page = 50
+    list_select_related = ('product',)
+
+    # Add Media class for custom CSS
+    class Media:
+        css = {
+            'all': ('admin/css/custom_admin.css', 'admin/css/action_fixes.css',)
+        }
+
+    def has_add_permission(self, request):
+        # The ledger is append-only and written by the stock operations themselves
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def quantity_display(self, obj):
+        color = '#28a745' if obj.quantity > 0 else '#dc3545'
+        return format_html('<span style="color: {}; font-weight: bold;">{}</span>', color, f'{obj.quantity:+d}')
+    quantity_display.short_description = 'Quantity'
+    quantity_display.admin_order_field = 'quantity'
@@ -0,0 +1,312 @@
+"""
+Read-only JSON API over the reports, products and invoices (`/api/v1/`).
+
+Every response carries a strong ETag built from the versions of the tables it reads
+(see store.cache), so a client that sends it back in If-None-Match gets a
+304 Not Modified without the query being run. The versions are kept in the
+database, so every worker gives the same data the same ETag and a write made
+through any of them changes it. Decimals are written as strings,
+exactly as stored, never through float.
+"""
+import binascii
+import datetime
+import decimal
+import functools
+import hashlib
+import hmac
+import json
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.http import Http404, HttpResponse, JsonResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import quote_etag
+from django.views.decorators.http import require_safe
+
+from . import queries
+from .cache import get_or_compute, versioned_key
+from .models import Invoice, InvoiceLineItem, Product, PurchaseOrder, PurchaseOrderLineItem
+from .pagination import KeysetPaginator, _encode, _load, keyset_fields
+from .rollups import ROLLUP_TABLES
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+API_VERSION = 'v1'
+FIELDS_VAR = 'fields'
+LIMIT_VAR = 'limit'
+CURSOR_VAR = 'cursor'
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+# Columns that exist for the database's benefit only
+EXCLUDED_FIELDS = {'search_document'}
+
+
+class ApiError(Exception):
+    """A bad request, reported to the client as a 400 with the message"""
+
+
+def _default(value):
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def dumps(data):
+    """Encode `data` as compact JSON bytes, with orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(data, default=_default)
+    return json.dumps(data, default=_default, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def _parse_int(value):
+    return int(value)
+
+
+def _parse_decimal(value):
+    amount = decimal.Decimal(value)
+    if not amount.is_finite():
+        raise ValueError
+    return amount
+
+
+@dataclass
+class Report:
+    """A report function from store.queries, the tables it reads and the query parameters it takes"""
+    func: object
+    models: tuple
+    params: dict = field(default_factory=dict)
+    defaults: dict = field(default_factory=dict)
+
+
+# The reports read the rollups, which are refreshed after the source tables change
+SALES_MODELS = (Invoice, InvoiceLineItem, *ROLLUP_TABLES['sales'])
+PURCHASE_MODELS = (PurchaseOrder, PurchaseOrderLineItem, *ROLLUP_TABLES['purchases'])
+
+REPORTS = {
+    'high-value-invoices': Report(queries.get_high_value_invoices, (Invoice,),
+                                  {'min_total_amount': _parse_decimal}),
+    'overdue-invoices': Report(queries.get_overdue_invoices, (Invoice,)),
+    'invoices-by-status': Report(queries.get_invoices_by_status_with_totals, (Invoice,)),
+    'invoice-status-summary': Report(queries.get_invoice_status_summary, (Invoice,)),
+    'product-sales': Report(queries.get_product_sales_analysis, (Product, *SALES_MODELS)),
+    'vendor-purchases': Report(queries.get_vendor_purchase_summary, PURCHASE_MODELS),
+    'profit-margins': Report(queries.get_product_profit_margin, (Product, *SALES_MODELS, *PURCHASE_MODELS)),
+    # The default year is resolved per request and is part of the ETag, so it changes at the new year
+    'monthly-sales': Report(queries.get_monthly_sales_report, SALES_MODELS, {'year': _parse_int},
+                            {'year': lambda: timezone.now().year}),
+    'low-stock-products': Report(queries.get_low_stock_products, (Product,), {'threshold': _parse_int}),
+    'customers-by-revenue': Report(queries.get_customers_by_revenue, SALES_MODELS),
+    'products-never-purchased': Report(queries.get_products_never_purchased, (Product, InvoiceLineItem)),
+}
+
+
+def _authorized(request):
+    # Staff sessions (as for the dashboard), or the bearer token BI tools use
+    if request.user.is_active and request.user.is_staff:
+        return True
+    token = getattr(settings, 'STORE_API_TOKEN', '')
+    header = request.headers.get('Authorization', '')
+    return bool(token) and hmac.compare_digest(header, f'Bearer {token}')
+
+
+def _limit(request):
+    try:
+        limit = int(request.GET.get(LIMIT_VAR, DEFAULT_LIMIT))
+    except ValueError:
+        raise ApiError(f"'{LIMIT_VAR}' must be a whole number.")
+    if not 1 <= limit <= MAX_LIMIT:
+        raise ApiError(f"'{LIMIT_VAR}' must be between 1 and {MAX_LIMIT}.")
+    return limit
+
+
+def available_fields(queryset):
+    """The names a queryset's rows can be serialized with: its columns (or values() keys) and annotations"""
+    query = queryset.query
+    if queryset._fields is not None or query.values_select:
+        return [*query.values_select, *query.annotation_select]
+    columns = [
+        model_field.attname for model_field in queryset.model._meta.concrete_fields
+        if model_field.name not in EXCLUDED_FIELDS
+    ]
+    return [*columns, *query.annotation_select]
+
+
+def selected_fields(request, available):
+    """The fields asked for with ?fields=a,b (all of them by default), in the order asked"""
+    if not request.GET.get(FIELDS_VAR):
+        return list(available)
+    names = [name.strip() for name in request.GET[FIELDS_VAR].split(',') if name.strip()]
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        raise ApiError(f"Unknown field(s): {', '.join(unknown)}. Available: {', '.join(available)}.")
+    return list(dict.fromkeys(names))
+
+
+def _stable_order(queryset):
+    """The queryset's ordering with a unique tiebreaker, so offset pages don't overlap"""
+    ordering = list(queryset.query.order_by) or list(queryset.model._meta.ordering)
+    if queryset._fields is not None or queryset.query.values_select:
+        tiebreakers = list(queryset.query.values_select)
+    else:
+        tiebreakers = ['pk']
+    return queryset.order_by(*ordering, *[name for name in tiebreakers if name not in ordering])
+
+
+def _page_url(request, cursor):
+    params = request.GET.copy()
+    params[CURSOR_VAR] = cursor
+    return request.build_absolute_uri(f'{request.path}?{params.urlencode()}')
+
+
+def _offset(cursor):
+    try:
+        mode, values = _load(cursor)
+        if mode == 'offset' and isinstance(values[0], int) and values[0] >= 0:
+            return values[0]
+    except (binascii.Error, ValueError, TypeError, IndexError, KeyError):
+        pass
+    raise ApiError(f"Invalid '{CURSOR_VAR}'.")
+
+
+def _etag(name, models, request, params=None):
+    # The same tables at the same versions, the same query and the same resolved
+    # parameters (defaults included) give the same bytes
+    query = json.dumps(sorted(request.GET.lists())).encode() + dumps(params or {})
+    key = versioned_key(f'api:{API_VERSION}:{name}', *models, extra=[hashlib.sha256(query).hexdigest()])
+    return key, hashlib.sha256(key.encode()).hexdigest()
+
+
+def _json_response(request, etag, render):
+    """A 304 when the client has `etag`, otherwise the bytes from `render()`"""
+    response = get_conditional_response(request, etag=quote_etag(etag))
+    if response is None:
+        response = HttpResponse(render(), content_type='application/json')
+    response['ETag'] = quote_etag(etag)
+    # Clients may keep the body but must revalidate it, and it differs per caller
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ['Authorization', 'Cookie'])
+    return response
+
+
+def api_view(view):
+    """Restrict a view to GET/HEAD by staff or the API token, and report ApiError as a 400"""
+    @functools.wraps(view)
+    @require_safe
+    def wrapper(request, *args, **kwargs):
+        if not _authorized(request):
+            return JsonResponse({'error': 'Log in as staff or send the API token.'}, status=401)
+        try:
+            return view(request, *args, **kwargs)
+        except ApiError as error:
+            return JsonResponse({'error': str(error)}, status=400)
+    return wrapper
+
+
+def _report_params(report, request):
+    params = {name: default() for name, default in report.defaults.items()}
+    for name, parse in report.params.items():
+        if name in request.GET:
+            try:
+                params[name] = parse(request.GET[name])
+            except (ValueError, ArithmeticError):
+                raise ApiError(f"Invalid value for '{name}'.")
+    return params
+
+
+def _report_body(request, name, report, params, limit):
+    result = report.func(**params)
+    if isinstance(result, list):
+        # Already-evaluated reports (cached by store.queries)
+        available = list(result[0]) if result else []
+        fields = selected_fields(request, available) if result else []
+        offset = _offset(request.GET[CURSOR_VAR]) if CURSOR_VAR in request.GET else 0
+        rows = result[offset:offset + limit + 1]
+        rows = [{name: row[name] for name in fields} for row in rows]
+    else:
+        fields = selected_fields(request, available_fields(result))
+        offset = _offset(request.GET[CURSOR_VAR]) if CURSOR_VAR in request.GET else 0
+        rows = list(_stable_order(result).values(*fields)[offset:offset + limit + 1])
+    more = len(rows) > limit
+    return dumps({
+        'report': name,
+        'parameters': params,
+        'next': _page_url(request, _encode('offset', [offset + limit])) if more else None,
+        'previous': _page_url(request, _encode('offset', [max(offset - limit, 0)])) if offset else None,
+        'results': rows[:limit],
+    })
+
+
+@api_view
+def report_index(request):
+    """The available reports with their URLs and parameters"""
+    etag = f'{API_VERSION}:reports'
+    return _json_response(request, etag, lambda: dumps({
+        'reports': [
+            {
+                'name': name,
+                'url': request.build_absolute_uri(f'{request.path}{name}/'),
+                'parameters': sorted(report.params),
+            }
+            for name, report in REPORTS.items()
+        ],
+    }))
+
+
+@api_view
+def report_detail(request, name):
+    """One report from store.queries, paged with ?limit= and ?cursor="""
+    report = REPORTS.get(name)
+    if report is None:
+        raise Http404(f'No report named {name!r}.')
+    params = _report_params(report, request)
+    limit = _limit(request)
+    key, etag = _etag(f'report:{name}', report.models, request, params)
+
+    def render():
+        # The body is cached under the versioned key, like the dashboard's data
+        return get_or_compute(key, lambda: _report_body(request, name, report, params, limit), ttl=None)
+    return _json_response(request, etag, render)
+
+
+def _listing(request, name, queryset):
+    """Keyset pages of a model's rows in primary key order, with ?fields=, ?limit= and ?cursor="""
+    limit = _limit(request)
+    fields = selected_fields(request, available_fields(queryset))
+    _, etag = _etag(name, [queryset.model], request)
+
+    def render():
+        ordered = queryset.order_by('pk')
+        paginator = KeysetPaginator(ordered, limit, keyset_fields(ordered))
+        page = paginator.page(request.GET.get(CURSOR_VAR))
+        return dumps({
+            'count': paginator.count,
+            'count_is_estimate': paginator.is_estimate,
+            'next': _page_url(request, page.next_cursor) if page.has_next else None,
+            'previous': _page_url(request, page.previous_cursor) if page.has_previous else None,
+            'results': list(page.object_list.values(*fields)),
+        })
+    return _json_response(request, etag, render)
+
+
+@api_view
+def product_list(request):
+    """Products, in primary key order"""
+    return _listing(request, 'products', Product.objects.all())
+
+
+@api_view
+def invoice_list(request):
+    """Invoices in primary key order, optionally filtered with ?status="""
+    invoices = Invoice.objects.all()
+    if 'status' in request.GET:
+        status = request.GET['status']
+        if status not in dict(Invoice.STATUS_CHOICES):
+            raise ApiError(f"Unknown status {status!r}.")
+        invoices = invoices.filter(status=status)
+    return _listing(request, 'invoices', invoices)
@@ -0,0 +1,265 @@
+"""
+Benchmarks for the expensive report paths
+"""
+import inspect
+import math
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib import admin
+from django.core.cache import cache
+from django.db import connection, connections
+from django.db.models import Count, DecimalField, F, QuerySet, Sum
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from . import queries
+from .exports import export_invoices_xlsx, iter_product_csv
+from .inventory import InsufficientStock, release_reservations, reserve_stock, with_retry
+from .models import Invoice, Product, PurchaseOrder, StockReservation
+from .rollups import refresh_rollups
+
+# Invoices exported per XLSX run: one admin changelist page worth of selected rows
+EXPORT_SAMPLE = 100
+# Latency differences smaller than this are treated as noise when comparing runs
+NOISE_FLOOR_MS = 1.0
+
+
+class BenchmarkError(Exception):
+    """Raised when a benchmarked page doesn't render, so a broken page isn't timed as a fast one"""
+
+
+def measure(func, *args, **kwargs):
+    """Run `func` once and return its result, query count and wall time in milliseconds"""
+    with CaptureQueriesContext(connection) as context:
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        elapsed = (time.perf_counter() - start) * 1000
+    return result, len(context.captured_queries), elapsed
+
+
+def invoice_status_summary(generator, sizes):
+    """
+    Time get_invoice_status_summary() on a cold cache as the invoice table grows.
+    Yields one row per size; the query count should not change between rows.
+    """
+    existing = Invoice.objects.count()
+    for size in sizes:
+        if size > existing:
+            generator.invoices(size - existing)
+            existing = size
+        # Drop just this report's cached value, not the whole cache other processes share
+        cache.delete(queries.invoice_status_summary_key())
+        _, query_count, elapsed = measure(queries.get_invoice_status_summary)
+        yield {'invoices': existing, 'queries': query_count, 'ms': round(elapsed, 2)}
+
+
+# The join-based aggregates the report queries used before they read the stored totals.
+# Kept only so the benchmark can compare plans and results against them.
+JOINED_AGGREGATES = {
+    'vendor_purchase_summary': lambda: PurchaseOrder.objects.values('vendor_name').annotate(
+        order_count=Count('id'),
+        total_spent=Sum(F('line_items__quantity') * F('line_items__cost_per_unit'), output_field=DecimalField())
+    ).order_by('-total_spent'),
+    'customers_by_revenue': lambda: Invoice.objects.values('customer_name', 'customer_email').annotate(
+        invoice_count=Count('id'),
+        total_spent=Sum(F('line_items__quantity') * F('line_items__price_each'), output_field=DecimalField())
+    ).order_by('-total_spent'),
+    'invoices_by_status_with_totals': lambda: Invoice.objects.values('status').annotate(
+        count=Count('id'),
+        total_amount=Sum(F('line_items__quantity') * F('line_items__price_each'), output_field=DecimalField())
+    ).order_by('status'),
+}
+
+
+def plan_cost(queryset):
+    """Return the planner's total cost estimate where the backend reports one (PostgreSQL)"""
+    if connection.vendor != 'postgresql':
+        return None
+    match = re.search(r'cost=[\d.]+\.\.([\d.]+)', queryset.explain())
+    return float(match.group(1)) if match else None
+
+
+def aggregate_fan_out(generator, sizes, lines_per_document=5):
+    """
+    Compare the join-based aggregates with the rewritten report queries.
+    Documents get several line items each, which is what made the joined counts fan out.
+    """
+    existing = Invoice.objects.count()
+    for size in sizes:
+        if size > existing:
+            generator.invoices(size - existing, lines_per_invoice=lines_per_document)
+            generator.purchase_orders((size - existing) // 10 or 1, lines_per_order=lines_per_document)
+            existing = size
+        # The reports read the rollups, which don't refresh themselves on read
+        refresh_rollups()
+        for name, joined in JOINED_AGGREGATES.items():
+            current = getattr(queries, f'get_{name}')
+            joined_rows, _, joined_ms = measure(lambda: list(joined()))
+            current_rows, query_count, current_ms = measure(lambda: list(current()))
+            yield {
+                'invoices': existing,
+                'report': name,
+                'queries': query_count,
+                'joined_ms': round(joined_ms, 2),
+                'ms': round(current_ms, 2),
+                'joined_cost': plan_cost(joined()),
+                'cost': plan_cost(current()),
+                'joined_counts_inflated': _columns(joined_rows, 'count') != _columns(current_rows, 'count'),
+                'totals_match': _columns(joined_rows, ('total_spent', 'total_amount')) == _columns(current_rows, ('total_spent', 'total_amount')),
+            }
+
+
+def _columns(rows, suffix):
+    """Sorted tuples of the row values whose keys end with `suffix`, for order-insensitive comparison"""
+    return sorted(tuple(value or 0 for key, value in row.items() if key.endswith(suffix)) for row in rows)
+
+
+def reservation_throughput(generator, sizes, workers=8, hot_products=5, basket=3):
+    """
+    Reserve stock from `workers` threads contending for a handful of hot products.
+    Each size is the number of baskets attempted; stock is set so only about half of them
+    fit, and the final stock must equal what was not reserved.
+    """
+    generator.products(hot_products)
+    product_ids = list(Product.objects.filter(sku__startswith='BENCH-').order_by('-pk').values_list('pk', flat=True)[:hot_products])
+    try:
+        for size in sizes:
+            stock = max(size * basket // (2 * hot_products), 1)
+            Product.objects.filter(pk__in=product_ids).update(stock_quantity=stock)
+            baskets = [[(generator.random.choice(product_ids), 1) for _ in range(basket)] for _ in range(size)]
+            _, query_count, _ = measure(reserve_stock, [(product_ids[0], 1)])
+
+            def attempt(items):
+                try:
+                    with_retry(reserve_stock, items)
+                    return True
+                except InsufficientStock:
+                    return False
+                finally:
+                    connections.close_all()
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                reserved = sum(pool.map(attempt, baskets))
+            elapsed = time.perf_counter() - start
+
+            reservations = StockReservation.objects.filter(product_id__in=product_ids, status='reserved')
+            held = sum(reservations.values_list('quantity', flat=True))
+            remaining = sum(Product.objects.filter(pk__in=product_ids).values_list('stock_quantity', flat=True))
+            yield {
+                'baskets': size, 'reserved': reserved, 'queries': query_count,
+                'per_sec': round(size / elapsed, 1), 'consistent': held + remaining == stock * hot_products,
+            }
+            release_reservations(reservations)
+    finally:
+        StockReservation.objects.filter(product_id__in=product_ids).delete()
+        Product.objects.filter(pk__in=product_ids).delete()
+
+
+# Runs outside the benchmark transaction: the worker threads need to see committed rows.
+reservation_throughput.transactional = False
+
+
+SCENARIOS = {
+    'status-summary': invoice_status_summary,
+    'fan-out': aggregate_fan_out,
+    'reservations': reservation_throughput,
+}
+
+
+def _evaluate(result):
+    """Fetch a lazy report result so its queries run inside the measurement"""
+    if isinstance(result, (QuerySet, list, tuple)) or inspect.isgenerator(result):
+        return list(result)
+    return result
+
+
+def _page(client, url):
+    def fetch():
+        response = client.get(url)
+        if response.status_code != 200:
+            raise BenchmarkError(f'{url} returned {response.status_code}')
+        return response
+    return fetch
+
+
+def _inline(fetch):
+    # Pool threads have their own connections: measure() wouldn't count their queries,
+    # and they can't see rows seeded in a transaction that hasn't committed
+    def fetch_inline():
+        with override_settings(STORE_DASHBOARD_WORKERS=0):
+            return fetch()
+    return fetch_inline
+
+
+def _export_invoices(layout):
+    def export():
+        export_invoices_xlsx(Invoice.objects.order_by('-invoice_date')[:EXPORT_SAMPLE], layout=layout).close()
+    return export
+
+
+def suite_targets(client):
+    """
+    Name -> callable for every report function in store.queries, the store views, each
+    store admin changelist and the exports. `client` must be logged in as a superuser.
+    """
+    targets = {}
+    for name, func in inspect.getmembers(queries, inspect.isfunction):
+        if name.startswith('get_') and func.__module__ == queries.__name__:
+            targets[f'queries.{name}'] = lambda func=func: _evaluate(func())
+    targets['views.home'] = _page(client, reverse('store:home'))
+    targets['views.dashboard'] = _inline(_page(client, reverse('store:dashboard')))
+    for model in sorted(admin.site._registry, key=lambda model: model._meta.model_name):
+        if model._meta.app_label == 'store':
+            targets[f'admin.{model._meta.model_name}'] = _page(client, reverse(f'admin:store_{model._meta.model_name}_changelist'))
+    targets['exports.product_csv'] = lambda: sum(len(line) for line in iter_product_csv(Product.objects.all()))
+    targets['exports.invoice_xlsx'] = _export_invoices('sheets')
+    targets['exports.invoice_xlsx_flat'] = _export_invoices('flat')
+    return targets
+
+
+def _percentile(values, percent):
+    """Nearest-rank percentile"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+
+def time_target(func, repeat=5):
+    """
+    Run `func` once to warm up, then `repeat` times on a cold cache; returns the
+    largest query count and the p50/p95 latency in milliseconds
+    """
+    func()
+    timings = []
+    query_counts = []
+    for _ in range(repeat):
+        cache.clear()
+        _, query_count, elapsed = measure(func)
+        timings.append(elapsed)
+        query_counts.append(query_count)
+    return {
+        'queries': max(query_counts),
+        'p50_ms': round(_percentile(timings, 50), 2),
+        'p95_ms': round(_percentile(timings, 95), 2),
+        'runs': repeat,
+    }
+
+
+def compare_results(baseline, current, threshold=0.2):
+    """
+    Return a message for each target that regressed against the baseline: any rise in
+    its query count, or a median latency more than `threshold` (a fraction) slower
+    """
+    regressions = []
+    for name, result in current.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if result['queries'] > before['queries']:
+            regressions.append(f"{name}: {before['queries']} -> {result['queries']} queries")
+        slower = result['p50_ms'] - before['p50_ms']
+        if slower > NOISE_FLOOR_MS and result['p50_ms'] > before['p50_ms'] * (1 + threshold):
+            regressions.append(f"{name}: p50 {before['p50_ms']}ms -> {result['p50_ms']}ms")
+    return regressions
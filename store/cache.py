@@ -0,0 +1,187 @@
+"""
+Stale-while-revalidate caching for expensive report computations
+"""
+import math
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+
+from django.core.cache import cache
+from django.db import OperationalError, transaction
+from django.db.models import F
+
+from .profiling import current_profile
+
+# How long a value cached under a versioned key is retained. The value never goes
+# stale, this only lets keys for superseded versions fall out of the cache.
+VERSIONED_KEY_TIMEOUT = 7 * 24 * 60 * 60
+
+
+@dataclass
+class CacheStats:
+    """Process-wide counters for the report cache"""
+    hits: int = 0
+    stale_hits: int = 0
+    misses: int = 0
+    recomputes: int = 0
+    recompute_seconds: float = 0.0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def record(self, **increments):
+        with self._lock:
+            for name, amount in increments.items():
+                setattr(self, name, getattr(self, name) + amount)
+        # Also count them against the request being profiled, if any
+        profile = current_profile()
+        if profile is not None:
+            profile.record_cache(**increments)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'recomputes': self.recomputes,
+                'recompute_seconds': round(self.recompute_seconds, 4),
+            }
+
+    def reset(self):
+        with self._lock:
+            self.hits = self.stale_hits = self.misses = self.recomputes = 0
+            self.recompute_seconds = 0.0
+
+
+stats = CacheStats()
+
+
+class StillComputing(Exception):
+    """Another caller is computing the value and it wasn't ready in time"""
+
+
+def _compute_and_store(key, compute, ttl, stale_ttl):
+    start = time.perf_counter()
+    value = compute()
+    delta = time.perf_counter() - start
+    stats.record(recomputes=1, recompute_seconds=delta)
+    if ttl is None:
+        # Versioned keys never go stale; a write changes the key instead
+        cache.set(key, {'value': value, 'expires': None, 'delta': delta}, VERSIONED_KEY_TIMEOUT)
+        return value
+    entry = {'value': value, 'expires': time.time() + ttl, 'delta': delta}
+    # Keep the entry around past its expiry so it can be served while being refreshed
+    cache.set(key, entry, ttl + stale_ttl)
+    return value
+
+
+def _should_refresh(entry, beta):
+    """
+    Probabilistic early expiration ("XFetch"): the closer the entry is to expiring
+    and the longer it took to compute, the more likely a caller refreshes it early.
+    That spreads refreshes out instead of having them all land at expiry.
+    """
+    if entry['expires'] is None:
+        return False
+    jitter = entry['delta'] * beta * -math.log(1.0 - random.random())
+    return time.time() + jitter >= entry['expires']
+
+
+def get_or_compute(key, compute, ttl=300, stale_ttl=600, beta=1.0, lock_timeout=60, wait_timeout=10, poll_interval=0.05,
+                   compute_after_wait=True):
+    """
+    Return the cached value for `key`, computing it with `compute()` when needed.
+    A `ttl` of None keeps the value until its key falls out of use, which is
+    meant for keys built with versioned_key().
+
+    Only one caller at a time recomputes a key (single flight, using an atomic
+    cache.add() lock). While it runs, other callers get the stale value. If there
+    is no stale value yet, they wait up to `wait_timeout` seconds for the result,
+    then compute it themselves (or raise StillComputing if `compute_after_wait` is false).
+    """
+    lock_key = f'{key}:lock'
+    entry = cache.get(key)
+
+    if entry is not None:
+        if not _should_refresh(entry, beta):
+            stats.record(hits=1)
+            return entry['value']
+        if cache.add(lock_key, True, lock_timeout):
+            try:
+                return _compute_and_store(key, compute, ttl, stale_ttl)
+            finally:
+                cache.delete(lock_key)
+        stats.record(stale_hits=1)
+        return entry['value']
+
+    stats.record(misses=1)
+    deadline = time.monotonic() + wait_timeout
+    while True:
+        if cache.add(lock_key, True, lock_timeout):
+            try:
+                return _compute_and_store(key, compute, ttl, stale_ttl)
+            finally:
+                cache.delete(lock_key)
+        # Another worker is computing the value; wait for it rather than piling on
+        time.sleep(poll_interval)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry['value']
+        if time.monotonic() >= deadline:
+            if not compute_after_wait:
+                raise StillComputing(key)
+            return _compute_and_store(key, compute, ttl, stale_ttl)
+
+
+def invalidate(key):
+    """Drop a cached value so the next caller recomputes it"""
+    cache.delete(key)
+
+
+def get_model_versions(*models):
+    """Return the current version number of each model, in the order given (one query)"""
+    from .models import ModelVersion
+
+    labels = [model._meta.label_lower for model in models]
+    versions = dict(ModelVersion.objects.filter(label__in=labels).values_list('label', 'version'))
+    missing = [label for label in labels if label not in versions]
+    if missing:
+        # Start from the clock rather than 1 so a recreated row can't repeat an old version
+        ModelVersion.objects.bulk_create(
+            [ModelVersion(label=label, version=time.time_ns()) for label in missing], ignore_conflicts=True
+        )
+        versions.update(ModelVersion.objects.filter(label__in=missing).values_list('label', 'version'))
+    return [versions[label] for label in labels]
+
+
+def _increment_versions(labels, using, attempts=5):
+    from .models import ModelVersion
+
+    # Runs after the write committed, in autocommit, so the row is held only for this statement
+    for attempt in range(attempts):
+        try:
+            ModelVersion.objects.db_manager(using).filter(label__in=labels).update(version=F('version') + 1)
+            return
+        except OperationalError:
+            # SQLite reports a locked table instead of waiting for it
+            if attempt == attempts - 1:
+                raise
+            time.sleep(0.01 * 2 ** attempt)
+
+
+def bump_model_version(*models, using=None):
+    """
+    Mark the data of the given models as changed, invalidating every cache key
+    built from their versions in every process. The bump happens when the
+    surrounding transaction commits, so readers can't cache uncommitted data
+    under the new version.
+    """
+    labels = sorted({model._meta.label_lower for model in models})
+    # The write has committed by then; a failed bump is logged rather than raised into its caller
+    transaction.on_commit(lambda: _increment_versions(labels, using), using=using, robust=True)
+
+
+def versioned_key(name, *models, extra=()):
+    """Build a cache key that changes whenever one of the models' versions is bumped"""
+    parts = [name, *(str(version) for version in get_model_versions(*models)), *(str(part) for part in extra)]
+    return ':'.join(parts)
@@ -0,0 +1,158 @@
+"""
+The dashboard's reports, computed concurrently.
+
+Each report is cached under its own versioned key, so a write to invoices doesn't
+throw away the vendor summary. On a cache miss the reports run side by side on a
+bounded thread pool instead of one after another. A report that fails, or doesn't
+finish within its timeout, is shown as a placeholder instead of failing the page;
+a timed-out report keeps running and fills the cache for the next page load.
+"""
+import asyncio
+import contextvars
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connections
+
+from . import queries
+from .cache import StillComputing, get_or_compute, versioned_key
+from .models import Invoice, InvoiceLineItem, Product, PurchaseOrder, PurchaseOrderLineItem
+from .rollups import ROLLUP_TABLES
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 4
+DEFAULT_TIMEOUT = 5
+
+
+@dataclass
+class DashboardReport:
+    compute: Callable
+    models: tuple
+    # Seconds to wait for the report; STORE_DASHBOARD_TIMEOUT when None
+    timeout: float = None
+
+
+# The reports read the rollups, which are refreshed after the source tables change
+SALES_MODELS = (Invoice, InvoiceLineItem, *ROLLUP_TABLES['sales'])
+PURCHASE_MODELS = (PurchaseOrder, PurchaseOrderLineItem, *ROLLUP_TABLES['purchases'])
+
+# Limit data retrieval to what's necessary
+DASHBOARD_REPORTS = {
+    'top_products': DashboardReport(lambda: list(queries.get_product_sales_analysis()[:5]), (Product, *SALES_MODELS)),
+    'vendor_summary': DashboardReport(lambda: list(queries.get_vendor_purchase_summary()[:5]), PURCHASE_MODELS),
+    'invoice_summary': DashboardReport(lambda: list(queries.get_invoice_status_summary()), (Invoice,)),
+    'top_customers': DashboardReport(lambda: list(queries.get_customers_by_revenue()[:5]), SALES_MODELS),
+    'product_margins': DashboardReport(lambda: list(queries.get_product_profit_margin()[:5]),
+                                       (Product, *SALES_MODELS, *PURCHASE_MODELS)),
+}
+
+
+@dataclass
+class Placeholder:
+    """Stands in for a report that isn't available; templates check `report.placeholder`"""
+    message: str
+    failed: bool = False
+    placeholder = True
+
+
+_executor = None
+_inline_executor = None
+_executor_lock = threading.Lock()
+
+
+def worker_count():
+    """STORE_DASHBOARD_WORKERS; 0 runs the reports one after another instead of on the pool"""
+    return getattr(settings, 'STORE_DASHBOARD_WORKERS', DEFAULT_WORKERS)
+
+
+def get_executor():
+    """The process-wide pool the reports run on, sized by STORE_DASHBOARD_WORKERS"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=worker_count(), thread_name_prefix='dashboard')
+        return _executor
+
+
+def get_inline_executor():
+    """
+    The threads reports run on one at a time when STORE_DASHBOARD_WORKERS is 0. Only one
+    is in use at a time, plus any report still finishing after its page gave up on it.
+    """
+    global _inline_executor
+    with _executor_lock:
+        if _inline_executor is None:
+            _inline_executor = ThreadPoolExecutor(thread_name_prefix='dashboard-inline')
+        return _inline_executor
+
+
+def _cached_report(name, report, timeout):
+    key = versioned_key(f'dashboard:{name}', *report.models)
+    # A report another caller is computing isn't computed twice; it's still computing
+    return get_or_compute(key, report.compute, ttl=None, wait_timeout=timeout, compute_after_wait=False)
+
+
+def _pooled_report(name, report, timeout):
+    # Runs on a pool thread, whose connections are opened and closed like a request's
+    close_old_connections()
+    try:
+        return _cached_report(name, report, timeout)
+    finally:
+        close_old_connections()
+
+
+def _shared_report(name, report, timeout, connection):
+    # Runs on a thread of its own, on the request's connection (see _run)
+    connection.inc_thread_sharing()
+    connections[DEFAULT_DB_ALIAS] = connection
+    try:
+        return _cached_report(name, report, timeout)
+    finally:
+        del connections[DEFAULT_DB_ALIAS]
+        connection.dec_thread_sharing()
+
+
+async def _run(name, report):
+    timeout = report.timeout or getattr(settings, 'STORE_DASHBOARD_TIMEOUT', DEFAULT_TIMEOUT)
+    if worker_count() == 0:
+        # Never on the request's thread itself: a report running there couldn't be given up
+        # on, so the timeout wouldn't bound the page
+        connection = await sync_to_async(lambda: connections[DEFAULT_DB_ALIAS])()
+        if connection.in_atomic_block:
+            # Only the request's connection sees its open transaction (tests, benchmarks). The
+            # request can't use it again until the report is done, so the report isn't timed out
+            call = sync_to_async(_shared_report, thread_sensitive=False, executor=get_inline_executor())(
+                name, report, timeout, connection
+            )
+            timeout = None
+        else:
+            call = sync_to_async(_pooled_report, thread_sensitive=False, executor=get_inline_executor())(
+                name, report, timeout
+            )
+    else:
+        # The pool thread runs in a copy of the request's context, so its queries count towards the request's profile
+        context = contextvars.copy_context()
+        call = asyncio.get_running_loop().run_in_executor(
+            get_executor(), context.run, _pooled_report, name, report, timeout
+        )
+    try:
+        return await asyncio.wait_for(call, timeout)
+    except (TimeoutError, StillComputing):
+        return Placeholder('Still computing. Refresh the page in a moment.')
+    except Exception:
+        logger.exception("Dashboard report %s failed", name)
+        return Placeholder("This report couldn't be computed.", failed=True)
+
+
+async def get_dashboard_reports(reports=DASHBOARD_REPORTS):
+    """Compute the reports concurrently; returns {name: rows or Placeholder}"""
+    if worker_count() == 0:
+        return {name: await _run(name, report) for name, report in reports.items()}
+    results = await asyncio.gather(*(_run(name, report) for name, report in reports.items()))
+    return dict(zip(reports, results))
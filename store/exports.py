@@ -0,0 +1,177 @@
+"""
+File exports for the admin, written to be streamed rather than built in memory
+"""
+import csv
+import re
+import tempfile
+
+import openpyxl
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, PatternFill
+from openpyxl.utils import get_column_letter
+from django.db.models import DecimalField, ExpressionWrapper, F, Prefetch
+
+from .models import InvoiceLineItem
+
+PRODUCT_CSV_HEADER = ['Name', 'SKU', 'Unit Price', 'Stock Quantity', 'Inventory Value']
+
+
+class Echo:
+    """An object that implements just the write method of the file-like interface"""
+
+    def write(self, value):
+        return value
+
+
+def product_csv_rows(queryset):
+    """
+    Product rows for the CSV export as dicts in column order, with the inventory
+    value computed by the database instead of per model instance
+    """
+    return queryset.annotate(
+        inventory_value=ExpressionWrapper(
+            F('unit_price') * F('stock_quantity'),
+            output_field=DecimalField(max_digits=20, decimal_places=2)
+        )
+    ).values('name', 'sku', 'unit_price', 'stock_quantity', 'inventory_value')
+
+
+def iter_product_csv(queryset, chunk_size=2000):
+    """Generate the product CSV line by line, fetching rows from the database in chunks"""
+    writer = csv.writer(Echo())
+    yield writer.writerow(PRODUCT_CSV_HEADER)
+    for row in product_csv_rows(queryset).iterator(chunk_size=chunk_size):
+        yield writer.writerow(row.values())
+
+
+INVOICE_LINE_HEADER = ['Product', 'SKU', 'Quantity', 'Price Each', 'Subtotal']
+INVOICE_FLAT_HEADER = [
+    'Invoice Number', 'Date', 'Due Date', 'Status', 'Customer', 'Email',
+    'Product', 'SKU', 'Quantity', 'Price Each', 'Subtotal',
+]
+# openpyxl's write-only mode keeps a temporary file open for every sheet until the
+# workbook is saved, so larger exports get the single flat sheet instead
+MAX_INVOICE_SHEETS = 500
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+INVALID_SHEET_TITLE_CHARS = re.compile(r'[\\/*?:\[\]]')
+
+
+def invoices_with_line_items(queryset):
+    """Invoices with their line items and products loaded in bulk rather than per row"""
+    return queryset.prefetch_related(
+        Prefetch('line_items', queryset=InvoiceLineItem.objects.select_related('product').order_by('pk'))
+    )
+
+
+class InvoiceWorkbook:
+    """
+    Writes invoices to an XLSX workbook in openpyxl's write-only mode, which
+    streams rows to disk instead of keeping every cell in memory
+    """
+    header_font = Font(bold=True, size=12)
+    title_font = Font(bold=True, size=16)
+    header_fill = PatternFill(start_color="DDDDDD", end_color="DDDDDD", fill_type="solid")
+
+    def __init__(self, chunk_size=500):
+        self.workbook = openpyxl.Workbook(write_only=True)
+        self.chunk_size = chunk_size
+        self._titles = set()
+
+    def _cell(self, worksheet, value, font=None, fill=None):
+        cell = WriteOnlyCell(worksheet, value=value)
+        if font:
+            cell.font = font
+        if fill:
+            cell.fill = fill
+        return cell
+
+    def _sheet_title(self, invoice):
+        # Sheet titles are limited to 31 characters and must be unique
+        base = INVALID_SHEET_TITLE_CHARS.sub('-', f"Invoice {invoice.invoice_number}")[:31]
+        title, suffix = base, 1
+        while title.lower() in self._titles:
+            suffix += 1
+            title = f"{base[:31 - len(str(suffix)) - 1]}~{suffix}"
+        self._titles.add(title.lower())
+        return title
+
+    def _label(self, worksheet, label, value):
+        return [self._cell(worksheet, label, font=self.header_font), value]
+
+    def add_invoice_sheet(self, invoice):
+        """Add a sheet with the invoice header, its line items and the total"""
+        ws = self.workbook.create_sheet(title=self._sheet_title(invoice))
+        for col in ['A', 'B', 'C', 'D', 'E']:
+            ws.column_dimensions[col].width = 20
+
+        ws.append([self._cell(ws, 'E-COMMERCE MANAGEMENT SYSTEM', font=self.title_font)])
+        ws.append([])
+        ws.append(self._label(ws, 'Invoice Number:', str(invoice.invoice_number)) + [None]
+                  + self._label(ws, 'Customer:', invoice.customer_name))
+        ws.append(self._label(ws, 'Date:', invoice.invoice_date.strftime('%Y-%m-%d')) + [None]
+                  + self._label(ws, 'Email:', invoice.customer_email))
+        ws.append(self._label(ws, 'Due Date:', invoice.due_date.strftime('%Y-%m-%d')) + [None]
+                  + self._label(ws, 'Billing Address:', invoice.billing_address.replace("\n", ", ")))
+        ws.append(self._label(ws, 'Status:', invoice.get_status_display()))
+        ws.append([])
+        ws.append([self._cell(ws, header, font=self.header_font, fill=self.header_fill) for header in INVOICE_LINE_HEADER])
+
+        for item in invoice.line_items.all():
+            ws.append([item.product.name, item.product.sku, item.quantity, item.price_each, item.get_subtotal()])
+
+        ws.append([])
+        ws.append([None, None, None,
+                   self._cell(ws, 'Total:', font=self.header_font),
+                   self._cell(ws, invoice.total_amount, font=self.header_font)])
+
+    def add_invoices(self, queryset, layout='sheets'):
+        """
+        Add the invoices as one sheet each ('sheets') or as one flat sheet ('flat') and
+        return the layout used: more than MAX_INVOICE_SHEETS invoices always go flat
+        """
+        if layout != 'flat' and queryset.count() > MAX_INVOICE_SHEETS:
+            layout = 'flat'
+        if layout == 'flat':
+            self.add_flat_sheet(queryset)
+        else:
+            self.add_invoice_sheets(queryset)
+        return layout
+
+    def add_invoice_sheets(self, queryset):
+        """Add one sheet per invoice (see MAX_INVOICE_SHEETS)"""
+        for invoice in invoices_with_line_items(queryset).iterator(chunk_size=self.chunk_size):
+            self.add_invoice_sheet(invoice)
+
+    def add_flat_sheet(self, queryset):
+        """Add a single sheet with one row per line item across all invoices"""
+        ws = self.workbook.create_sheet(title='Invoices')
+        for index in range(len(INVOICE_FLAT_HEADER)):
+            ws.column_dimensions[get_column_letter(index + 1)].width = 18
+        ws.append([self._cell(ws, header, font=self.header_font, fill=self.header_fill) for header in INVOICE_FLAT_HEADER])
+        for invoice in invoices_with_line_items(queryset).iterator(chunk_size=self.chunk_size):
+            invoice_columns = [
+                str(invoice.invoice_number),
+                invoice.invoice_date.strftime('%Y-%m-%d'),
+                invoice.due_date.strftime('%Y-%m-%d'),
+                invoice.get_status_display(),
+                invoice.customer_name,
+                invoice.customer_email,
+            ]
+            for item in invoice.line_items.all():
+                ws.append(invoice_columns + [
+                    item.product.name, item.product.sku, item.quantity, item.price_each, item.get_subtotal()
+                ])
+
+    def save(self):
+        """Write the workbook to an anonymous temporary file and return it rewound"""
+        output = tempfile.TemporaryFile()
+        self.workbook.save(output)
+        output.seek(0)
+        return output
+
+
+def export_invoices_xlsx(queryset, layout='sheets'):
+    """Export invoices to XLSX, one sheet per invoice or one flat sheet, and return the temporary file"""
+    workbook = InvoiceWorkbook()
+    workbook.add_invoices(queryset, layout)
+    return workbook.save()
@@ -0,0 +1,223 @@
+"""
+Bulk product catalog import from CSV or XLSX files.
+
+Rows are streamed from the file, validated in chunks and upserted on Product.sku,
+so a catalog of any size is loaded with a few queries per chunk.
+"""
+import csv
+import io
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from .inventory import _add_stock
+from .models import InventoryMovement, Product, StoreCounter
+
+logger = logging.getLogger(__name__)
+
+IMPORT_COLUMNS = ('sku', 'name', 'description', 'unit_price', 'stock_quantity')
+REQUIRED_COLUMNS = ('sku', 'name', 'unit_price')
+ERROR_REPORT_HEADER = ['Row', 'SKU', 'Error']
+
+
+class ImportFileError(Exception):
+    """Raised when the file can't be read as a product catalog at all"""
+
+
+@dataclass
+class ImportResult:
+    rows: int = 0
+    created: int = 0
+    updated: int = 0
+    errors: list = field(default_factory=list)
+    seconds: float = 0.0
+
+    @property
+    def rows_per_second(self):
+        return round(self.rows / self.seconds, 1) if self.seconds else 0.0
+
+    def as_dict(self):
+        return {
+            'rows': self.rows, 'created': self.created, 'updated': self.updated,
+            'errors': len(self.errors), 'seconds': round(self.seconds, 2), 'rows_per_second': self.rows_per_second,
+        }
+
+
+def _normalize_header(header):
+    columns = [str(name or '').strip().lower().replace(' ', '_') for name in header]
+    missing = [name for name in REQUIRED_COLUMNS if name not in columns]
+    if missing:
+        raise ImportFileError(f"Missing required column(s): {', '.join(missing)}")
+    return columns
+
+
+def _csv_rows(file):
+    reader = csv.reader(io.TextIOWrapper(file, encoding='utf-8-sig', newline=''))
+    columns = _normalize_header(next(reader, []))
+    for number, values in enumerate(reader, 2):
+        if any(values):
+            yield number, dict(zip(columns, values))
+
+
+def _xlsx_rows(file):
+    from openpyxl import load_workbook
+
+    # Read-only mode streams the sheet instead of loading every cell into memory
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        columns = _normalize_header(next(rows, []))
+        for number, values in enumerate(rows, 2):
+            if any(value not in (None, '') for value in values):
+                yield number, dict(zip(columns, values))
+    finally:
+        workbook.close()
+
+
+def read_rows(file, filename):
+    """Yield (row number, {column: value}) pairs from a CSV or XLSX file"""
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == '.csv':
+        return _csv_rows(file)
+    if extension == '.xlsx':
+        return _xlsx_rows(file)
+    raise ImportFileError(f"Unsupported file type '{extension}'; upload a .csv or .xlsx file.")
+
+
+def _clean(values):
+    """Validate one row with the model fields' own validation; returns the cleaned values"""
+    cleaned = {}
+    errors = []
+    for name in IMPORT_COLUMNS:
+        value = values.get(name)
+        if isinstance(value, str):
+            value = value.strip()
+        if value in (None, ''):
+            if name in REQUIRED_COLUMNS:
+                errors.append(f"{name}: This field is required.")
+            continue
+        try:
+            cleaned[name] = Product._meta.get_field(name).clean(value, None)
+        except ValidationError as error:
+            errors.append(f"{name}: {' '.join(error.messages)}")
+    if errors:
+        raise ValidationError(errors)
+    return cleaned
+
+
+class ProductImporter:
+    """
+    Upserts product rows in chunks. Existing SKUs get their name, description and
+    price updated; a stock_quantity column is treated as a stock count and applied
+    to existing products as a ledger adjustment.
+    """
+    update_fields = ['name', 'unit_price', 'updated_at']
+
+    def __init__(self, chunk_size=2000, reference='Import'):
+        self.chunk_size = chunk_size
+        self.reference = reference
+
+    def run(self, rows, progress=None):
+        result = ImportResult()
+        start = time.perf_counter()
+        chunk = []
+        for number, values in rows:
+            chunk.append((number, values))
+            if len(chunk) >= self.chunk_size:
+                self._import_chunk(chunk, result)
+                chunk = []
+                if progress:
+                    progress(result)
+        if chunk:
+            self._import_chunk(chunk, result)
+        result.seconds = time.perf_counter() - start
+        if progress:
+            progress(result, done=True)
+        logger.info("Product import finished", extra={'import': result.as_dict()})
+        return result
+
+    def _import_chunk(self, chunk, result):
+        result.rows += len(chunk)
+        valid = {}
+        for number, values in chunk:
+            try:
+                cleaned = _clean(values)
+            except ValidationError as error:
+                result.errors.append((number, values.get('sku') or '', '; '.join(error.messages)))
+                continue
+            sku = cleaned['sku']
+            if sku in valid:
+                # The last occurrence of a SKU wins; Postgres refuses to upsert one row twice in a statement
+                earlier = valid[sku][0]
+                result.errors.append((earlier, sku, f"Duplicate SKU; superseded by row {number}."))
+            valid[sku] = (number, cleaned)
+        if valid:
+            # A file without a description column leaves existing descriptions alone
+            update_fields = list(self.update_fields)
+            if any('description' in values for _, values in chunk):
+                update_fields.append('description')
+            with transaction.atomic():
+                self._upsert(valid, update_fields, result)
+
+    def _upsert(self, valid, update_fields, result):
+        # Lock the existing products so the stock counts are compared against current stock
+        existing = {
+            sku: (pk, stock_quantity)
+            for pk, sku, stock_quantity in Product.objects.select_for_update().filter(sku__in=valid)
+            .order_by('pk').values_list('pk', 'sku', 'stock_quantity')
+        }
+        products = [
+            Product(
+                sku=sku, name=cleaned['name'], description=cleaned.get('description', ''), unit_price=cleaned['unit_price'],
+                stock_quantity=cleaned.get('stock_quantity', 0) if sku not in existing else existing[sku][1],
+            )
+            for sku, (number, cleaned) in valid.items()
+        ]
+        Product.objects.bulk_create(products, update_conflicts=True, unique_fields=['sku'], update_fields=update_fields)
+
+        created = [product for product in products if product.sku not in existing]
+        result.created += len(created)
+        result.updated += len(products) - len(created)
+        StoreCounter.objects.adjust(product_count=len(created))
+
+        # Stock goes through the ledger: opening balances for new products, and the
+        # difference from the counted quantity for existing ones
+        new_pks = dict(Product.objects.filter(sku__in=[product.sku for product in created]).values_list('sku', 'pk'))
+        movements = [
+            InventoryMovement(product_id=new_pks[product.sku], quantity=product.stock_quantity, reason='opening',
+                              reference=self.reference)
+            for product in created if product.stock_quantity
+        ]
+        adjustments = {}
+        for sku, (pk, stock_quantity) in existing.items():
+            counted = valid[sku][1].get('stock_quantity')
+            if counted is not None and counted != stock_quantity:
+                adjustments[pk] = counted - stock_quantity
+        if adjustments:
+            _add_stock(adjustments)
+            movements.extend(
+                InventoryMovement(product_id=pk, quantity=quantity, reason='adjustment', reference=self.reference)
+                for pk, quantity in adjustments.items()
+            )
+        InventoryMovement.objects.bulk_create(movements)
+
+
+def write_error_report(result, output):
+    """Write the rows that were not imported as CSV to a binary file object"""
+    text = io.TextIOWrapper(output, encoding='utf-8', newline='', write_through=True)
+    writer = csv.writer(text)
+    writer.writerow(ERROR_REPORT_HEADER)
+    writer.writerows(sorted(result.errors))
+    text.detach()
+    output.seek(0)
+    return output
+
+
+def import_products(file, filename, chunk_size=2000, progress=None):
+    """Import a CSV or XLSX catalog from an open binary file and return an ImportResult"""
+    importer = ProductImporter(chunk_size=chunk_size, reference=f'Import: {os.path.basename(filename)}')
+    return importer.run(read_rows(file, filename), progress=progress)
@@ -0,0 +1,156 @@
+"""
+Batch ingestion of invoices pushed by the storefront.
+
+A batch is validated up front without touching the database, then written with a
+fixed number of queries: one SKU lookup, one idempotency check, one locked stock
+update for all the products and bulk inserts for the invoices that fit, their
+reservations and their line items.
+"""
+from dataclasses import dataclass, field
+
+from django import forms
+from django.db import IntegrityError, transaction
+
+from .inventory import record_invoice_reservations, take_stock_for_invoices
+from .models import Invoice, InvoiceLineItem, Product
+
+INVOICE_FIELDS = ['invoice_number', 'customer_name', 'customer_email', 'billing_address', 'invoice_date', 'due_date', 'status', 'notes']
+MAX_BATCH_SIZE = 1000
+
+
+class InvoicePayloadForm(forms.ModelForm):
+    """Validates one invoice's fields; omitted invoice_date and status take the model defaults"""
+
+    class Meta:
+        model = Invoice
+        fields = INVOICE_FIELDS
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['invoice_number'].required = True
+        self.fields['invoice_date'].required = False
+        self.fields['status'].required = False
+
+    def validate_unique(self):
+        # Existing invoice numbers are detected for the whole batch in one query
+        pass
+
+
+class LineItemPayloadForm(forms.Form):
+    sku = forms.CharField(max_length=50)
+    quantity = forms.IntegerField(min_value=1)
+    price_each = forms.DecimalField(max_digits=10, decimal_places=2, min_value=0, required=False,
+                                    help_text="Defaults to the product's unit price")
+
+
+@dataclass
+class IngestResult:
+    created: list = field(default_factory=list)
+    existing: list = field(default_factory=list)
+    errors: dict = field(default_factory=dict)
+
+    def as_dict(self):
+        return {'created': self.created, 'existing': self.existing, 'errors': self.errors}
+
+
+def _validate(record):
+    """Return (unsaved invoice, [line item fields], {field: [errors]}) for a payload record"""
+    if not isinstance(record, dict):
+        return None, [], {'__all__': ["Each invoice must be an object."]}
+    form = InvoicePayloadForm(record)
+    errors = {} if form.is_valid() else {name: list(messages) for name, messages in form.errors.items()}
+    line_items = record.get('line_items')
+    if not isinstance(line_items, list) or not line_items:
+        errors['line_items'] = ["At least one line item is required."]
+        line_items = []
+    lines = []
+    for position, line in enumerate(line_items):
+        line_form = LineItemPayloadForm(line if isinstance(line, dict) else {})
+        if line_form.is_valid():
+            lines.append(line_form.cleaned_data)
+        else:
+            for name, messages in line_form.errors.items():
+                errors[f'line_items[{position}].{name}'] = list(messages)
+    return form.instance, lines, errors
+
+
+def ingest_invoices(records):
+    """
+    Create invoices with their line items from a list of payload records, reserving
+    their stock. Invoices whose number already exists are skipped, so a batch can be
+    retried safely. Returns an IngestResult; invalid records, unknown SKUs and
+    invoices without enough stock are reported in its errors, keyed by invoice
+    number (or position when the number is missing), and the rest are still created.
+    """
+    result = IngestResult()
+    valid = {}
+    for position, record in enumerate(records):
+        invoice, lines, errors = _validate(record)
+        if errors:
+            number = record.get('invoice_number') if isinstance(record, dict) else None
+            result.errors[str(number or f'#{position}')] = errors
+            continue
+        number = invoice.invoice_number
+        if number in valid:
+            result.errors[number] = {'invoice_number': ["Duplicate invoice number in this batch."]}
+            continue
+        valid[number] = (invoice, lines)
+
+    skus = {line['sku'] for _, lines in valid.values() for line in lines}
+    products = {sku: (pk, unit_price) for pk, sku, unit_price in Product.objects.filter(sku__in=skus).values_list('pk', 'sku', 'unit_price')}
+    for number, (_, lines) in list(valid.items()):
+        unknown = sorted({line['sku'] for line in lines} - set(products))
+        if unknown:
+            result.errors[number] = {'line_items': [f"Unknown SKU(s): {', '.join(unknown)}"]}
+            del valid[number]
+
+    for attempt in range(2):
+        try:
+            with transaction.atomic():
+                created, existing, errors = _write(valid, products)
+            break
+        except IntegrityError:
+            # Another request inserted one of these invoice numbers between the check and the
+            # insert; the savepoint rolled the batch back, so retry it once against the committed rows
+            if attempt:
+                raise
+            for invoice, _ in valid.values():
+                invoice.pk = None
+    result.created, result.existing = created, existing
+    result.errors.update(errors)
+    return result
+
+
+def _write(valid, products):
+    """Write the valid invoices that aren't stored yet; returns (created, existing, stock errors)"""
+    existing = set(Invoice.objects.filter(invoice_number__in=valid).values_list('invoice_number', flat=True))
+    pending = [record for number, record in valid.items() if number not in existing]
+    if not pending:
+        return [], sorted(existing), {}
+
+    # Take the stock first so only the invoices that fit are inserted
+    demands = [(invoice, [(products[line['sku']][0], line['quantity']) for line in lines]) for invoice, lines in pending]
+    shortages = take_stock_for_invoices(demands)
+    errors = {}
+    if shortages:
+        sku_by_pk = {pk: sku for sku, (pk, _) in products.items()}
+        for index, short in shortages.items():
+            errors[pending[index][0].invoice_number] = {
+                'line_items': [f"Insufficient stock for SKU(s): {', '.join(sorted(sku_by_pk[pk] for pk in short))}"]
+            }
+        pending = [record for index, record in enumerate(pending) if index not in shortages]
+        demands = [demand for index, demand in enumerate(demands) if index not in shortages]
+    if not pending:
+        return [], sorted(existing), errors
+
+    Invoice.objects.bulk_create([invoice for invoice, _ in pending])
+    record_invoice_reservations(demands)
+    InvoiceLineItem.objects.bulk_create([
+        InvoiceLineItem(
+            invoice=invoice, product_id=products[line['sku']][0], quantity=line['quantity'],
+            price_each=line['price_each'] if line['price_each'] is not None else products[line['sku']][1],
+        )
+        for invoice, lines in pending
+        for line in lines
+    ])
+    return [invoice.invoice_number for invoice, _ in pending], sorted(existing), errors
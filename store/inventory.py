@@ -0,0 +1,381 @@
+"""
+Stock movements: receiving purchase orders into inventory, reserving stock for invoices
+and the inventory ledger behind point-in-time stock queries
+"""
+import random
+import time
+from collections import defaultdict
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import OperationalError, transaction
+from django.db.models import Exists, F, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import (
+    InventoryMovement,
+    InventorySnapshot,
+    Product,
+    PurchaseOrder,
+    PurchaseOrderLineItem,
+    StockReservation,
+)
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+class ReceivingError(Exception):
+    """Raised when a receipt doesn't fit the outstanding quantity of a line item"""
+
+
+class InsufficientStock(Exception):
+    """Raised when a reservation asks for more stock than is available"""
+
+    def __init__(self, shortages):
+        self.shortages = shortages
+        super().__init__(
+            "Insufficient stock for product(s): " + ", ".join(str(product_id) for product_id in sorted(shortages))
+        )
+
+
+def _add_stock(quantities):
+    """
+    Add stock for several products in one statement. Products are locked in
+    primary key order so concurrent receipts can't deadlock, and the increment
+    is an F() expression so concurrent writers can't overwrite each other.
+    """
+    products = list(
+        Product.objects.select_for_update().filter(pk__in=quantities).order_by('pk').only('pk')
+    )
+    for product in products:
+        product.stock_quantity = F('stock_quantity') + quantities[product.pk]
+    Product.objects.bulk_update(products, ['stock_quantity'])
+
+
+@transaction.atomic
+def receive_line_items(quantities):
+    """
+    Receive purchase order line items into stock.
+
+    `quantities` maps line item ids to the quantity received, or to None to
+    receive everything still outstanding on that line. Returns a dict of the
+    quantity added per product id. Purchase orders whose lines are all received
+    are marked as received.
+    """
+    # Lock the line items (in a fixed order) first so a line can't be received twice concurrently
+    lines = list(
+        PurchaseOrderLineItem.objects.select_for_update()
+        .filter(pk__in=quantities)
+        .select_related('purchase_order')
+        .order_by('pk')
+    )
+    missing = set(quantities) - {line.pk for line in lines}
+    if missing:
+        raise ReceivingError(f"Unknown purchase order line items: {sorted(missing)}")
+
+    received = defaultdict(int)
+    changed = []
+    movements = []
+    for line in lines:
+        if line.purchase_order.status == 'cancelled':
+            raise ReceivingError(f"{line.purchase_order} is cancelled.")
+        outstanding = line.quantity - line.received_quantity
+        quantity = outstanding if quantities[line.pk] is None else quantities[line.pk]
+        if quantity < 0 or quantity > outstanding:
+            raise ReceivingError(
+                f"Cannot receive {quantity} of {line.product_id} on {line.purchase_order}; {outstanding} outstanding."
+            )
+        if quantity:
+            line.received_quantity += quantity
+            received[line.product_id] += quantity
+            changed.append(line)
+            movements.append(InventoryMovement(
+                product_id=line.product_id, quantity=quantity, reason='receipt',
+                reference=f'PO #{line.purchase_order.order_number}',
+            ))
+
+    if not changed:
+        return {}
+
+    _add_stock(received)
+    PurchaseOrderLineItem.objects.bulk_update(changed, ['received_quantity'])
+    InventoryMovement.objects.bulk_create(movements)
+
+    outstanding_lines = PurchaseOrderLineItem.objects.filter(
+        purchase_order=OuterRef('pk'), received_quantity__lt=F('quantity')
+    )
+    PurchaseOrder.objects.filter(
+        pk__in={line.purchase_order_id for line in changed}
+    ).exclude(status='received').filter(~Exists(outstanding_lines)).update(status='received')
+
+    return dict(received)
+
+
+def receive_purchase_orders(orders):
+    """Receive every outstanding line item of the given purchase orders"""
+    line_ids = PurchaseOrderLineItem.objects.filter(
+        purchase_order__in=orders, received_quantity__lt=F('quantity')
+    ).exclude(purchase_order__status='cancelled').values_list('pk', flat=True)
+    return receive_line_items({line_id: None for line_id in line_ids})
+
+
+def with_retry(func, *args, attempts=5, base_delay=0.02, **kwargs):
+    """
+    Call `func`, retrying with jittered exponential backoff when the database reports
+    contention (a lock timeout, deadlock or serialization failure). Only useful
+    outside an enclosing transaction, since a failed statement aborts it.
+    """
+    for attempt in range(attempts):
+        try:
+            return func(*args, **kwargs)
+        except OperationalError:
+            if attempt == attempts - 1:
+                raise
+            time.sleep(base_delay * (2 ** attempt) * (0.5 + random.random()))
+
+
+def _demand(items):
+    """Sum (product_id, quantity) pairs per product, in primary key order"""
+    demand = defaultdict(int)
+    for product_id, quantity in items:
+        if quantity < 0:
+            raise ValueError("Reserved quantities must not be negative.")
+        if quantity:
+            demand[product_id] += quantity
+    return dict(sorted(demand.items()))
+
+
+@transaction.atomic
+def reserve_stock(items, invoice=None):
+    """
+    Reserve stock for (product_id, quantity) pairs, all or nothing.
+
+    Each product is decremented with a conditional UPDATE ... WHERE stock_quantity >= n,
+    so stock never goes negative and there is no read-modify-write to race on.
+    Products are updated in primary key order to avoid deadlocks between batches.
+    Raises InsufficientStock, rolling back the whole batch, if any product falls short.
+    """
+    demand = _demand(items)
+    shortages = {}
+    for product_id, quantity in demand.items():
+        updated = Product.objects.filter(pk=product_id, stock_quantity__gte=quantity).update(
+            stock_quantity=F('stock_quantity') - quantity
+        )
+        if not updated:
+            shortages[product_id] = quantity
+    if shortages:
+        raise InsufficientStock(shortages)
+    reference = f'Invoice #{invoice.invoice_number}' if invoice is not None else ''
+    InventoryMovement.objects.bulk_create([
+        InventoryMovement(product_id=product_id, quantity=-quantity, reason='reservation', reference=reference)
+        for product_id, quantity in demand.items()
+    ])
+    return StockReservation.objects.bulk_create([
+        StockReservation(product_id=product_id, invoice=invoice, quantity=quantity)
+        for product_id, quantity in demand.items()
+    ])
+
+
+
+def take_stock_for_invoices(demands):
+    """
+    Take the stock for a batch of invoices inside the caller's transaction, before
+    the invoices are saved; record_invoice_reservations() then records it once they are.
+
+    `demands` is a list of (invoice, items) pairs with items as (product_id, quantity)
+    pairs. All the products involved are locked once, in primary key order, and the
+    invoices are served in list order: an invoice that doesn't fit in the remaining
+    stock takes nothing. Returns {index: shortages} for the invoices that didn't fit.
+    Cancelled invoices take nothing.
+    """
+    product_ids = {product_id for _, items in demands for product_id, _ in items}
+    available = dict(
+        Product.objects.select_for_update().filter(pk__in=product_ids).order_by('pk').values_list('pk', 'stock_quantity')
+    )
+
+    taken = defaultdict(int)
+    shortages = {}
+    for index, (invoice, items) in enumerate(demands):
+        if invoice.status == 'cancelled':
+            continue
+        demand = _demand(items)
+        short = {
+            product_id: quantity for product_id, quantity in demand.items()
+            if quantity > available.get(product_id, 0) - taken[product_id]
+        }
+        if short:
+            shortages[index] = short
+            continue
+        for product_id, quantity in demand.items():
+            taken[product_id] += quantity
+
+    if taken:
+        _add_stock({product_id: -quantity for product_id, quantity in taken.items()})
+    return shortages
+
+
+def record_invoice_reservations(demands):
+    """
+    Record the reservations and ledger movements for stock taken by take_stock_for_invoices(),
+    now that the invoices are saved. `demands` are the (invoice, items) pairs that fit.
+    Paid invoices get committed reservations.
+    """
+    reservations = []
+    movements = []
+    for invoice, items in demands:
+        if invoice.status == 'cancelled':
+            continue
+        status = 'committed' if invoice.status == 'paid' else 'reserved'
+        for product_id, quantity in _demand(items).items():
+            reservations.append(StockReservation(product_id=product_id, invoice=invoice, quantity=quantity, status=status))
+            movements.append(InventoryMovement(
+                product_id=product_id, quantity=-quantity, reason='reservation', reference=f'Invoice #{invoice.invoice_number}'
+            ))
+    StockReservation.objects.bulk_create(reservations)
+    InventoryMovement.objects.bulk_create(movements)
+
+
+@transaction.atomic
+def commit_reservations(reservations):
+    """Mark reservations as final (the invoice was paid); the stock was already taken when reserving"""
+    return StockReservation.objects.filter(
+        pk__in=[getattr(reservation, 'pk', reservation) for reservation in reservations], status='reserved'
+    ).update(status='committed', updated_at=timezone.now())
+
+
+@transaction.atomic
+def release_reservations(reservations):
+    """Return the stock of open reservations; committed and already released ones are left alone"""
+    # Lock the reservations so concurrent releases can't return the same stock twice
+    open_reservations = list(
+        StockReservation.objects.select_for_update(of=('self',))
+        .select_related('invoice')
+        .filter(pk__in=[getattr(reservation, 'pk', reservation) for reservation in reservations], status='reserved')
+        .order_by('pk')
+    )
+    released = StockReservation.objects.filter(
+        pk__in=[reservation.pk for reservation in open_reservations], status='reserved'
+    ).update(status='released', updated_at=timezone.now())
+    returned = defaultdict(int)
+    for reservation in open_reservations:
+        returned[reservation.product_id] += reservation.quantity
+    if returned:
+        _add_stock(returned)
+        InventoryMovement.objects.bulk_create([
+            InventoryMovement(
+                product_id=reservation.product_id, quantity=reservation.quantity, reason='release',
+                reference=f'Invoice #{reservation.invoice.invoice_number}' if reservation.invoice else '',
+            )
+            for reservation in open_reservations
+        ])
+    return released
+
+
+@transaction.atomic
+def adjust_stock(product_id, quantity, reference=''):
+    """
+    Apply a manual stock correction of `quantity` (negative to remove stock) and
+    record it in the ledger. The change is applied as a delta, so it can't overwrite
+    stock taken by concurrent reservations. Raises InsufficientStock if it would
+    leave the product with negative stock.
+    """
+    if not quantity:
+        return
+    updated = Product.objects.filter(pk=product_id, stock_quantity__gte=-quantity).update(
+        stock_quantity=F('stock_quantity') + quantity
+    )
+    if not updated:
+        raise InsufficientStock({product_id: -quantity})
+    InventoryMovement.objects.create(product_id=product_id, quantity=quantity, reason='adjustment', reference=reference)
+
+
+def stock_as_of(when, products=None):
+    """
+    Return {product_id: stock} at the moment `when`, for all products or the given ones.
+
+    Each product's stock is its latest snapshot taken at or before `when` plus the
+    movements recorded between the snapshot and `when`, so the scan is bounded by the
+    snapshot interval. Once movements have been compacted, times before the
+    compaction cutoff resolve to the nearest earlier snapshot.
+    """
+    snapshots = InventorySnapshot.objects.filter(product=OuterRef('pk'), taken_at__lte=when).order_by('-taken_at')
+    queryset = Product.objects.filter(created_at__lte=when) if products is None else Product.objects.filter(pk__in=products)
+    queryset = queryset.order_by().annotate(
+        _snapshot_quantity=Coalesce(Subquery(snapshots.values('quantity')[:1]), Value(0)),
+        _snapshot_at=Coalesce(Subquery(snapshots.values('taken_at')[:1]), Value(EPOCH)),
+    )
+    movements = InventoryMovement.objects.filter(
+        product=OuterRef('pk'), created_at__gt=OuterRef('_snapshot_at'), created_at__lte=when
+    ).order_by().values('product').annotate(total=Sum('quantity')).values('total')
+    queryset = queryset.annotate(
+        _stock=F('_snapshot_quantity') + Coalesce(Subquery(movements, output_field=IntegerField()), Value(0))
+    )
+    return dict(queryset.values_list('pk', '_stock'))
+
+
+def take_snapshots(taken_at=None, batch_size=5000):
+    """Record every product's current stock as a snapshot and return how many were written"""
+    taken_at = taken_at or timezone.now()
+    products = Product.objects.order_by('pk').values_list('pk', 'stock_quantity')
+    snapshots = InventorySnapshot.objects.bulk_create(
+        (InventorySnapshot(product_id=pk, quantity=quantity, taken_at=taken_at) for pk, quantity in products.iterator()),
+        batch_size=batch_size,
+    )
+    return len(snapshots)
+
+
+@transaction.atomic
+def compact_movements(before, batch_size=5000):
+    """
+    Fold the movements recorded up to `before` into a snapshot at `before` for every
+    product that has any, then delete them. Returns (snapshots written, movements deleted).
+    """
+    product_ids = InventoryMovement.objects.filter(created_at__lte=before).values_list('product', flat=True).distinct()
+    stock = stock_as_of(before, products=product_ids)
+    InventorySnapshot.objects.filter(product__in=list(stock), taken_at=before).delete()
+    InventorySnapshot.objects.bulk_create(
+        [InventorySnapshot(product_id=pk, quantity=quantity, taken_at=before) for pk, quantity in stock.items()],
+        batch_size=batch_size,
+    )
+    deleted, _ = InventoryMovement.objects.filter(created_at__lte=before).delete()
+    return len(stock), deleted
+
+
+@transaction.atomic
+def sync_invoice_reservations(invoice):
+    """
+    Bring an invoice's reservations in line with its line items and status: reserve
+    what the line items need beyond the current reservations, release what they no
+    longer need, commit on payment and release everything on cancellation.
+
+    Saving an invoice or its line items doesn't reserve stock by itself. The admin,
+    the ingest API (take_stock_for_invoices) and status transitions do; any other
+    code that creates or edits invoices must call this in the same transaction.
+    """
+    open_reservations = StockReservation.objects.filter(invoice=invoice, status='reserved')
+    if invoice.status == 'cancelled':
+        return release_reservations(open_reservations)
+
+    needed = dict(invoice.line_items.values('product').annotate(total=Sum('quantity')).values_list('product', 'total'))
+    held = dict(
+        StockReservation.objects.filter(invoice=invoice, status__in=['reserved', 'committed'])
+        .values('product').annotate(total=Sum('quantity')).values_list('product', 'total')
+    )
+
+    # Products whose line items shrank or disappeared: release their open reservations
+    # and reserve the new requirement again from scratch
+    shrunk = [product_id for product_id, quantity in held.items() if quantity > needed.get(product_id, 0)]
+    if shrunk:
+        release_reservations(open_reservations.filter(product__in=shrunk))
+        held = dict(
+            StockReservation.objects.filter(invoice=invoice, status__in=['reserved', 'committed'])
+            .values('product').annotate(total=Sum('quantity')).values_list('product', 'total')
+        )
+
+    reserve_stock(
+        [(product_id, quantity - held.get(product_id, 0)) for product_id, quantity in needed.items()
+         if quantity > held.get(product_id, 0)],
+        invoice=invoice,
+    )
+    if invoice.status == 'paid':
+        commit_reservations(open_reservations.all())
@@ -0,0 +1,259 @@
+"""
+A small database-backed job queue for long-running exports and reports.
+Jobs are enqueued by the admin and executed by `manage.py run_jobs`.
+"""
+import json
+import logging
+import tempfile
+import threading
+import time
+import traceback
+from dataclasses import dataclass
+from datetime import timedelta
+
+from django.contrib.admin.helpers import ACTION_CHECKBOX_NAME
+from django.contrib.auth.models import AnonymousUser
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DatabaseError, connection, transaction
+from django.db.models import F
+from django.http import HttpRequest, QueryDict
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+# Seconds between a running job's heartbeats; a job that misses several is assumed to have lost its worker
+HEARTBEAT_INTERVAL = 30
+STALE_AFTER = 5 * HEARTBEAT_INTERVAL
+# A job whose worker died this many times is failed rather than queued again
+MAX_ATTEMPTS = 3
+
+
+@dataclass
+class JobHandler:
+    func: object
+    description: str
+
+
+HANDLERS = {}
+
+
+def job_handler(kind, description):
+    """Register a function as the handler for a job kind"""
+    def decorator(func):
+        HANDLERS[kind] = JobHandler(func=func, description=description)
+        return func
+    return decorator
+
+
+def enqueue(kind, params=None, user=None):
+    """Queue a job and return it; a worker picks it up on its next poll"""
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    return Job.objects.create(kind=kind, params=params or {}, created_by=user)
+
+
+def requeue_stale_jobs():
+    """
+    Queue running jobs whose worker stopped sending heartbeats (it was killed, or its
+    machine went away) again, or fail them once they've used up their attempts.
+    Returns how many were queued again.
+    """
+    stale = Job.objects.filter(status='running', heartbeat_at__lt=timezone.now() - timedelta(seconds=STALE_AFTER))
+    stale.filter(attempts__gte=MAX_ATTEMPTS).update(
+        status='failed', error='The worker running the job stopped responding.', finished_at=timezone.now()
+    )
+    return stale.update(status='queued', started_at=None, heartbeat_at=None, progress=0)
+
+
+def claim_next_job():
+    """
+    Atomically move the oldest queued job to running and return it, or None.
+    The conditional UPDATE makes sure two workers never claim the same job.
+    """
+    requeue_stale_jobs()
+    with transaction.atomic():
+        candidates = Job.objects.filter(status='queued').order_by('created_at', 'pk')
+        if connection.features.has_select_for_update_skip_locked:
+            candidates = candidates.select_for_update(skip_locked=True)
+        for job_id in candidates.values_list('pk', flat=True)[:5]:
+            now = timezone.now()
+            claimed = Job.objects.filter(pk=job_id, status='queued').update(
+                status='running', started_at=now, heartbeat_at=now, attempts=F('attempts') + 1
+            )
+            if claimed:
+                return Job.objects.get(pk=job_id)
+    return None
+
+
+class JobProgress:
+    """Progress reporter handed to job handlers; writes are throttled to one per interval"""
+
+    def __init__(self, job, interval=1.0):
+        self.job = job
+        self.interval = interval
+        self._last_write = 0.0
+
+    def __call__(self, progress, total=None, force=False):
+        now = time.monotonic()
+        if not force and now - self._last_write < self.interval:
+            return
+        self._last_write = now
+        fields = {'progress': progress}
+        if total is not None:
+            fields['total'] = total
+        Job.objects.filter(pk=self.job.pk).update(**fields)
+
+
+class Heartbeat(threading.Thread):
+    """Stamps a running job every `interval` seconds, on its own connection, until stopped"""
+
+    def __init__(self, job_id, interval=HEARTBEAT_INTERVAL):
+        super().__init__(name=f'job-{job_id}-heartbeat', daemon=True)
+        self.job_id = job_id
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        try:
+            while not self.stopped.wait(self.interval):
+                try:
+                    Job.objects.filter(pk=self.job_id, status='running').update(heartbeat_at=timezone.now())
+                except DatabaseError:
+                    # A missed beat is harmless; several in a row are what mark the job stale
+                    logger.warning("Heartbeat of job %s failed", self.job_id, exc_info=True)
+        finally:
+            connection.close()
+
+
+def run_job(job_id):
+    """Execute a claimed job; runs inside a worker process"""
+    job = Job.objects.get(pk=job_id)
+    progress = JobProgress(job)
+    heartbeat = Heartbeat(job.pk)
+    heartbeat.start()
+    try:
+        filename, output = HANDLERS[job.kind].func(job, progress)
+        with output:
+            job.result_file.save(filename, File(output, name=filename), save=False)
+        job.status = 'done'
+    except Exception:
+        logger.exception("Job %s (%s) failed", job.pk, job.kind)
+        job.status = 'failed'
+        job.error = traceback.format_exc()
+    finally:
+        heartbeat.stopped.set()
+        heartbeat.join()
+    job.refresh_from_db(fields=['progress', 'total'])
+    if job.status == 'done':
+        job.progress = job.total
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'error', 'summary', 'result_file', 'progress', 'finished_at'])
+    return job.status
+
+
+def selection_params(request, model):
+    """
+    Job params that select the rows of an admin action again in the worker: the
+    changelist's query string (filters and search), the ticked rows unless every
+    matching row was selected, and the last primary key of the table, so rows
+    added after the job was queued aren't exported
+    """
+    last_pk = model._default_manager.order_by('-pk').values_list('pk', flat=True).first()
+    params = {'changelist': request.GET.urlencode(), 'last_pk': last_pk or 0}
+    if request.POST.get('select_across') != '1':
+        params['pks'] = request.POST.getlist(ACTION_CHECKBOX_NAME)
+    return params
+
+
+def _selected(model, job):
+    """The rows a job was enqueued for, in primary key order"""
+    from django.contrib import admin
+
+    # Rebuild the changelist the action ran on, so its filters and search are applied the same way
+    request = HttpRequest()
+    request.method = 'GET'
+    request.GET = QueryDict(job.params['changelist'])
+    request.user = job.created_by or AnonymousUser()
+    model_admin = admin.site._registry[model]
+    queryset = model_admin.get_changelist_instance(request).get_queryset(request)
+    if 'pks' in job.params:
+        queryset = queryset.filter(pk__in=job.params['pks'])
+    return queryset.filter(pk__lte=job.params['last_pk']).order_by('pk')
+
+
+@job_handler('export_products_csv', 'Product CSV export')
+def export_products_csv(job, progress):
+    from .exports import iter_product_csv
+    from .models import Product
+
+    queryset = _selected(Product, job)
+    total = queryset.count()
+    progress(0, total, force=True)
+    output = tempfile.TemporaryFile()
+    for count, line in enumerate(iter_product_csv(queryset)):
+        output.write(line.encode('utf-8'))
+        progress(count, total)
+    output.seek(0)
+    return f"products_{job.pk}.csv", output
+
+
+@job_handler('export_invoices_xlsx', 'Invoice XLSX export')
+def export_invoices_xlsx(job, progress):
+    from .exports import InvoiceWorkbook
+    from .models import Invoice
+
+    queryset = _selected(Invoice, job)
+    progress(0, queryset.count(), force=True)
+    workbook = InvoiceWorkbook()
+    # Large exports are written as the flat sheet whatever layout was asked for
+    job.summary = {'layout': workbook.add_invoices(queryset, job.params.get('layout', 'sheets'))}
+    return f"invoices_{job.pk}.xlsx", workbook.save()
+
+
+@job_handler('dashboard_report', 'Dashboard report')
+def dashboard_report(job, progress):
+    from . import queries
+    from .rollups import refresh_rollups
+
+    # Reports read the rollups as they are; bring them up to date with the latest writes first
+    refresh_rollups()
+
+    reports = {
+        'top_products': lambda: list(queries.get_product_sales_analysis().values('name', 'sku', 'quantity_sold', 'total_revenue')),
+        'vendor_summary': lambda: list(queries.get_vendor_purchase_summary()),
+        'invoice_summary': lambda: list(queries.get_invoice_status_summary()),
+        'top_customers': lambda: list(queries.get_customers_by_revenue()),
+        'product_margins': lambda: list(queries.get_product_profit_margin().values('name', 'sku', 'avg_purchase_price', 'avg_sales_price', 'profit_margin')),
+    }
+    progress(0, len(reports), force=True)
+    data = {'generated_at': timezone.now()}
+    for done, (name, report) in enumerate(reports.items(), 1):
+        data[name] = report()
+        progress(done, force=True)
+    output = tempfile.TemporaryFile()
+    output.write(json.dumps(data, cls=DjangoJSONEncoder, indent=2).encode('utf-8'))
+    output.seek(0)
+    return f"dashboard_{job.pk}.json", output
+
+
+@job_handler('import_products', 'Product catalog import')
+def import_product_catalog(job, progress):
+    from .imports import import_products, write_error_report
+
+    path = job.params['path']
+
+    def report(result, done=False):
+        # The row count of the file isn't known up front, so progress counts rows read
+        progress(result.rows, result.rows, force=done)
+
+    try:
+        with default_storage.open(path, 'rb') as upload:
+            result = import_products(upload, job.params.get('filename', path), progress=report)
+    finally:
+        default_storage.delete(path)
+    job.summary = result.as_dict()
+    return f"import_errors_{job.pk}.csv", write_error_report(result, tempfile.TemporaryFile())
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from store.benchmarks import SCENARIOS
+from store.seeding import DataGenerator
+
+
+class Rollback(Exception):
+    """Raised to discard the seeded benchmark data"""
+
+
+class Command(BaseCommand):
+    help = 'Seed data and benchmark the report queries at increasing volumes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenario', choices=sorted(SCENARIOS))
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000, 1000000],
+                            help='Row counts to benchmark at, in increasing order')
+        parser.add_argument('--seed', type=int, default=42, help='Seed for the data generator')
+        parser.add_argument('--keep-data', action='store_true', help='Commit the seeded rows instead of rolling back')
+
+    def handle(self, *args, **options):
+        sizes = sorted(options['sizes'])
+        if sizes[0] < 1:
+            raise CommandError('--sizes must be positive integers.')
+
+        scenario = SCENARIOS[options['scenario']]
+        generator = DataGenerator(seed=options['seed'])
+        rows = []
+        if not getattr(scenario, 'transactional', True):
+            # The scenario commits its own rows and removes them when it finishes.
+            self._run(scenario, generator, sizes, rows)
+        else:
+            try:
+                with transaction.atomic():
+                    self._run(scenario, generator, sizes, rows)
+                    if not options['keep_data']:
+                        raise Rollback
+            except Rollback:
+                pass
+
+        query_counts = {row['queries'] for row in rows}
+        if len(query_counts) == 1:
+            self.stdout.write(self.style.SUCCESS(f'Query count is constant ({query_counts.pop()}) across all sizes.'))
+        else:
+            self.stdout.write(self.style.WARNING(f'Query count varies with data volume: {sorted(query_counts)}'))
+
+    def _run(self, scenario, generator, sizes, rows):
+        for row in scenario(generator, sizes):
+            rows.append(row)
+            self.stdout.write('  '.join(f'{key}={value}' for key, value in row.items()))
@@ -0,0 +1,121 @@
+import json
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.utils import timezone
+
+from store.benchmarks import BenchmarkError, compare_results, suite_targets, time_target
+from store.rollups import refresh_rollups
+from store.seeding import DataGenerator
+
+from .benchmark import Rollback
+
+
+class Command(BaseCommand):
+    help = 'Seed data and record query counts and p50/p95 latency for every report, view, admin changelist and export'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=10000, help='Products to seed (default: 10000)')
+        parser.add_argument('--invoices', type=int, default=200000, help='Invoices to seed (default: 200000)')
+        parser.add_argument('--lines-per-invoice', type=int, default=5, help='Line items per seeded invoice (default: 5)')
+        parser.add_argument('--purchase-orders', type=int, default=20000, help='Purchase orders to seed (default: 20000)')
+        parser.add_argument('--seed', type=int, default=42, help='Seed for the data generator')
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs per target, after one warm-up run (default: 5)')
+        parser.add_argument('--only', action='append', metavar='TEXT', help='Only run targets whose name contains TEXT (may be repeated)')
+        parser.add_argument('--output', metavar='PATH', help='Write the results to this JSON file')
+        parser.add_argument('--compare', metavar='PATH', help='Fail if the results regress against this JSON file')
+        parser.add_argument('--threshold', type=float, default=20,
+                            help='Allowed slowdown of the median latency, in percent (default: 20)')
+        parser.add_argument('--keep-data', action='store_true', help='Commit the seeded rows instead of rolling back')
+
+    def handle(self, *args, **options):
+        counts = [options[name] for name in ('products', 'invoices', 'lines_per_invoice', 'purchase_orders')]
+        if min(counts) < 0 or options['repeat'] < 1:
+            raise CommandError('Volumes must not be negative and --repeat must be a positive integer.')
+        baseline = None
+        if options['compare']:
+            try:
+                with open(options['compare']) as file:
+                    baseline = json.load(file)
+            except (OSError, ValueError) as error:
+                raise CommandError(f"Can't read the baseline: {error}")
+
+        results = {}
+        try:
+            with transaction.atomic():
+                self._seed(DataGenerator(seed=options['seed']), options)
+                results = self._run(options)
+                if not options['keep_data']:
+                    raise Rollback
+        except Rollback:
+            pass
+
+        report = {
+            'meta': {
+                'database': connection.vendor,
+                'created_at': timezone.now().isoformat(),
+                'seed': options['seed'],
+                'products': options['products'],
+                'invoices': options['invoices'],
+                'lines_per_invoice': options['lines_per_invoice'],
+                'purchase_orders': options['purchase_orders'],
+                'repeat': options['repeat'],
+            },
+            'results': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(report, file, indent=2)
+            self.stdout.write(f'Results written to {options["output"]}.')
+
+        if baseline is not None:
+            self._compare(baseline, report, options['threshold'])
+
+    def _seed(self, generator, options):
+        self.stdout.write(
+            f"Seeding {options['products']} products, {options['invoices']} invoices "
+            f"x {options['lines_per_invoice']} lines and {options['purchase_orders']} purchase orders..."
+        )
+        generator.products(options['products'])
+        if options['invoices']:
+            generator.invoices(options['invoices'], lines_per_invoice=options['lines_per_invoice'])
+        if options['purchase_orders']:
+            generator.purchase_orders(options['purchase_orders'], lines_per_order=options['lines_per_invoice'])
+        # Bring the reporting rollups up to date here rather than in the first timed report
+        refresh_rollups()
+
+    def _run(self, options):
+        user = get_user_model().objects.filter(is_superuser=True, is_active=True).first()
+        if user is None:
+            user = get_user_model().objects.create_superuser('benchmark-admin', 'benchmark@example.com', None)
+        client = Client()
+        client.force_login(user)
+
+        results = {}
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            for name, func in suite_targets(client).items():
+                if options['only'] and not any(text in name for text in options['only']):
+                    continue
+                try:
+                    results[name] = result = time_target(func, repeat=options['repeat'])
+                except BenchmarkError as error:
+                    raise CommandError(str(error))
+                self.stdout.write(
+                    f"{name:<45} {result['queries']:>4} queries  p50 {result['p50_ms']:>9.2f}ms  p95 {result['p95_ms']:>9.2f}ms"
+                )
+        return results
+
+    def _compare(self, baseline, report, threshold):
+        volumes = ('database', 'products', 'invoices', 'lines_per_invoice', 'purchase_orders')
+        before = baseline.get('meta', {})
+        if any(before.get(key) != report['meta'][key] for key in volumes):
+            self.stdout.write(self.style.WARNING('The baseline was recorded with a different database or data volume.'))
+        regressions = compare_results(baseline.get('results', {}), report['results'], threshold=threshold / 100)
+        if regressions:
+            for message in regressions:
+                self.stdout.write(self.style.ERROR(f'  {message}'))
+            raise CommandError(f'{len(regressions)} regression(s) past the {threshold:g}% threshold.')
+        self.stdout.write(self.style.SUCCESS('No regressions against the baseline.'))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from store.plans import run_checks
+
+
+class Command(BaseCommand):
+    help = 'EXPLAIN the hot queries and fail if one is not served by the index meant for it'
+
+    def handle(self, *args, **options):
+        failed = []
+        for check, expected, plan, passed in run_checks():
+            if passed:
+                self.stdout.write(self.style.SUCCESS(f'ok    {check.label}'))
+            else:
+                failed.append(check.label)
+                wanted = ', '.join(sorted(expected)) or f'none exists on ({", ".join(check.columns)})'
+                self.stdout.write(self.style.ERROR(f'FAIL  {check.label}: expected an index from {wanted}'))
+            if not passed or options['verbosity'] >= 2:
+                for line in plan.splitlines():
+                    self.stdout.write(f'      {line}')
+        if failed:
+            raise CommandError(f'{len(failed)} of the query plans did not use their index.')
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from store.imports import ImportFileError, import_products, write_error_report
+
+
+class Command(BaseCommand):
+    help = 'Import a product catalog from a CSV or XLSX file, upserting on SKU'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or XLSX file with sku, name and unit_price columns')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Rows validated and upserted per batch (default: 2000)')
+        parser.add_argument('--errors', metavar='PATH', help='Write the rows that could not be imported to this CSV file')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        if chunk_size < 1:
+            raise CommandError('--chunk-size must be a positive integer.')
+
+        def report(result, done=False):
+            if options['verbosity'] >= 2 and not done:
+                self.stdout.write(f'  {result.rows} rows read, {len(result.errors)} errors')
+
+        try:
+            with open(options['path'], 'rb') as file:
+                result = import_products(file, options['path'], chunk_size=chunk_size, progress=report)
+        except (OSError, ImportFileError) as error:
+            raise CommandError(str(error))
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {result.rows} rows in {result.seconds:.1f}s ({result.rows_per_second} rows/s): '
+            f'{result.created} created, {result.updated} updated, {len(result.errors)} errors.'
+        ))
+        if result.errors:
+            if options['errors']:
+                with open(options['errors'], 'wb') as output:
+                    write_error_report(result, output)
+                self.stdout.write(self.style.WARNING(f'Rows that were not imported are listed in {options["errors"]}.'))
+            else:
+                for number, sku, error in sorted(result.errors)[:20]:
+                    self.stdout.write(self.style.WARNING(f'  row {number} ({sku}): {error}'))
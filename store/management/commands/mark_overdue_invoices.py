@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from store.transitions import mark_overdue_invoices, past_due_invoices
+
+
+class Command(BaseCommand):
+    help = 'Move draft and sent invoices past their due date to overdue (schedule it daily)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report how many invoices are past due')
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            self.stdout.write(f'{past_due_invoices().count()} invoices would be marked as overdue.')
+            return
+        moved = mark_overdue_invoices()
+        self.stdout.write(self.style.SUCCESS(f'Marked {moved} invoices as overdue.'))
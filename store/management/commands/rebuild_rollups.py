@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from store.rollups import ROLLUP_TABLES, rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Recompute the daily sales and purchase rollups from the invoices and purchase orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', choices=sorted(ROLLUP_TABLES), action='append',
+                            help='Only rebuild this kind of rollup (may be repeated; default: all)')
+        parser.add_argument('--days-per-batch', type=int, default=31,
+                            help='Number of days recomputed per transaction (default: 31)')
+
+    def handle(self, *args, **options):
+        days_per_batch = options['days_per_batch']
+        if days_per_batch < 1:
+            raise CommandError('--days-per-batch must be a positive integer.')
+
+        for kind in options['kind'] or sorted(ROLLUP_TABLES):
+            written = rebuild_rollups(kind, days_per_batch=days_per_batch)
+            self.stdout.write(self.style.SUCCESS(f'Rebuilt {written} {kind} rollup rows.'))
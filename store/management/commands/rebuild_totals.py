@@ -0,0 +1,86 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F, Q
+
+from store.models import Invoice, PurchaseOrder
+from store.stats import StoreStats
+
+# The models with stored totals; their querysets' total_expressions() recompute them from the line items
+TARGETS = {
+    'invoices': Invoice,
+    'purchase-orders': PurchaseOrder,
+}
+
+
+class Command(BaseCommand):
+    help = 'Rebuild and verify the stored invoice and purchase order totals in batches, then the home page counters'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of rows per batch (default: 1000)')
+        parser.add_argument('--only', choices=sorted(TARGETS), help='Limit the run to one model')
+        parser.add_argument('--verify-only', action='store_true', help='Report mismatches without rewriting totals')
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be a positive integer.')
+
+        names = [options['only']] if options['only'] else sorted(TARGETS)
+        mismatched = 0
+        for name in names:
+            model = TARGETS[name]
+            if not options['verify_only']:
+                rebuilt = self.rebuild(model, batch_size)
+                self.stdout.write(f'Rebuilt totals for {rebuilt} {name}.')
+            stale = self.verify(model, batch_size)
+            mismatched += stale
+            if stale:
+                self.stdout.write(self.style.WARNING(f'{stale} {name} have stored totals that do not match their line items.'))
+            else:
+                self.stdout.write(self.style.SUCCESS(f'All {name} totals verified.'))
+
+        if not options['verify_only'] and not options['only']:
+            StoreStats().rebuild_counters()
+            self.stdout.write('Rebuilt the home page counters.')
+
+        if mismatched and options['verify_only']:
+            raise CommandError(f'{mismatched} rows have stale totals; run without --verify-only to rebuild them.')
+
+    def _batches(self, model, batch_size):
+        """Yield primary key batches in ascending order using keyset pagination"""
+        last_pk = None
+        queryset = model._default_manager.order_by('pk').values_list('pk', flat=True)
+        while True:
+            batch = list((queryset.filter(pk__gt=last_pk) if last_pk is not None else queryset)[:batch_size])
+            if not batch:
+                return
+            yield batch
+            last_pk = batch[-1]
+
+    def rebuild(self, model, batch_size):
+        rebuilt = 0
+        for batch in self._batches(model, batch_size):
+            with transaction.atomic():
+                model._default_manager.filter(pk__in=batch).refresh_totals()
+            rebuilt += len(batch)
+            if self.verbosity >= 2:
+                self.stdout.write(f'  {model._meta.verbose_name_plural}: {rebuilt} rebuilt')
+        return rebuilt
+
+    def verify(self, model, batch_size):
+        stale = 0
+        for batch in self._batches(model, batch_size):
+            # The same expressions refresh_totals() writes, so the two can't disagree on what a total is
+            queryset = model._default_manager.filter(pk__in=batch)
+            totals = queryset.total_expressions()
+            expected = {f'expected_{field}': expression for field, expression in totals.items()}
+            mismatch = Q()
+            for field in totals:
+                mismatch |= ~Q(**{field: F(f'expected_{field}')})
+            rows = queryset.annotate(**expected).filter(mismatch)
+            for row in rows.values('pk', *totals, *expected):
+                stale += 1
+                if self.verbosity >= 2:
+                    self.stdout.write(f'  {model._meta.verbose_name} {row["pk"]}: {row}')
+        return stale
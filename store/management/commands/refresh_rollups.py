@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store.rollups import ROLLUP_TABLES, refresh_rollups
+
+
+class Command(BaseCommand):
+    help = 'Recompute the daily rollups for the days changed since the last refresh'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', choices=sorted(ROLLUP_TABLES), action='append',
+                            help='Only refresh this kind of rollup (may be repeated; default: all)')
+        parser.add_argument('--every', type=float, metavar='SECONDS',
+                            help='Keep running, refreshing every SECONDS seconds')
+
+    def handle(self, *args, **options):
+        every = options['every']
+        if every is not None and every <= 0:
+            raise CommandError('--every must be a positive number of seconds.')
+
+        kinds = options['kind'] or sorted(ROLLUP_TABLES)
+        while True:
+            days = refresh_rollups(kinds)
+            if days:
+                self.stdout.write(self.style.SUCCESS(f'Refreshed {days} changed days.'))
+            if every is None:
+                return
+            time.sleep(every)
@@ -0,0 +1,63 @@
+import multiprocessing
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from store import worker
+from store.jobs import claim_next_job
+from store.models import Job
+from store.rollups import refresh_rollups
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs (exports and reports) in a pool of worker processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2, help='Number of worker processes (default: 2)')
+        parser.add_argument('--poll-interval', type=float, default=2.0, help='Seconds between checks for new jobs')
+        parser.add_argument('--once', action='store_true', help='Exit once the queue is empty')
+        parser.add_argument('--no-rollups', action='store_true',
+                            help="Don't refresh the report rollups between jobs (run refresh_rollups separately)")
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        if workers < 1:
+            raise CommandError('--workers must be a positive integer.')
+
+        running = {}
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=worker.init_worker) as pool:
+            try:
+                while True:
+                    if not options['no_rollups']:
+                        refresh_rollups()
+                    # Only claim as many jobs as there are free workers, so queued jobs stay claimable by other runners
+                    while len(running) < workers:
+                        job = claim_next_job()
+                        if job is None:
+                            break
+                        self.stdout.write(f'Started {job}')
+                        running[pool.submit(worker.execute, job.pk)] = job
+
+                    if not running:
+                        if options['once']:
+                            return
+                        time.sleep(options['poll_interval'])
+                        continue
+
+                    done, _ = wait(running, timeout=options['poll_interval'], return_when=FIRST_COMPLETED)
+                    for future in done:
+                        job = running.pop(future)
+                        try:
+                            status = future.result()
+                        except Exception as e:
+                            # The worker process died, so the job couldn't record its own failure
+                            status = f'crashed ({e})'
+                            Job.objects.filter(pk=job.pk, status='running').update(
+                                status='failed', error=status, finished_at=timezone.now()
+                            )
+                        self.stdout.write(f'Finished job #{job.pk}: {status}')
+            except KeyboardInterrupt:
+                self.stdout.write('Stopping; waiting for running jobs to finish.')
@@ -0,0 +1,35 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from store.inventory import compact_movements, take_snapshots
+
+
+class Command(BaseCommand):
+    help = 'Snapshot every product\'s stock and optionally compact old inventory movements into snapshots'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='Number of rows per insert (default: 5000)')
+        parser.add_argument('--compact-older-than', type=int, metavar='DAYS',
+                            help='Fold movements older than DAYS days into snapshots and delete them')
+        parser.add_argument('--no-snapshot', action='store_true', help='Only compact, without taking a new snapshot')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be a positive integer.')
+
+        if not options['no_snapshot']:
+            written = take_snapshots(batch_size=batch_size)
+            self.stdout.write(self.style.SUCCESS(f'Snapshotted stock for {written} products.'))
+
+        days = options['compact_older_than']
+        if days is not None:
+            if days < 0:
+                raise CommandError('--compact-older-than must not be negative.')
+            cutoff = timezone.now() - timedelta(days=days)
+            snapshots, deleted = compact_movements(cutoff, batch_size=batch_size)
+            self.stdout.write(self.style.SUCCESS(
+                f'Compacted {deleted} movements before {cutoff:%Y-%m-%d %H:%M} into {snapshots} snapshots.'
+            ))
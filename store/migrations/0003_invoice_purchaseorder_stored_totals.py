@@ -0,0 +1,60 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:16
+
+from django.db import migrations, models
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_totals(apps, schema_editor):
+    Invoice = apps.get_model('store', 'Invoice')
+    InvoiceLineItem = apps.get_model('store', 'InvoiceLineItem')
+    PurchaseOrder = apps.get_model('store', 'PurchaseOrder')
+    PurchaseOrderLineItem = apps.get_model('store', 'PurchaseOrderLineItem')
+    db_alias = schema_editor.connection.alias
+
+    invoice_lines = InvoiceLineItem.objects.using(db_alias).filter(invoice=OuterRef('pk')).order_by().values('invoice')
+    Invoice.objects.using(db_alias).update(
+        total_amount=Coalesce(
+            Subquery(invoice_lines.annotate(
+                total=Sum(F('quantity') * F('price_each'), output_field=DecimalField())
+            ).values('total')),
+            Value(0), output_field=DecimalField(),
+        )
+    )
+
+    order_lines = PurchaseOrderLineItem.objects.using(db_alias).filter(purchase_order=OuterRef('pk')).order_by().values('purchase_order')
+    PurchaseOrder.objects.using(db_alias).update(
+        total_cost=Coalesce(
+            Subquery(order_lines.annotate(
+                total=Sum(F('quantity') * F('cost_per_unit'), output_field=DecimalField())
+            ).values('total')),
+            Value(0), output_field=DecimalField(),
+        ),
+        total_items=Coalesce(Subquery(order_lines.annotate(total=Sum('quantity')).values('total')), Value(0)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0002_alter_invoice_customer_email_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='total_amount',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=14),
+        ),
+        migrations.AddField(
+            model_name='purchaseorder',
+            name='total_cost',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=14),
+        ),
+        migrations.AddField(
+            model_name='purchaseorder',
+            name='total_items',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:20
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def seed_counters(apps, schema_editor):
+    Product = apps.get_model('store', 'Product')
+    PurchaseOrder = apps.get_model('store', 'PurchaseOrder')
+    Invoice = apps.get_model('store', 'Invoice')
+    StoreCounter = apps.get_model('store', 'StoreCounter')
+    db_alias = schema_editor.connection.alias
+
+    values = {
+        'product_count': Product.objects.using(db_alias).count(),
+        'purchase_order_count': PurchaseOrder.objects.using(db_alias).count(),
+        'invoice_count': Invoice.objects.using(db_alias).count(),
+        'total_invoice_value': Invoice.objects.using(db_alias).aggregate(total=Sum('total_amount'))['total'] or 0,
+        'total_purchase_value': PurchaseOrder.objects.using(db_alias).aggregate(total=Sum('total_cost'))['total'] or 0,
+    }
+    StoreCounter.objects.using(db_alias).bulk_create(
+        [StoreCounter(name=name, value=value) for name, value in values.items()]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0003_invoice_purchaseorder_stored_totals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoreCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('value', models.DecimalField(decimal_places=2, default=0, max_digits=18)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Store Counter',
+                'verbose_name_plural': 'Store Counters',
+            },
+        ),
+        migrations.RunPython(seed_counters, migrations.RunPython.noop),
+    ]
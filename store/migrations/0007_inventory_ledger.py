@@ -0,0 +1,61 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:30
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def snapshot_opening_stock(apps, schema_editor):
+    """Anchor the ledger: stock before this point is only known from these snapshots"""
+    Product = apps.get_model('store', 'Product')
+    InventorySnapshot = apps.get_model('store', 'InventorySnapshot')
+    db_alias = schema_editor.connection.alias
+    taken_at = django.utils.timezone.now()
+    products = Product.objects.using(db_alias).values_list('pk', 'stock_quantity').order_by('pk')
+    InventorySnapshot.objects.using(db_alias).bulk_create(
+        (InventorySnapshot(product_id=pk, quantity=quantity, taken_at=taken_at) for pk, quantity in products.iterator()),
+        batch_size=5000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0006_stockreservation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InventoryMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField()),
+                ('reason', models.CharField(choices=[('opening', 'Opening Balance'), ('receipt', 'Purchase Order Receipt'), ('reservation', 'Invoice Reservation'), ('release', 'Reservation Released'), ('adjustment', 'Manual Adjustment')], max_length=20)),
+                ('reference', models.CharField(blank=True, help_text='Purchase order, invoice or user behind the movement', max_length=100)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='movements', to='store.product')),
+            ],
+            options={
+                'verbose_name': 'Inventory Movement',
+                'verbose_name_plural': 'Inventory Movements',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['product', 'created_at'], name='store_inven_product_286bd0_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='InventorySnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField()),
+                ('taken_at', models.DateTimeField()),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='store.product')),
+            ],
+            options={
+                'verbose_name': 'Inventory Snapshot',
+                'verbose_name_plural': 'Inventory Snapshots',
+                'ordering': ['-taken_at'],
+                'unique_together': {('product', 'taken_at')},
+            },
+        ),
+        migrations.RunPython(snapshot_opening_stock, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0007_inventory_ledger'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='summary',
+            field=models.JSONField(blank=True, default=dict, help_text='Counts and timings reported by the job'),
+        ),
+    ]
@@ -0,0 +1,81 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:43
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+# Index-only scans for the per-status counts and totals of the dashboard; INCLUDE
+# columns are PostgreSQL only, and other databases read the table instead
+COVERING_INDEX = 'store_invoice_status_total_idx'
+
+
+def add_covering_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(f'CREATE INDEX IF NOT EXISTS {COVERING_INDEX} ON store_invoice (status) INCLUDE (total_amount)')
+
+
+def drop_covering_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(f'DROP INDEX IF EXISTS {COVERING_INDEX}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0011_daily_rollups'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    # The new indexes are created before the ones they replace are dropped
+    operations = [
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['status', 'invoice_date'], name='store_invoice_status_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(condition=models.Q(('status', 'queued')), fields=['created_at', 'id'], name='store_job_queued_idx'),
+        ),
+        migrations.RunPython(add_covering_index, drop_covering_index),
+        migrations.AlterField(
+            model_name='invoice',
+            name='customer_email',
+            field=models.EmailField(max_length=254),
+        ),
+        migrations.AlterField(
+            model_name='invoice',
+            name='customer_name',
+            field=models.CharField(max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='invoice',
+            name='invoice_number',
+            field=models.CharField(default=uuid.uuid4, max_length=50, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='invoice',
+            name='status',
+            field=models.CharField(choices=[('draft', 'Draft'), ('sent', 'Sent'), ('paid', 'Paid'), ('cancelled', 'Cancelled'), ('overdue', 'Overdue')], default='draft', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='invoicelineitem',
+            name='invoice',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='line_items', to='store.invoice'),
+        ),
+        migrations.AlterField(
+            model_name='job',
+            name='status',
+            field=models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='queued', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='sku',
+            field=models.CharField(help_text='Stock Keeping Unit', max_length=50, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='purchaseorderlineitem',
+            name='purchase_order',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='line_items', to='store.purchaseorder'),
+        ),
+    ]
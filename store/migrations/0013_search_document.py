@@ -0,0 +1,95 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:48
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class RunSQLOn(migrations.RunSQL):
+    """
+    RunSQL for one database vendor; the others skip it. SQLite's statements also
+    need FTS5, without which search falls back to icontains.
+    """
+
+    def __init__(self, vendor, *args, **kwargs):
+        self.vendor = vendor
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, args, kwargs = super().deconstruct()
+        return name, [self.vendor, *args], kwargs
+
+    def _applies(self, connection):
+        if connection.vendor != self.vendor:
+            return False
+        if self.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA compile_options')
+                return any(option == 'ENABLE_FTS5' for option, in cursor.fetchall())
+        return True
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if self._applies(schema_editor.connection):
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if self._applies(schema_editor.connection):
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+
+
+# The SQL store.search generated when this migration was written, frozen so later
+# changes to that module can't change what this migration does
+POSTGRES_INDEXES = [
+    """CREATE INDEX "store_{0}_search_idx" ON "store_{0}" USING gin ((to_tsvector('simple'::regconfig, COALESCE("search_document", ''))))""",
+]
+POSTGRES_INDEXES_REVERSE = [
+    'DROP INDEX IF EXISTS "store_{0}_search_idx"',
+]
+
+SQLITE_SEARCH = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS store_{0}_search USING fts5("
+    "search_document, content='store_{0}', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    'DROP TRIGGER IF EXISTS store_{0}_search_insert',
+    'DROP TRIGGER IF EXISTS store_{0}_search_delete',
+    'DROP TRIGGER IF EXISTS store_{0}_search_update',
+    'CREATE TRIGGER store_{0}_search_insert AFTER INSERT ON store_{0} BEGIN '
+    'INSERT INTO store_{0}_search(rowid, search_document) VALUES (new.id, new.search_document); END',
+    'CREATE TRIGGER store_{0}_search_delete AFTER DELETE ON store_{0} BEGIN '
+    "INSERT INTO store_{0}_search(store_{0}_search, rowid, search_document) VALUES ('delete', old.id, old.search_document); END",
+    'CREATE TRIGGER store_{0}_search_update AFTER UPDATE ON store_{0} '
+    'WHEN old.search_document IS NOT new.search_document BEGIN '
+    "INSERT INTO store_{0}_search(store_{0}_search, rowid, search_document) VALUES ('delete', old.id, old.search_document); "
+    'INSERT INTO store_{0}_search(rowid, search_document) VALUES (new.id, new.search_document); END',
+    "INSERT INTO store_{0}_search(store_{0}_search) VALUES ('rebuild')",
+]
+SQLITE_SEARCH_REVERSE = [
+    'DROP TRIGGER IF EXISTS store_{0}_search_insert',
+    'DROP TRIGGER IF EXISTS store_{0}_search_delete',
+    'DROP TRIGGER IF EXISTS store_{0}_search_update',
+    'DROP TABLE IF EXISTS store_{0}_search',
+]
+
+
+def for_tables(statements):
+    return [statement.format(model_name) for model_name in ('product', 'invoice') for statement in statements]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0012_workload_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='search_document',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.functions.text.Concat(models.F('invoice_number'), models.Value(' '), models.F('customer_name'), models.Value(' '), models.F('customer_email'), models.Value(' '), models.F('notes'), output_field=models.TextField()), output_field=models.TextField()),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='search_document',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.functions.text.Concat(models.F('sku'), models.Value(' '), models.F('name'), models.Value(' '), models.F('description'), output_field=models.TextField()), output_field=models.TextField()),
+        ),
+        RunSQLOn('postgresql', for_tables(POSTGRES_INDEXES), for_tables(POSTGRES_INDEXES_REVERSE)),
+        RunSQLOn('sqlite', for_tables(SQLITE_SEARCH), for_tables(SQLITE_SEARCH_REVERSE)),
+    ]
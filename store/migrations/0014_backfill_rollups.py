@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:10
+
+from django.db import migrations
+from django.db.models.functions import TruncDate
+
+
+def flag_existing_days(apps, schema_editor):
+    """Flag every day with invoices or purchase orders, so the next refresh builds its rollups"""
+    Invoice = apps.get_model('store', 'Invoice')
+    PurchaseOrder = apps.get_model('store', 'PurchaseOrder')
+    RollupDirtyDay = apps.get_model('store', 'RollupDirtyDay')
+    db_alias = schema_editor.connection.alias
+    for kind, model, field in [('sales', Invoice, 'invoice_date'), ('purchases', PurchaseOrder, 'order_date')]:
+        days = model.objects.using(db_alias).order_by().annotate(day=TruncDate(field)).values_list('day', flat=True).distinct()
+        RollupDirtyDay.objects.using(db_alias).bulk_create(
+            (RollupDirtyDay(kind=kind, date=day) for day in days.iterator()),
+            batch_size=5000,
+            ignore_conflicts=True,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0013_search_document'),
+    ]
+
+    operations = [
+        migrations.RunPython(flag_existing_days, migrations.RunPython.noop),
+    ]
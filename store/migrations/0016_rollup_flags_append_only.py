@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:27
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0015_model_version'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='rollupdirtyday',
+            unique_together=set(),
+        ),
+    ]
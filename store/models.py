@@ -1,18 +1,373 @@
-from django.db import models
-from django.db.models import Sum, F, DecimalField
+from django.conf import settings
+from django.db import OperationalError, models, router, transaction
+from django.db.models import Sum, F, DecimalField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Concat, TruncDate
 from django.utils import timezone
+import time
 import uuid
 
-class Product(models.Model):
+from .cache import bump_model_version
+
+
+class StoreCounterManager(models.Manager):
+    """Manager with helpers for the running totals behind the home page statistics"""
+
+    def enabled(self):
+        return getattr(settings, 'STORE_STATS_USE_COUNTERS', False)
+
+    def adjust(self, using=None, **deltas):
+        """
+        Add each delta to the named counter once the surrounding transaction commits.
+        Every writer shares these rows, so they are updated in their own short statements
+        after the write instead of staying locked until the write's transaction ends.
+        """
+        if not self.enabled():
+            return
+        deltas = {name: delta for name, delta in deltas.items() if delta}
+        if deltas:
+            using = using or router.db_for_write(self.model)
+            # The write has committed by then; a failed adjustment is logged (rebuild_totals repairs the counters)
+            transaction.on_commit(lambda: self._apply(deltas, using), using=using, robust=True)
+
+    def _apply(self, deltas, using, attempts=5):
+        for name, delta in deltas.items():
+            for attempt in range(attempts):
+                try:
+                    self.db_manager(using).filter(name=name).update(value=F('value') + delta, updated_at=timezone.now())
+                    break
+                except OperationalError:
+                    # SQLite reports a locked table instead of waiting for it
+                    if attempt == attempts - 1:
+                        raise
+                    time.sleep(0.01 * 2 ** attempt)
+
+
+def _local_day(value):
+    """The day a datetime falls on in the current time zone, as TruncDate computes it"""
+    if value is None:
+        return None
+    return timezone.localdate(value) if timezone.is_aware(value) else value.date()
+
+
+class RollupDirtyDayManager(models.Manager):
+    """Manager with a helper to flag days whose daily rollups need recomputing"""
+
+    def mark(self, kind, days, using=None):
+        days = sorted({day for day in days if day is not None})
+        if days:
+            # A plain insert of a flag per write, never an update of a shared row per day, so
+            # writers don't wait on each other. A refresh clears only the flags it saw, so the
+            # flag of a write that hasn't committed yet is left for the next one.
+            self.db_manager(using).bulk_create([self.model(kind=kind, date=day) for day in days])
+
+
+class RollupQuerySetMixin:
+    """
+    Flags the days touched by bulk writes so their daily rollups get recomputed
+    (see store.rollups). The model names its rollup kind and the datetime field
+    that decides the day.
+    """
+
+    def _mark_days(self, days):
+        RollupDirtyDay.objects.mark(self.model.rollup_kind, days, using=self.db)
+
+    def _mark_rows(self):
+        date_field = self.model.rollup_date_field
+        self._mark_days(self.order_by().annotate(_day=TruncDate(date_field)).values_list('_day', flat=True).distinct())
+
+    def update(self, **kwargs):
+        with transaction.atomic(using=self.db, savepoint=False):
+            moved = self.model.rollup_date_field in kwargs
+            pks = list(self.values_list('pk', flat=True)) if moved else None
+            self._mark_rows()
+            rows = super().update(**kwargs)
+            if moved:
+                # The rows may now be on other days (and no longer match this queryset)
+                self.model._default_manager.using(self.db).filter(pk__in=pks)._mark_rows()
+        return rows
+
+    update.alters_data = True
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        with transaction.atomic(using=self.db, savepoint=False):
+            created = super().bulk_create(objs, *args, **kwargs)
+            self._mark_days(_local_day(getattr(obj, self.model.rollup_date_field)) for obj in objs)
+        return created
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        objs = list(objs)
+        with transaction.atomic(using=self.db, savepoint=False):
+            self.filter(pk__in=[obj.pk for obj in objs])._mark_rows()
+            rows = super().bulk_update(objs, fields, *args, **kwargs)
+            if self.model.rollup_date_field in fields:
+                self._mark_days(_local_day(getattr(obj, self.model.rollup_date_field)) for obj in objs)
+        return rows
+
+
+class VersionedQuerySetMixin:
+    """Bumps the model's cache version for the bulk writes that don't send signals"""
+
+    def update(self, **kwargs):
+        rows = super().update(**kwargs)
+        if rows:
+            bump_model_version(self.model, using=self.db)
+        return rows
+
+    update.alters_data = True
+
+    def bulk_create(self, objs, *args, **kwargs):
+        created = super().bulk_create(objs, *args, **kwargs)
+        if created:
+            bump_model_version(self.model, using=self.db)
+        return created
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        rows = super().bulk_update(objs, fields, *args, **kwargs)
+        if rows:
+            bump_model_version(self.model, using=self.db)
+        return rows
+
+
+class CountedQuerySetMixin:
+    """Keeps the row counter in step for bulk inserts, which bypass the post_save signal"""
+    counter_name = None
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        created = super().bulk_create(objs, *args, **kwargs)
+        # Upserts and ignored conflicts don't say how many rows are new; callers adjust those themselves
+        if not kwargs.get('update_conflicts') and not kwargs.get('ignore_conflicts'):
+            StoreCounter.objects.adjust(using=self.db, **{self.counter_name: len(created)})
+        return created
+
+
+class ProductQuerySet(CountedQuerySetMixin, VersionedQuerySetMixin, models.QuerySet):
+    counter_name = 'product_count'
+
+
+class InvoiceQuerySet(CountedQuerySetMixin, RollupQuerySetMixin, VersionedQuerySetMixin, models.QuerySet):
+    """QuerySet for invoices with helpers for the stored totals"""
+    counter_name = 'invoice_count'
+
+    def total_expressions(self):
+        """The stored totals recomputed from the line items, as expressions by field name"""
+        line_totals = InvoiceLineItem.objects.filter(invoice=OuterRef('pk')).order_by().values('invoice').annotate(
+            total=Sum(F('quantity') * F('price_each'), output_field=DecimalField())
+        ).values('total')
+        return {'total_amount': Coalesce(Subquery(line_totals), Value(0), output_field=DecimalField())}
+
+    def refresh_totals(self):
+        """Recompute the stored total_amount of every invoice in this queryset"""
+        totals = self.total_expressions()
+        with transaction.atomic(using=self.db, savepoint=False):
+            delta = None
+            if StoreCounter.objects.enabled():
+                delta = self.aggregate(
+                    delta=Sum(totals['total_amount'] - F('total_amount'), output_field=DecimalField())
+                )['delta']
+            rows = self.update(**totals)
+            StoreCounter.objects.adjust(using=self.db, total_invoice_value=delta)
+        return rows
+
+
+class PurchaseOrderQuerySet(CountedQuerySetMixin, RollupQuerySetMixin, VersionedQuerySetMixin, models.QuerySet):
+    """QuerySet for purchase orders with helpers for the stored totals"""
+    counter_name = 'purchase_order_count'
+
+    def total_expressions(self):
+        """The stored totals recomputed from the line items, as expressions by field name"""
+        line_items = PurchaseOrderLineItem.objects.filter(purchase_order=OuterRef('pk')).order_by().values('purchase_order')
+        line_costs = line_items.annotate(
+            total=Sum(F('quantity') * F('cost_per_unit'), output_field=DecimalField())
+        ).values('total')
+        line_quantities = line_items.annotate(total=Sum('quantity')).values('total')
+        return {
+            'total_cost': Coalesce(Subquery(line_costs), Value(0), output_field=DecimalField()),
+            'total_items': Coalesce(Subquery(line_quantities), Value(0)),
+        }
+
+    def refresh_totals(self):
+        """Recompute the stored total_cost and total_items of every purchase order in this queryset"""
+        totals = self.total_expressions()
+        with transaction.atomic(using=self.db, savepoint=False):
+            delta = None
+            if StoreCounter.objects.enabled():
+                delta = self.aggregate(
+                    delta=Sum(totals['total_cost'] - F('total_cost'), output_field=DecimalField())
+                )['delta']
+            rows = self.update(**totals)
+            StoreCounter.objects.adjust(using=self.db, total_purchase_value=delta)
+        return rows
+
+
+class LineItemQuerySet(VersionedQuerySetMixin, models.QuerySet):
+    """
+    Base QuerySet for line items that keeps the parent's stored totals in sync
+    for the bulk operations which bypass Model.save()
+    """
+    # Name of the foreign key to the parent document and the fields feeding its totals
+    parent_field = None
+    total_fields = ()
+
+    def _parent_queryset(self, parent_ids):
+        parent_model = self.model._meta.get_field(self.parent_field).related_model
+        return parent_model._default_manager.using(self.db).filter(pk__in=parent_ids)
+
+    def _parent_ids(self, objs=()):
+        attname = f'{self.parent_field}_id'
+        return {getattr(obj, attname) for obj in objs if getattr(obj, attname) is not None}
+
+    def _touches_totals(self, fields):
+        return any(field in (self.parent_field, f'{self.parent_field}_id', *self.total_fields) for field in fields)
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        with transaction.atomic(using=self.db, savepoint=False):
+            created = super().bulk_create(objs, *args, **kwargs)
+            self._parent_queryset(self._parent_ids(objs)).refresh_totals()
+        return created
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        if not self._touches_totals(fields):
+            return super().bulk_update(objs, fields, *args, **kwargs)
+        objs = list(objs)
+        with transaction.atomic(using=self.db, savepoint=False):
+            # Include the previous parents so line items moved between documents are accounted for
+            parent_ids = set(self.filter(pk__in=[obj.pk for obj in objs]).values_list(self.parent_field, flat=True))
+            rows = super().bulk_update(objs, fields, *args, **kwargs)
+            self._parent_queryset(parent_ids | self._parent_ids(objs)).refresh_totals()
+        return rows
+
+    def update(self, **kwargs):
+        if not self._touches_totals(kwargs):
+            return super().update(**kwargs)
+        with transaction.atomic(using=self.db, savepoint=False):
+            parent_ids = set(self.values_list(self.parent_field, flat=True))
+            rows = super().update(**kwargs)
+            new_parent = kwargs.get(self.parent_field, kwargs.get(f'{self.parent_field}_id'))
+            if new_parent is not None:
+                parent_ids.add(getattr(new_parent, 'pk', new_parent))
+            self._parent_queryset(parent_ids).refresh_totals()
+        return rows
+
+    update.alters_data = True
+
+
+class InvoiceLineItemQuerySet(LineItemQuerySet):
+    parent_field = 'invoice'
+    # product isn't part of the totals, but refreshing them flags the day for the product rollups
+    total_fields = ('quantity', 'price_each', 'product')
+
+
+class PurchaseOrderLineItemQuerySet(LineItemQuerySet):
+    parent_field = 'purchase_order'
+    total_fields = ('quantity', 'cost_per_unit', 'product')
+
+
+def search_document(*fields):
+    """
+    A generated column joining the searched fields with spaces. The database fills it
+    on every write, bulk or not, and store.search indexes it for full-text search.
+    """
+    parts = []
+    for name in fields:
+        parts += [F(name), Value(' ')]
+    return models.GeneratedField(
+        expression=Concat(*parts[:-1], output_field=models.TextField()),
+        output_field=models.TextField(),
+        db_persist=True,
+    )
+
+
+class StoredTotalsMixin:
+    """
+    Keeps Model.save() from overwriting denormalized fields with stale in-memory values;
+    they are only ever written by their own update paths, e.g. refresh_totals()
+    """
+    denormalized_fields = ()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.denormalized_fields
+            ]
+        super().save(*args, **kwargs)
+
+
+class RollupSourceMixin:
+    """
+    Flags the day of a saved row for the daily rollups, and the day it was loaded
+    with if the save moved it to another day. Deletes are handled by a signal.
+    """
+    rollup_kind = None
+    rollup_date_field = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_rollup_day = _local_day(instance.__dict__.get(cls.rollup_date_field))
+        return instance
+
+    def save(self, *args, **kwargs):
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using, savepoint=False):
+            super().save(*args, **kwargs)
+            day = _local_day(getattr(self, self.rollup_date_field))
+            RollupDirtyDay.objects.mark(self.rollup_kind, [day, getattr(self, '_loaded_rollup_day', None)], using=using)
+            self._loaded_rollup_day = day
+
+
+class LineItemTotalsMixin:
+    """Refreshes the parent document's stored totals whenever a line item is saved"""
+    parent_field = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_parent_id = getattr(instance, f'{cls.parent_field}_id', None)
+        return instance
+
+    def save(self, *args, **kwargs):
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using, savepoint=False):
+            super().save(*args, **kwargs)
+            self.refresh_parent_totals(using=using)
+
+    def refresh_parent_totals(self, using=None):
+        """Recompute the totals of the parent document (and a previous parent, if it changed)"""
+        parent_ids = {getattr(self, f'{self.parent_field}_id'), getattr(self, '_loaded_parent_id', None)}
+        parent_ids.discard(None)
+        self._loaded_parent_id = getattr(self, f'{self.parent_field}_id')
+        descriptor = getattr(type(self), self.parent_field)
+        parent_model = descriptor.field.related_model
+        parent_model._default_manager.using(using).filter(pk__in=parent_ids).refresh_totals()
+        # Keep an already loaded parent instance in step with the database
+        if descriptor.is_cached(self):
+            parent = getattr(self, self.parent_field)
+            if parent is not None and parent.pk is not None:
+                parent.refresh_from_db(using=using, fields=parent.denormalized_fields)
+
+class Product(StoredTotalsMixin, models.Model):
     """Model for storing product information"""
     name = models.CharField(max_length=255, db_index=True)
-    sku = models.CharField(max_length=50, unique=True, help_text="Stock Keeping Unit", db_index=True)
+    sku = models.CharField(max_length=50, unique=True, help_text="Stock Keeping Unit")
     description = models.TextField(blank=True)
     unit_price = models.DecimalField(max_digits=10, decimal_places=2)
     stock_quantity = models.PositiveIntegerField(default=0, db_index=True)
     image = models.ImageField(upload_to='products/', blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True, db_index=True)
     updated_at = models.DateTimeField(auto_now=True)
+    search_document = search_document('sku', 'name', 'description')
+
+    objects = ProductQuerySet.as_manager()
+
+    # Searches match this field by prefix as well as the document's words
+    search_identifier = 'sku'
+
+    # Stock changes go through store.inventory so each one is recorded in the ledger
+    denormalized_fields = ('stock_quantity',)
 
     class Meta:
         ordering = ['name']
@@ -28,7 +383,7 @@ class Product(models.Model):
             return 0
         return self.unit_price * self.stock_quantity
 
-class PurchaseOrder(models.Model):
+class PurchaseOrder(RollupSourceMixin, StoredTotalsMixin, models.Model):
     """Model for purchase orders from vendors"""
     STATUS_CHOICES = (
         ('pending', 'Pending'),
@@ -43,9 +398,18 @@ class PurchaseOrder(models.Model):
     expected_delivery_date = models.DateField(null=True, blank=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     notes = models.TextField(blank=True)
+    # Denormalized from the line items, maintained by PurchaseOrderQuerySet.refresh_totals()
+    total_cost = models.DecimalField(max_digits=14, decimal_places=2, default=0, editable=False)
+    total_items = models.PositiveIntegerField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = PurchaseOrderQuerySet.as_manager()
+
+    denormalized_fields = ('total_cost', 'total_items')
+    rollup_kind = 'purchases'
+    rollup_date_field = 'order_date'
+
     class Meta:
         ordering = ['-order_date']
         verbose_name = 'Purchase Order'
@@ -55,22 +419,25 @@ class PurchaseOrder(models.Model):
         return f"PO #{self.order_number} - {self.vendor_name}"
 
     def get_total_cost(self):
-        """Calculate the total cost of the purchase order"""
-        return self.line_items.aggregate(
-            total=Sum(F('quantity') * F('cost_per_unit'), output_field=DecimalField())
-        )['total'] or 0
+        """Get the total cost of the purchase order"""
+        return self.total_cost
     
     def get_total_items(self):
         """Get total number of items ordered"""
-        return self.line_items.aggregate(Sum('quantity'))['quantity__sum'] or 0
+        return self.total_items
 
-class PurchaseOrderLineItem(models.Model):
+class PurchaseOrderLineItem(LineItemTotalsMixin, models.Model):
     """Model for individual line items on purchase orders"""
-    purchase_order = models.ForeignKey(PurchaseOrder, on_delete=models.CASCADE, related_name='line_items')
+    parent_field = 'purchase_order'
+
+    # Lookups by order use the (purchase_order, product) unique index
+    purchase_order = models.ForeignKey(PurchaseOrder, on_delete=models.CASCADE, related_name='line_items', db_index=False)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField()
     cost_per_unit = models.DecimalField(max_digits=10, decimal_places=2)
     received_quantity = models.PositiveIntegerField(default=0)
+
+    objects = PurchaseOrderLineItemQuerySet.as_manager()
     
     class Meta:
         verbose_name = 'Purchase Order Line Item'
@@ -84,7 +451,7 @@ class PurchaseOrderLineItem(models.Model):
         """Calculate the subtotal for this line item"""
         return self.quantity * self.cost_per_unit
 
-class Invoice(models.Model):
+class Invoice(RollupSourceMixin, StoredTotalsMixin, models.Model):
     """Model for customer invoices"""
     STATUS_CHOICES = (
         ('draft', 'Draft'),
@@ -94,19 +461,36 @@ class Invoice(models.Model):
         ('overdue', 'Overdue'),
     )
     
-    invoice_number = models.CharField(max_length=50, unique=True, default=uuid.uuid4, db_index=True)
-    customer_name = models.CharField(max_length=255, db_index=True)
-    customer_email = models.EmailField(db_index=True)
+    invoice_number = models.CharField(max_length=50, unique=True, default=uuid.uuid4)
+    customer_name = models.CharField(max_length=255)
+    customer_email = models.EmailField()
     billing_address = models.TextField()
     invoice_date = models.DateTimeField(default=timezone.now, db_index=True)
     due_date = models.DateField(db_index=True)
-    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='draft', db_index=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='draft')
     notes = models.TextField(blank=True)
+    # Denormalized from the line items, maintained by InvoiceQuerySet.refresh_totals()
+    total_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    search_document = search_document('invoice_number', 'customer_name', 'customer_email', 'notes')
+
+    objects = InvoiceQuerySet.as_manager()
+
+    search_identifier = 'invoice_number'
+
+    denormalized_fields = ('total_amount',)
+    rollup_kind = 'sales'
+    rollup_date_field = 'invoice_date'
 
     class Meta:
         ordering = ['-invoice_date']
+        indexes = [
+            # The overdue sweep: open statuses past their due date
+            models.Index(fields=['status', 'due_date'], name='store_invoice_status_due_idx'),
+            # Invoice lists filtered by status, newest first (admin, overdue report)
+            models.Index(fields=['status', 'invoice_date'], name='store_invoice_status_date_idx'),
+        ]
         verbose_name = 'Invoice'
         verbose_name_plural = 'Invoices'
 
@@ -114,10 +498,8 @@ class Invoice(models.Model):
         return f"Invoice #{self.invoice_number} - {self.customer_name}"
 
     def get_total_amount(self):
-        """Calculate the total amount of the invoice"""
-        return self.line_items.aggregate(
-            total=Sum(F('quantity') * F('price_each'), output_field=DecimalField())
-        )['total'] or 0
+        """Get the total amount of the invoice"""
+        return self.total_amount
     
     def is_overdue(self):
         """Check if the invoice is overdue"""
@@ -130,12 +512,17 @@ class Invoice(models.Model):
         self.status = 'paid'
         self.save()
 
-class InvoiceLineItem(models.Model):
+class InvoiceLineItem(LineItemTotalsMixin, models.Model):
     """Model for individual line items on invoices"""
-    invoice = models.ForeignKey(Invoice, on_delete=models.CASCADE, related_name='line_items')
+    parent_field = 'invoice'
+
+    # Lookups by invoice use the (invoice, product) unique index
+    invoice = models.ForeignKey(Invoice, on_delete=models.CASCADE, related_name='line_items', db_index=False)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField()
     price_each = models.DecimalField(max_digits=10, decimal_places=2)
+
+    objects = InvoiceLineItemQuerySet.as_manager()
     
     class Meta:
         verbose_name = 'Invoice Line Item'
@@ -148,3 +535,267 @@ class InvoiceLineItem(models.Model):
     def get_subtotal(self):
         """Calculate the subtotal for this line item"""
         return self.quantity * self.price_each
+
+
+class StoreCounter(models.Model):
+    """Running totals for the home page statistics, kept up to date by signals"""
+    COUNTER_NAMES = (
+        'product_count',
+        'purchase_order_count',
+        'invoice_count',
+        'total_invoice_value',
+        'total_purchase_value',
+    )
+
+    name = models.CharField(max_length=50, unique=True)
+    value = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = StoreCounterManager()
+
+    class Meta:
+        verbose_name = 'Store Counter'
+        verbose_name_plural = 'Store Counters'
+
+    def __str__(self):
+        return f"{self.name} = {self.value}"
+
+
+class ModelVersion(models.Model):
+    """
+    Change counter of a model, bumped after every committed write to it. The report
+    cache keys are built from these (store.cache), so they live in the database where
+    every process sees the same versions.
+    """
+    label = models.CharField(max_length=100, unique=True)
+    version = models.BigIntegerField()
+
+    class Meta:
+        verbose_name = 'Model Version'
+        verbose_name_plural = 'Model Versions'
+
+    def __str__(self):
+        return f"{self.label} v{self.version}"
+
+
+class Job(models.Model):
+    """Background job for exports and reports that are too slow for the request cycle"""
+    STATUS_CHOICES = (
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    )
+
+    kind = models.CharField(max_length=50)
+    params = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    progress = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(default=0)
+    result_file = models.FileField(upload_to='jobs/', blank=True)
+    error = models.TextField(blank=True)
+    summary = models.JSONField(default=dict, blank=True, help_text="Counts and timings reported by the job")
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True, help_text="Last sign of life from the worker running the job")
+    attempts = models.PositiveSmallIntegerField(default=0)
+
+    class Meta:
+        ordering = ['-created_at']
+        # Workers claim the oldest queued job and look for running jobs whose worker died;
+        # finished jobs, the bulk of the table, stay out of both indexes
+        indexes = [
+            models.Index(fields=['created_at', 'id'], condition=models.Q(status='queued'), name='store_job_queued_idx'),
+            models.Index(fields=['heartbeat_at'], condition=models.Q(status='running'), name='store_job_running_idx'),
+        ]
+        verbose_name = 'Job'
+        verbose_name_plural = 'Jobs'
+
+    def __str__(self):
+        return f"{self.get_kind_display()} #{self.pk} ({self.get_status_display()})"
+
+    def get_kind_display(self):
+        from .jobs import HANDLERS
+        handler = HANDLERS.get(self.kind)
+        return handler.description if handler else self.kind
+
+    def get_progress_percent(self):
+        """Return the job's progress as a percentage"""
+        if self.status == 'done':
+            return 100
+        if not self.total:
+            return 0
+        return min(100, int(100 * self.progress / self.total))
+
+
+class StockReservation(models.Model):
+    """Stock held for an invoice; the product's stock is decremented when the reservation is made"""
+    STATUS_CHOICES = (
+        ('reserved', 'Reserved'),
+        ('committed', 'Committed'),
+        ('released', 'Released'),
+    )
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reservations')
+    invoice = models.ForeignKey(Invoice, on_delete=models.CASCADE, null=True, blank=True, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='reserved', db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = 'Stock Reservation'
+        verbose_name_plural = 'Stock Reservations'
+
+    def __str__(self):
+        return f"{self.quantity} x product {self.product_id} ({self.get_status_display()})"
+
+
+class InventoryMovement(models.Model):
+    """Append-only record of a change to a product's stock; quantity is negative for stock leaving"""
+    REASON_CHOICES = (
+        ('opening', 'Opening Balance'),
+        ('receipt', 'Purchase Order Receipt'),
+        ('reservation', 'Invoice Reservation'),
+        ('release', 'Reservation Released'),
+        ('adjustment', 'Manual Adjustment'),
+    )
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='movements')
+    quantity = models.IntegerField()
+    reason = models.CharField(max_length=20, choices=REASON_CHOICES)
+    reference = models.CharField(max_length=100, blank=True, help_text="Purchase order, invoice or user behind the movement")
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [models.Index(fields=['product', 'created_at'])]
+        verbose_name = 'Inventory Movement'
+        verbose_name_plural = 'Inventory Movements'
+
+    def __str__(self):
+        return f"{self.quantity:+d} x product {self.product_id} ({self.get_reason_display()})"
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("Inventory movements are append-only.")
+        super().save(*args, **kwargs)
+
+
+class InventorySnapshot(models.Model):
+    """A product's stock at a point in time; movements before it can be compacted away"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='snapshots')
+    quantity = models.IntegerField()
+    taken_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ['-taken_at']
+        unique_together = ('product', 'taken_at')
+        verbose_name = 'Inventory Snapshot'
+        verbose_name_plural = 'Inventory Snapshots'
+
+    def __str__(self):
+        return f"{self.quantity} x product {self.product_id} at {self.taken_at}"
+
+
+class InvoiceStatusChange(models.Model):
+    """History of invoice status transitions, written in bulk by store.transitions"""
+    invoice = models.ForeignKey(Invoice, on_delete=models.CASCADE, related_name='status_changes')
+    from_status = models.CharField(max_length=20, choices=Invoice.STATUS_CHOICES)
+    to_status = models.CharField(max_length=20, choices=Invoice.STATUS_CHOICES)
+    changed_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
+    source = models.CharField(max_length=50, blank=True, help_text="What made the change, e.g. an admin action or a command")
+    changed_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['-changed_at']
+        indexes = [models.Index(fields=['invoice', 'changed_at'])]
+        verbose_name = 'Invoice Status Change'
+        verbose_name_plural = 'Invoice Status Changes'
+
+    def __str__(self):
+        return f"Invoice {self.invoice_id}: {self.from_status} -> {self.to_status}"
+
+
+class RollupDirtyDay(models.Model):
+    """A day whose daily rollups are out of date; store.rollups recomputes and removes it"""
+    KIND_CHOICES = (
+        ('sales', 'Sales'),
+        ('purchases', 'Purchases'),
+    )
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    date = models.DateField()
+    marked_at = models.DateTimeField(auto_now=True)
+
+    objects = RollupDirtyDayManager()
+
+    def __str__(self):
+        return f"{self.kind} {self.date}"
+
+
+class DailySales(models.Model):
+    """Invoice count and value per day and status"""
+    date = models.DateField()
+    status = models.CharField(max_length=20, choices=Invoice.STATUS_CHOICES)
+    invoice_count = models.PositiveIntegerField(default=0)
+    total_amount = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = ('date', 'status')
+        verbose_name_plural = 'Daily Sales'
+
+
+class DailyCustomerSales(models.Model):
+    """Invoice count and value per day and customer"""
+    date = models.DateField()
+    customer_name = models.CharField(max_length=255)
+    customer_email = models.EmailField()
+    invoice_count = models.PositiveIntegerField(default=0)
+    total_amount = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = ('date', 'customer_email', 'customer_name')
+        verbose_name_plural = 'Daily Customer Sales'
+
+
+class DailyProductSales(models.Model):
+    """Invoice line items per day and product; price_total and line_count give the average price"""
+    date = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='daily_sales')
+    quantity = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    price_total = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    line_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('date', 'product')
+        verbose_name_plural = 'Daily Product Sales'
+
+
+class DailyVendorPurchases(models.Model):
+    """Purchase order count and cost per day and vendor"""
+    date = models.DateField()
+    vendor_name = models.CharField(max_length=255)
+    order_count = models.PositiveIntegerField(default=0)
+    total_cost = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = ('date', 'vendor_name')
+        verbose_name_plural = 'Daily Vendor Purchases'
+
+
+class DailyProductPurchases(models.Model):
+    """Purchase order line items per day and product; cost_total and line_count give the average cost"""
+    date = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='daily_purchases')
+    quantity = models.PositiveIntegerField(default=0)
+    cost_total = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    line_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('date', 'product')
+        verbose_name_plural = 'Daily Product Purchases'
@@ -0,0 +1,220 @@
+"""
+Keyset (seek) pagination for admin changelists over large tables.
+
+Django's paginator pages with OFFSET, which reads and discards every row before
+the page, and runs COUNT(*) over the whole result on every request. Here a page
+starts after the sort key of the previous page's last row, so any page is an index
+range scan of one page of rows, and large tables are counted from the planner's
+statistics instead.
+"""
+import base64
+import binascii
+import json
+from dataclasses import dataclass
+from functools import reduce
+from operator import or_
+
+from django.contrib.admin.views.main import ChangeList
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db import connections
+from django.db.models import Q
+
+CURSOR_VAR = 'cursor'
+# Tables with fewer rows than this are counted exactly
+ESTIMATE_THRESHOLD = 100000
+
+
+def estimated_count(queryset, threshold=ESTIMATE_THRESHOLD):
+    """
+    Return (count, is_estimate) for a queryset. On PostgreSQL, tables of `threshold`
+    rows or more are counted from the planner's statistics: the table's row
+    estimate when unfiltered, otherwise the plan's estimate for the filtered rows.
+    Other databases, and smaller tables, get an exact COUNT(*).
+    """
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass', [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+        table_rows = row[0] if row else -1
+        if table_rows >= threshold:
+            if not queryset.query.where:
+                return int(table_rows), True
+            plan = json.loads(queryset.order_by().explain(format='json'))
+            return int(plan[0]['Plan']['Plan Rows']), True
+    return queryset.count(), False
+
+
+def keyset_fields(queryset):
+    """
+    The (field, descending) pairs of the queryset's ordering when it can be paged by
+    keyset: plain non-null columns ending in a unique one. None otherwise (ordering by
+    expressions, annotations or related models).
+    """
+    opts = queryset.model._meta
+    fields = []
+    for item in queryset.query.order_by:
+        if not isinstance(item, str):
+            return None
+        name = item.removeprefix('-')
+        try:
+            field = opts.pk if name == 'pk' else opts.get_field(name)
+        except FieldDoesNotExist:
+            return None
+        if field.is_relation or field.null or not field.concrete:
+            return None
+        fields.append((field, item.startswith('-')))
+    if not fields or not fields[-1][0].unique:
+        return None
+    return fields
+
+
+def _json_value(value):
+    # Full precision: a datetime cut to milliseconds would skip or repeat rows
+    return value.isoformat() if hasattr(value, 'isoformat') else str(value)
+
+
+def _encode(mode, values):
+    data = json.dumps([mode, list(values)], default=_json_value, separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def _load(cursor):
+    return json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+
+
+def _decode(cursor, fields):
+    """Return (mode, values) from a cursor; an unreadable or stale cursor starts over at the first page"""
+    try:
+        mode, values = _load(cursor)
+        if mode == 'last':
+            return mode, None
+        if mode not in ('next', 'previous') or len(values) != len(fields):
+            raise ValueError
+        return mode, [field.to_python(value) for (field, _), value in zip(fields, values)]
+    except (binascii.Error, ValueError, TypeError, ValidationError):
+        return 'first', None
+
+
+def _beyond(fields, values, backwards=False):
+    """Rows after `values` in the ordering (before them when `backwards`)"""
+    clauses = []
+    equal = {}
+    for (field, descending), value in zip(fields, values):
+        lookup = 'lt' if descending != backwards else 'gt'
+        clauses.append(Q(**equal, **{f'{field.attname}__{lookup}': value}))
+        equal[field.attname] = value
+    # A bound on the leading key alone lets the database range-scan its index
+    first, descending = fields[0]
+    bound = Q(**{f"{first.attname}__{'lte' if descending != backwards else 'gte'}": values[0]})
+    return bound & reduce(or_, clauses)
+
+
+@dataclass
+class KeysetPage:
+    object_list: object
+    has_next: bool
+    has_previous: bool
+    next_cursor: str = ''
+    previous_cursor: str = ''
+    first_url: str = ''
+    last_url: str = ''
+    next_url: str = ''
+    previous_url: str = ''
+
+
+class KeysetPaginator:
+    """Pages a queryset ordered by keyset_fields() from a cursor instead of a page number"""
+
+    def __init__(self, queryset, per_page, fields):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.fields = fields
+        self.count, self.is_estimate = estimated_count(queryset)
+
+    def get_elided_page_range(self, *args, **kwargs):
+        # There are no page numbers to link to
+        return []
+
+    def page(self, cursor=None):
+        mode, values = _decode(cursor, self.fields) if cursor else ('first', None)
+        backwards = mode in ('previous', 'last')
+        ordering = [
+            ('-' if descending != backwards else '') + field.attname for field, descending in self.fields
+        ]
+        window = self.queryset.order_by(*ordering)
+        if values is not None:
+            window = window.filter(_beyond(self.fields, values, backwards=backwards))
+        pk_name = self.queryset.model._meta.pk.attname
+        keys = list(window.values_list(*[field.attname for field, _ in self.fields], pk_name)[:self.per_page + 1])
+        more = len(keys) > self.per_page
+        keys = keys[:self.per_page]
+        if backwards:
+            keys.reverse()
+
+        # The page itself keeps the admin's queryset (select_related, ordering) so list_editable works
+        object_list = self.queryset.filter(pk__in=[key[-1] for key in keys])
+        if not keys:
+            # Paged past the end (rows were deleted meanwhile): offer a way back
+            return KeysetPage(object_list, has_next=False, has_previous=mode != 'first')
+        return KeysetPage(
+            object_list,
+            has_next=more if mode in ('first', 'next') else mode == 'previous',
+            has_previous=more if backwards else mode == 'next',
+            next_cursor=_encode('next', keys[-1][:-1]),
+            previous_cursor=_encode('previous', keys[0][:-1]),
+        )
+
+
+class KeysetChangeList(ChangeList):
+    """
+    ChangeList that pages by keyset when the list is ordered by plain columns (the
+    default ordering or a clicked column) and falls back to page numbers otherwise,
+    e.g. for search results ranked by relevance
+    """
+    keyset_page = None
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(CURSOR_VAR, None)
+        return lookup_params
+
+    def get_query_string(self, new_params=None, remove=None):
+        # Sorting and filtering links start over at the first page
+        return super().get_query_string(new_params, [*(remove or []), CURSOR_VAR])
+
+    def get_results(self, request):
+        fields = keyset_fields(self.queryset)
+        if fields is None or self.show_all:
+            return super().get_results(request)
+
+        paginator = KeysetPaginator(self.queryset, self.list_per_page, fields)
+        page = paginator.page(request.GET.get(CURSOR_VAR))
+        page.first_url = self.get_query_string()
+        page.last_url = self.get_query_string({CURSOR_VAR: _encode('last', [])})
+        page.next_url = self.get_query_string({CURSOR_VAR: page.next_cursor})
+        page.previous_url = self.get_query_string({CURSOR_VAR: page.previous_cursor})
+
+        if self.model_admin.show_full_result_count and not self.queryset.query.where:
+            # Unfiltered, the full count is the one just taken
+            full_result_count = paginator.count
+        elif self.model_admin.show_full_result_count:
+            full_result_count, _ = estimated_count(self.root_queryset)
+        else:
+            full_result_count = None
+        self.result_count = paginator.count
+        self.show_full_result_count = self.model_admin.show_full_result_count
+        self.show_admin_actions = not self.show_full_result_count or bool(full_result_count)
+        self.full_result_count = full_result_count
+        self.result_list = page.object_list
+        self.can_show_all = paginator.count <= self.list_max_show_all
+        self.multi_page = page.has_next or page.has_previous
+        self.paginator = paginator
+        self.keyset_page = page
+
+
+class KeysetPaginationMixin:
+    """ModelAdmin mixin that pages the changelist with KeysetChangeList"""
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
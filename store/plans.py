@@ -0,0 +1,76 @@
+"""
+EXPLAIN-based checks that the hot queries are served by the indexes meant for them.
+
+Each check builds the query the app actually runs and asserts that its plan names
+an index whose leading columns are the expected ones. Run them with
+`manage.py check_query_plans` after changing models, indexes or queries.
+"""
+from dataclasses import dataclass
+from typing import Callable
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import queries
+from .models import DailySales, Invoice, InvoiceLineItem, Job, Product
+from .rollups import _in_days
+from .transitions import past_due_invoices
+
+
+@dataclass
+class PlanCheck:
+    label: str
+    queryset: Callable
+    model: type
+    columns: list
+
+
+PLAN_CHECKS = [
+    PlanCheck('Overdue sweep', past_due_invoices, Invoice, ['status', 'due_date']),
+    PlanCheck('Overdue invoices, newest first', queries.get_overdue_invoices, Invoice, ['status', 'invoice_date']),
+    PlanCheck('Line items of an invoice', lambda: InvoiceLineItem.objects.filter(invoice_id=1), InvoiceLineItem,
+              ['invoice_id', 'product_id']),
+    PlanCheck('Products never sold', queries.get_products_never_purchased, InvoiceLineItem, ['product_id']),
+    PlanCheck('Low stock products', queries.get_low_stock_products, Product, ['stock_quantity']),
+    PlanCheck('Job queue claim', lambda: Job.objects.filter(status='queued').order_by('created_at', 'pk').values_list('pk'),
+              Job, ['created_at', 'id']),
+    PlanCheck('Stale job sweep', lambda: Job.objects.filter(status='running', heartbeat_at__lt=timezone.now()),
+              Job, ['heartbeat_at']),
+    PlanCheck('Rollup refresh of a day', lambda: Invoice.objects.filter(_in_days('invoice_date', [timezone.localdate()])),
+              Invoice, ['invoice_date']),
+    PlanCheck('Monthly sales report', lambda: DailySales.objects.filter(date__year=timezone.localdate().year),
+              DailySales, ['date']),
+]
+
+
+def index_names(model, columns):
+    """Names of the indexes (including unique constraints) on the model's table that lead with `columns`"""
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, table)
+    names = set()
+    for name, info in constraints.items():
+        if (info['index'] or info['unique']) and info['columns'][:len(columns)] == columns:
+            if name.startswith('__unnamed'):
+                # Inline UNIQUE constraints on SQLite show up in plans as automatic indexes
+                names.add(f'sqlite_autoindex_{table}_')
+            else:
+                names.add(name)
+    return names
+
+
+def explain(queryset):
+    """The plan text for a queryset; PostgreSQL is kept off sequential scans so small tables plan like big ones"""
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        return queryset.explain()
+
+
+def run_checks(checks=PLAN_CHECKS):
+    """Yield (check, expected index names, plan, passed) for each check"""
+    for check in checks:
+        expected = index_names(check.model, check.columns)
+        plan = explain(check.queryset())
+        yield check, expected, plan, any(name in plan for name in expected)
@@ -0,0 +1,250 @@
+"""
+Per-request SQL profiling.
+
+For a sample of requests (STORE_PROFILING_SAMPLE_RATE), ProfilingMiddleware records
+the number of queries, the time spent in SQL, the queries repeated with the same
+shape (the N+1 pattern) and the report cache's hits and misses. Each sampled
+request gets a Server-Timing header and a log line, and is added to a rolling
+window that the admin's performance page aggregates. Requests that aren't sampled
+skip all of this, and with sampling off no query is wrapped at all.
+"""
+import logging
+import random
+import re
+import threading
+import time
+from collections import Counter, deque
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SAMPLE_RATE = 0.0
+DEFAULT_WINDOW = 60 * 60
+# Sampled requests kept per process, however busy the window is
+MAX_WINDOW_REQUESTS = 10000
+# Repeated query shapes reported per request
+MAX_DUPLICATES = 5
+
+_current = ContextVar('store_request_profile', default=None)
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_LIST = re.compile(r'(?:%s|\?)(?:\s*,\s*(?:%s|\?))+')
+_SPACE = re.compile(r'\s+')
+# Transaction control repeats in every request and isn't a query to fix
+_TRANSACTION = re.compile(r'(?:BEGIN|COMMIT|ROLLBACK|SAVEPOINT|RELEASE)\b', re.IGNORECASE)
+
+
+def fingerprint(sql):
+    """The shape of a query: literals and placeholder lists collapsed, so an N+1 loop's queries are one"""
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _LIST.sub('...', sql)
+    return _SPACE.sub(' ', sql).strip()
+
+
+def sample_rate():
+    return getattr(settings, 'STORE_PROFILING_SAMPLE_RATE', DEFAULT_SAMPLE_RATE)
+
+
+@dataclass
+class RequestProfile:
+    """What one request did, filled in by the query wrapper and the report cache"""
+    started: float = field(default_factory=time.perf_counter)
+    queries: int = 0
+    sql_seconds: float = 0.0
+    statements: Counter = field(default_factory=Counter)
+    cache: Counter = field(default_factory=Counter)
+    # The dashboard runs queries on several threads for one request
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def record_query(self, sql, seconds):
+        with self._lock:
+            self.queries += 1
+            self.sql_seconds += seconds
+            self.statements[sql] += 1
+
+    def record_cache(self, **increments):
+        with self._lock:
+            self.cache.update(increments)
+
+    def duplicates(self, limit=MAX_DUPLICATES):
+        """The most repeated query shapes as (fingerprint, count), for shapes run more than once"""
+        shapes = Counter()
+        for sql, count in self.statements.items():
+            if not _TRANSACTION.match(sql.lstrip()):
+                shapes[fingerprint(sql)] += count
+        return [(shape, count) for shape, count in shapes.most_common(limit) if count > 1]
+
+
+def current_profile():
+    """The profile of the request being handled, or None when it isn't sampled"""
+    return _current.get()
+
+
+def record_query(execute, sql, params, many, context):
+    """Database execute wrapper that times queries into the current request's profile"""
+    profile = _current.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.record_query(sql, time.perf_counter() - start)
+
+
+def install(connection):
+    """Wrap a database connection's queries, unless profiling is off"""
+    if sample_rate() > 0 and record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@dataclass
+class ProfileWindow:
+    """Process-wide rolling window of sampled requests, for the admin's performance page"""
+    seconds: float = DEFAULT_WINDOW
+    requests: deque = field(default_factory=lambda: deque(maxlen=MAX_WINDOW_REQUESTS))
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def add(self, summary):
+        with self._lock:
+            self.requests.append(summary)
+
+    def recent(self):
+        """The requests still inside the window, dropping older ones"""
+        cutoff = time.time() - getattr(settings, 'STORE_PROFILING_WINDOW', self.seconds)
+        with self._lock:
+            while self.requests and self.requests[0]['at'] < cutoff:
+                self.requests.popleft()
+            return list(self.requests)
+
+    def reset(self):
+        with self._lock:
+            self.requests.clear()
+
+    def slowest_endpoints(self, limit=20):
+        """Per endpoint: request count, mean/p95/max duration and mean queries and SQL time, slowest first"""
+        by_endpoint = {}
+        for summary in self.recent():
+            by_endpoint.setdefault(summary['endpoint'], []).append(summary)
+        rows = []
+        for endpoint, summaries in by_endpoint.items():
+            durations = sorted(summary['duration_ms'] for summary in summaries)
+            count = len(summaries)
+            rows.append({
+                'endpoint': endpoint,
+                'requests': count,
+                'mean_ms': sum(durations) / count,
+                'p95_ms': durations[min(count - 1, int(count * 0.95))],
+                'max_ms': durations[-1],
+                'mean_queries': sum(summary['queries'] for summary in summaries) / count,
+                'mean_sql_ms': sum(summary['sql_ms'] for summary in summaries) / count,
+            })
+        return sorted(rows, key=lambda row: row['p95_ms'], reverse=True)[:limit]
+
+    def worst_duplicates(self, limit=20):
+        """Per endpoint and repeated query shape: requests affected, the most repeats in one and the total"""
+        offenders = {}
+        for summary in self.recent():
+            for shape, count in summary['duplicates']:
+                row = offenders.setdefault((summary['endpoint'], shape), {
+                    'endpoint': summary['endpoint'], 'fingerprint': shape, 'requests': 0, 'max_count': 0, 'total': 0,
+                })
+                row['requests'] += 1
+                row['max_count'] = max(row['max_count'], count)
+                row['total'] += count
+        return sorted(offenders.values(), key=lambda row: row['total'], reverse=True)[:limit]
+
+
+window = ProfileWindow()
+
+
+def _endpoint(request):
+    # Group by URL pattern rather than path, so /admin/store/invoice/1/ and /2/ are one endpoint
+    match = request.resolver_match
+    route = match.route if match is not None and match.route else request.path
+    return f'{request.method} /{route.lstrip("/")}'
+
+
+def server_timing(summary, total_ms):
+    """A Server-Timing header value for a summary"""
+    hits = summary['cache'].get('hits', 0) + summary['cache'].get('stale_hits', 0)
+    misses = summary['cache'].get('misses', 0)
+    metrics = [
+        f'db;dur={summary["sql_ms"]:.1f};desc="{summary["queries"]} queries"',
+        f'cache;desc="{hits} hits, {misses} misses"',
+        f'total;dur={total_ms:.1f}',
+    ]
+    if summary['duplicates']:
+        repeated = sum(count for _, count in summary['duplicates'])
+        metrics.insert(1, f'dup;desc="{repeated} repeated queries"')
+    return ', '.join(metrics)
+
+
+def _finish(request, response, profile):
+    duration_ms = (time.perf_counter() - profile.started) * 1000
+    summary = {
+        'at': time.time(),
+        'endpoint': _endpoint(request),
+        'status': response.status_code,
+        'duration_ms': round(duration_ms, 2),
+        'queries': profile.queries,
+        'sql_ms': round(profile.sql_seconds * 1000, 2),
+        'duplicates': profile.duplicates(),
+        'cache': dict(profile.cache),
+    }
+    window.add(summary)
+    logger.info(
+        "%s: %d queries, %.1fms SQL, %.1fms total", summary['endpoint'], summary['queries'], summary['sql_ms'],
+        duration_ms, extra={'profile': summary},
+    )
+    timing = server_timing(summary, duration_ms)
+    if response.has_header('Server-Timing'):
+        timing = f"{response['Server-Timing']}, {timing}"
+    response['Server-Timing'] = timing
+    return response
+
+
+class ProfilingMiddleware:
+    """Profile a sample of requests (see the module docstring)"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def _sampled(self):
+        rate = sample_rate()
+        return rate > 0 and random.random() < rate
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not self._sampled():
+            return self.get_response(request)
+        profile = RequestProfile()
+        token = _current.set(profile)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return _finish(request, response, profile)
+
+    async def __acall__(self, request):
+        if not self._sampled():
+            return await self.get_response(request)
+        profile = RequestProfile()
+        token = _current.set(profile)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return _finish(request, response, profile)
@@ -1,36 +1,43 @@
-from django.db.models import Sum, F, DecimalField, Count, Q, Avg, Case, When, Value, IntegerField
+from django.db.models import Sum, F, DecimalField, FloatField, Count, Q, OuterRef, Subquery, ExpressionWrapper, Case, When, Value, IntegerField
+from django.db.models.functions import Cast, Coalesce, ExtractMonth
 from django.utils import timezone
-from .models import Product, PurchaseOrder, Invoice, InvoiceLineItem, PurchaseOrderLineItem
-from django.core.cache import cache
+from .models import (
+    Product, Invoice, InvoiceLineItem, PurchaseOrderLineItem,
+    DailySales, DailyCustomerSales, DailyProductSales, DailyVendorPurchases, DailyProductPurchases,
+)
+from .cache import get_or_compute, versioned_key
+
+
+def _average(rollup, total_field):
+    """Per-product average price from a daily rollup's running total and line count"""
+    per_product = rollup.objects.filter(product=OuterRef('pk')).order_by().values('product').annotate(
+        # The float cast keeps SQLite from dividing whole-number totals as integers
+        average=ExpressionWrapper(Sum(total_field) / Cast(Sum('line_count'), FloatField()), output_field=DecimalField())
+    ).values('average')
+    return Subquery(per_product, output_field=DecimalField())
 
 def get_high_value_invoices(min_total_amount=1000):
     """
     Get invoices with a total amount greater than the specified minimum
-    Using annotation to calculate the total amount for each invoice
+    Using the stored invoice total, so no line items are joined
     """
-    return Invoice.objects.annotate(
-        total_amount=Sum(F('line_items__quantity') * F('line_items__price_each'), 
-                        output_field=DecimalField())
-    ).filter(total_amount__gt=min_total_amount)
+    return Invoice.objects.filter(total_amount__gt=min_total_amount)
 
 def get_overdue_invoices():
     """
     Get all overdue invoices that are not paid or cancelled
+    Past-due invoices are moved to 'overdue' by `manage.py mark_overdue_invoices`
     """
-    today = timezone.now().date()
-    return Invoice.objects.filter(
-        due_date__lt=today,
-        status__in=['draft', 'sent', 'overdue']
-    )
+    return Invoice.objects.filter(status='overdue')
 
 def get_invoices_by_status_with_totals():
     """
     Group invoices by status and get the count and total amount for each status
+    Summing the stored invoice totals counts each invoice once instead of once per line item
     """
     return Invoice.objects.values('status').annotate(
         count=Count('id'),
-        total_amount=Sum(F('line_items__quantity') * F('line_items__price_each'), 
-                        output_field=DecimalField())
+        total_amount=Coalesce(Sum('total_amount'), Value(0), output_field=DecimalField())
     ).order_by('status')
 
 def get_product_sales_analysis():
@@ -38,29 +45,29 @@ def get_product_sales_analysis():
     Get a sales analysis for each product, including total quantity sold and revenue
     """
     return Product.objects.annotate(
-        quantity_sold=Sum('invoicelineitem__quantity'),
-        total_revenue=Sum(F('invoicelineitem__quantity') * F('invoicelineitem__price_each'), 
-                        output_field=DecimalField())
+        quantity_sold=Sum('daily_sales__quantity'),
+        total_revenue=Sum('daily_sales__revenue')
     ).filter(quantity_sold__gt=0).order_by('-total_revenue')
 
 def get_vendor_purchase_summary():
     """
     Get a summary of purchases by vendor, including total orders and amount spent
+    Read from the daily vendor rollup, one row per vendor and day
     """
-    return PurchaseOrder.objects.values('vendor_name').annotate(
-        order_count=Count('id'),
-        total_spent=Sum(F('line_items__quantity') * F('line_items__cost_per_unit'), 
-                        output_field=DecimalField())
+    return DailyVendorPurchases.objects.values('vendor_name').annotate(
+        order_count=Sum('order_count'),
+        total_spent=Coalesce(Sum('total_cost'), Value(0), output_field=DecimalField())
     ).order_by('-total_spent')
 
 def get_product_profit_margin():
     """
     Calculate the profit margin for each product
     Using complex annotation to compare sales price vs. purchase cost
+    The averages are per line item, from the daily rollups' price totals and line counts
     """
     return Product.objects.annotate(
-        avg_purchase_price=Avg('purchaseorderlineitem__cost_per_unit'),
-        avg_sales_price=Avg('invoicelineitem__price_each'),
+        avg_purchase_price=_average(DailyProductPurchases, 'cost_total'),
+        avg_sales_price=_average(DailyProductSales, 'price_total'),
         profit_margin=Case(
             When(avg_purchase_price__gt=0, 
                  then=100 * (F('avg_sales_price') - F('avg_purchase_price')) / F('avg_purchase_price')),
@@ -72,20 +79,19 @@ def get_product_profit_margin():
 def get_monthly_sales_report(year=None):
     """
     Get a monthly sales report for a specific year
-    Group by month and calculate total sales
+    Group by month and calculate total sales from the daily rollup (at most 365 rows per status)
     """
     if not year:
         year = timezone.now().year
-        
-    return Invoice.objects.filter(
-        invoice_date__year=year,
+    
+    return DailySales.objects.filter(
+        date__year=year,
         status__in=['sent', 'paid']
     ).annotate(
-        month=F('invoice_date__month')
+        month=ExtractMonth('date')
     ).values('month').annotate(
-        invoice_count=Count('id'),
-        total_sales=Sum(F('line_items__quantity') * F('line_items__price_each'), 
-                       output_field=DecimalField())
+        invoice_count=Sum('invoice_count'),
+        total_sales=Coalesce(Sum('total_amount'), Value(0), output_field=DecimalField())
     ).order_by('month')
 
 def get_low_stock_products(threshold=10):
@@ -97,11 +103,11 @@ def get_low_stock_products(threshold=10):
 def get_customers_by_revenue():
     """
     Get customers ranked by total revenue
+    Read from the daily customer rollup, one row per customer and day
     """
-    return Invoice.objects.values('customer_name', 'customer_email').annotate(
-        invoice_count=Count('id'),
-        total_spent=Sum(F('line_items__quantity') * F('line_items__price_each'), 
-                       output_field=DecimalField())
+    return DailyCustomerSales.objects.values('customer_name', 'customer_email').annotate(
+        invoice_count=Sum('invoice_count'),
+        total_spent=Coalesce(Sum('total_amount'), Value(0), output_field=DecimalField())
     ).order_by('-total_spent')
 
 def get_products_never_purchased():
@@ -113,43 +119,24 @@ def get_products_never_purchased():
         id__in=InvoiceLineItem.objects.values_list('product_id', flat=True)
     )
 
+def _invoice_status_summary():
+    # Totals come from the stored invoice totals, so no line items are joined
+    return list(Invoice.objects.order_by().values('status').annotate(
+        count=Count('id'),
+        overdue_count=Count('id', filter=Q(status='overdue')),
+        status_total=Coalesce(Sum('total_amount'), Value(0), output_field=DecimalField())
+    ).order_by('status'))
+
+def invoice_status_summary_key():
+    """The cache key of today's invoice status summary"""
+    # Cached until an invoice changes or the date moves on; the overdue sweep's writes change
+    # the key too, but a day with no sweep (or one run in another process) still needs a fresh count
+    return versioned_key('invoice_status_summary', Invoice, extra=[timezone.localdate()])
+
+
 def get_invoice_status_summary():
     """
     Get a summary of invoices by status with additional flags for overdue
-    Using conditional expressions with Case/When with optimization
+    A single grouped query returns the count, overdue count and total per status
     """
-    # Use cache key based on the last modified invoice to avoid recalculating unnecessarily
-    cache_key = 'invoice_status_summary'
-    cached_result = cache.get(cache_key)
-    
-    # If cached result exists and isn't too old, return it
-    if cached_result is not None:
-        return cached_result
-    
-    today = timezone.now().date()
-    
-    # More efficient query that doesn't compute complex aggregations for every row
-    result = Invoice.objects.annotate(
-        is_overdue=Case(
-            When(due_date__lt=today, status__in=['draft', 'sent'], then=Value(1)),
-            default=Value(0),
-            output_field=IntegerField()
-        )
-    ).values('status').annotate(
-        count=Count('id'),
-        overdue_count=Sum('is_overdue')
-    ).order_by('status')
-    
-    # Calculate totals in separate, simpler query
-    status_totals = {}
-    for status in result:
-        invoices = Invoice.objects.filter(status=status['status'])
-        total = 0
-        for invoice in invoices:
-            total += invoice.get_total_amount()
-        status['status_total'] = total
-    
-    # Cache the result for 10 minutes
-    cache.set(cache_key, result, 600)
-    
-    return result 
\ No newline at end of file
+    return get_or_compute(invoice_status_summary_key(), _invoice_status_summary, ttl=None)
@@ -0,0 +1,172 @@
+"""
+Daily rollups of sales and purchases for the reports in store.queries.
+
+Writes to invoices, purchase orders and their line items flag the affected days
+(RollupDirtyDay); refresh_rollups() recomputes just those days from the source rows,
+so a report reads one row per day and key instead of the whole line item history.
+Reports only read: the flagged days are recomputed by `manage.py refresh_rollups`
+and by the job runner, so report pages never write and can run on a replica.
+`manage.py rebuild_rollups` recomputes everything, e.g. after loading data.
+"""
+from datetime import datetime, time, timedelta
+
+from django.db import connection, transaction
+from django.db.models import Count, DecimalField, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .cache import bump_model_version
+from .models import (
+    DailyCustomerSales,
+    DailyProductPurchases,
+    DailyProductSales,
+    DailySales,
+    DailyVendorPurchases,
+    Invoice,
+    InvoiceLineItem,
+    PurchaseOrder,
+    PurchaseOrderLineItem,
+    RollupDirtyDay,
+)
+
+# Flags deleted per statement after a refresh
+FLAG_BATCH_SIZE = 5000
+
+ROLLUP_TABLES = {
+    'sales': (DailySales, DailyCustomerSales, DailyProductSales),
+    'purchases': (DailyVendorPurchases, DailyProductPurchases),
+}
+
+
+def _day_ranges(days):
+    """Merge days into [first, last] runs of consecutive days"""
+    runs = []
+    for day in sorted(set(days)):
+        if runs and day == runs[-1][1] + timedelta(days=1):
+            runs[-1][1] = day
+        else:
+            runs.append([day, day])
+    return runs
+
+
+def _in_days(field, days):
+    """Q matching datetimes in `field` that fall on one of the days, as index-friendly ranges"""
+    tz = timezone.get_current_timezone()
+    condition = Q()
+    for first, last in _day_ranges(days):
+        condition |= Q(**{
+            f'{field}__gte': datetime.combine(first, time.min, tzinfo=tz),
+            f'{field}__lt': datetime.combine(last + timedelta(days=1), time.min, tzinfo=tz),
+        })
+    return condition
+
+
+def _sales_rows(days):
+    invoices = Invoice.objects.filter(_in_days('invoice_date', days)).order_by().annotate(day=TruncDate('invoice_date'))
+    for row in invoices.values('day', 'status').annotate(invoices=Count('id'), total=Sum('total_amount')):
+        yield DailySales(date=row['day'], status=row['status'], invoice_count=row['invoices'], total_amount=row['total'])
+
+    for row in invoices.values('day', 'customer_name', 'customer_email').annotate(invoices=Count('id'), total=Sum('total_amount')):
+        yield DailyCustomerSales(
+            date=row['day'], customer_name=row['customer_name'], customer_email=row['customer_email'],
+            invoice_count=row['invoices'], total_amount=row['total'],
+        )
+
+    lines = InvoiceLineItem.objects.filter(_in_days('invoice__invoice_date', days)).order_by().annotate(
+        day=TruncDate('invoice__invoice_date')
+    )
+    for row in lines.values('day', 'product').annotate(
+        units=Sum('quantity'),
+        revenue=Sum(F('quantity') * F('price_each'), output_field=DecimalField()),
+        prices=Sum('price_each'),
+        lines=Count('id'),
+    ):
+        yield DailyProductSales(
+            date=row['day'], product_id=row['product'], quantity=row['units'],
+            revenue=row['revenue'], price_total=row['prices'], line_count=row['lines'],
+        )
+
+
+def _purchase_rows(days):
+    orders = PurchaseOrder.objects.filter(_in_days('order_date', days)).order_by().annotate(day=TruncDate('order_date'))
+    for row in orders.values('day', 'vendor_name').annotate(orders=Count('id'), total=Sum('total_cost')):
+        yield DailyVendorPurchases(date=row['day'], vendor_name=row['vendor_name'], order_count=row['orders'], total_cost=row['total'])
+
+    lines = PurchaseOrderLineItem.objects.filter(_in_days('purchase_order__order_date', days)).order_by().annotate(
+        day=TruncDate('purchase_order__order_date')
+    )
+    for row in lines.values('day', 'product').annotate(units=Sum('quantity'), costs=Sum('cost_per_unit'), lines=Count('id')):
+        yield DailyProductPurchases(
+            date=row['day'], product_id=row['product'], quantity=row['units'], cost_total=row['costs'], line_count=row['lines'],
+        )
+
+
+ROLLUP_ROWS = {
+    'sales': _sales_rows,
+    'purchases': _purchase_rows,
+}
+
+
+@transaction.atomic
+def rebuild_days(kind, days, batch_size=5000):
+    """Recompute the rollups of one kind for the given days and return how many rows were written"""
+    days = sorted(set(days))
+    if not days:
+        return 0
+    for table in ROLLUP_TABLES[kind]:
+        table.objects.filter(date__in=days).delete()
+    rows = {}
+    for row in ROLLUP_ROWS[kind](days):
+        rows.setdefault(type(row), []).append(row)
+    for table, objs in rows.items():
+        table.objects.bulk_create(objs, batch_size=batch_size)
+    # The reports cached from these tables are out of date once this commits
+    bump_model_version(*ROLLUP_TABLES[kind])
+    return sum(len(objs) for objs in rows.values())
+
+
+def refresh_rollups(kinds=('sales', 'purchases')):
+    """
+    Recompute the days flagged since the last refresh and return how many there were.
+    When nothing changed this is a single query, so it can run every few seconds.
+    """
+    with transaction.atomic():
+        flags = RollupDirtyDay.objects.filter(kind__in=kinds).order_by('pk')
+        if connection.features.has_select_for_update_skip_locked:
+            # Flags locked by a concurrent refresh or a still open write are left for the next one
+            flags = flags.select_for_update(skip_locked=True)
+        flags = list(flags.values_list('pk', 'kind', 'date'))
+        if not flags:
+            return 0
+        for kind in kinds:
+            rebuild_days(kind, [date for _, flag_kind, date in flags if flag_kind == kind])
+        # Only the flags read above: ones written since belong to writes this refresh may not have seen
+        pks = [pk for pk, _, _ in flags]
+        for start in range(0, len(pks), FLAG_BATCH_SIZE):
+            RollupDirtyDay.objects.filter(pk__in=pks[start:start + FLAG_BATCH_SIZE]).delete()
+    return len({(kind, date) for _, kind, date in flags})
+
+
+def source_days(kind):
+    """Every day that has source rows for the given kind of rollup, in order"""
+    model, field = (Invoice, 'invoice_date') if kind == 'sales' else (PurchaseOrder, 'order_date')
+    return model.objects.order_by().annotate(day=TruncDate(field)).values_list('day', flat=True).distinct().order_by('day')
+
+
+def rebuild_rollups(kind, days_per_batch=31):
+    """
+    Recompute one kind of rollup from scratch, a batch of days per transaction,
+    and return how many rows were written. Flags raised before the rebuild
+    started are cleared; later ones are left for refresh_rollups().
+    """
+    flags = list(RollupDirtyDay.objects.filter(kind=kind).values_list('pk', flat=True))
+    with transaction.atomic():
+        for table in ROLLUP_TABLES[kind]:
+            table.objects.all().delete()
+        bump_model_version(*ROLLUP_TABLES[kind])
+    days = list(source_days(kind))
+    written = 0
+    for start in range(0, len(days), days_per_batch):
+        written += rebuild_days(kind, days[start:start + days_per_batch])
+    RollupDirtyDay.objects.filter(pk__in=flags).delete()
+    return written
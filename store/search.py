@@ -0,0 +1,166 @@
+"""
+Full-text search over the products' and invoices' search_document columns.
+
+PostgreSQL matches the document through a GIN index on its tsvector, SQLite through
+an FTS5 table that triggers keep in step with the table. Either way a search is an
+index lookup instead of a LIKE '%term%' scan per searched column, and results are
+ranked. Other databases (or SQLite builds without FTS5) fall back to the admin's
+icontains search.
+"""
+import functools
+import re
+from operator import or_
+
+from django.db import connections
+from django.db.models import Case, FloatField, Q, Value, When
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce
+
+# Tables with a search_document column
+SEARCH_TABLES = ('store_product', 'store_invoice')
+SEARCH_CONFIG = 'simple'
+
+
+class PostgresSearch:
+    """tsvector matching with prefix queries, ranked by ts_rank"""
+
+    @staticmethod
+    def index(name):
+        from django.contrib.postgres.indexes import GinIndex
+        from django.contrib.postgres.search import SearchVector
+
+        # The queries below must use this same expression for the index to serve them
+        return GinIndex(SearchVector('search_document', config=SEARCH_CONFIG), name=name)
+
+    def prefix(self, field, value):
+        # Served by the varchar_pattern_ops index PostgreSQL has on unique text columns
+        return Q(**{f'{field}__startswith': value})
+
+    def full_text(self, queryset, words):
+        from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+
+        terms = ' & '.join("'{}':*".format(word.replace('\\', '\\\\').replace("'", "\\'")) for word in words)
+        query = SearchQuery(terms, search_type='raw', config=SEARCH_CONFIG)
+        vector = SearchVector('search_document', config=SEARCH_CONFIG)
+        return queryset.alias(search_vector=vector), Q(search_vector=query), SearchRank(vector, query)
+
+
+class SqliteSearch:
+    """FTS5 matching with prefix queries, ranked by bm25"""
+
+    def prefix(self, field, value):
+        # A range rather than LIKE, which SQLite can't serve from a case-sensitive index
+        return Q(**{f'{field}__gte': value, f'{field}__lt': value + '\uffff'})
+
+    def full_text(self, queryset, words):
+        tokens = [token for word in words for token in re.findall(r'\w+', word.lower())]
+        if not tokens:
+            return queryset, Q(pk__in=[]), Value(0.0)
+        match = ' '.join(f'"{token}"*' for token in tokens)
+        table = queryset.model._meta.db_table
+        fts = f'{table}_search'
+        matches = Q(pk__in=RawSQL(f'SELECT rowid FROM {fts} WHERE {fts} MATCH %s', [match]))
+        # bm25() is lower for better matches
+        rank = RawSQL(
+            f'SELECT -bm25({fts}) FROM {fts} WHERE {fts} MATCH %s AND rowid = {table}.{queryset.model._meta.pk.column}',
+            [match], output_field=FloatField(),
+        )
+        return queryset, matches, rank
+
+
+@functools.cache
+def _has_fts5(alias):
+    with connections[alias].cursor() as cursor:
+        cursor.execute('PRAGMA compile_options')
+        return any(option == 'ENABLE_FTS5' for option, in cursor.fetchall())
+
+
+def get_backend(alias):
+    """The full-text backend for a database alias, or None to use icontains"""
+    connection = connections[alias]
+    if connection.vendor == 'postgresql':
+        return PostgresSearch()
+    if connection.vendor == 'sqlite' and _has_fts5(alias):
+        return SqliteSearch()
+    return None
+
+
+def search(queryset, search_term):
+    """
+    Narrow `queryset` to the rows whose search document has every word of
+    `search_term` (as a word prefix), or whose identifier (SKU, invoice number)
+    starts with it. Rows are annotated with search_tier (2 for an exact identifier,
+    1 for an identifier prefix, else 0) and search_rank (the text relevance) for
+    ordering. Returns None when the database has no full-text backend.
+    """
+    backend = get_backend(queryset.db)
+    words = search_term.split()
+    if backend is None or not words:
+        return None
+    field = queryset.model.search_identifier
+    identifiers = {search_term.strip(), search_term.strip().upper()}
+    exact = Q(**{f'{field}__in': identifiers})
+    prefix = functools.reduce(or_, (backend.prefix(field, value) for value in identifiers))
+    queryset, matches, rank = backend.full_text(queryset, words)
+    return queryset.filter(matches | prefix).annotate(
+        search_tier=Case(When(exact, then=Value(2)), When(prefix, then=Value(1)), default=Value(0)),
+        search_rank=Coalesce(rank, Value(0.0), output_field=FloatField()),
+    )
+
+
+def _sqlite_has_column(cursor, connection, table, column):
+    return column in {info.name for info in connection.introspection.get_table_description(cursor, table)}
+
+
+def install_sqlite_search(connection):
+    """
+    Create the FTS5 tables and the triggers that keep them in step with the searched
+    tables, rebuilding an index whose triggers were missing. Rebuilding a table in a
+    migration drops its triggers, so this also runs after every migrate.
+    """
+    if connection.vendor != 'sqlite' or not _has_fts5(connection.alias):
+        return
+    with connection.cursor() as cursor:
+        tables = set(connection.introspection.table_names(cursor))
+        for table in SEARCH_TABLES:
+            if table not in tables or not _sqlite_has_column(cursor, connection, table, 'search_document'):
+                continue
+            fts = f'{table}_search'
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+                f"search_document, content='{table}', content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+            )
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = %s", [table])
+            triggers = {name for name, in cursor.fetchall()}
+            if {f'{fts}_insert', f'{fts}_delete', f'{fts}_update'} <= triggers:
+                continue
+            cursor.execute(f'DROP TRIGGER IF EXISTS {fts}_insert')
+            cursor.execute(f'DROP TRIGGER IF EXISTS {fts}_delete')
+            cursor.execute(f'DROP TRIGGER IF EXISTS {fts}_update')
+            cursor.execute(
+                f'CREATE TRIGGER {fts}_insert AFTER INSERT ON {table} BEGIN '
+                f'INSERT INTO {fts}(rowid, search_document) VALUES (new.id, new.search_document); END'
+            )
+            cursor.execute(
+                f'CREATE TRIGGER {fts}_delete AFTER DELETE ON {table} BEGIN '
+                f"INSERT INTO {fts}({fts}, rowid, search_document) VALUES ('delete', old.id, old.search_document); END"
+            )
+            # Stock and status updates leave the document alone and skip the index
+            cursor.execute(
+                f'CREATE TRIGGER {fts}_update AFTER UPDATE ON {table} '
+                f'WHEN old.search_document IS NOT new.search_document BEGIN '
+                f"INSERT INTO {fts}({fts}, rowid, search_document) VALUES ('delete', old.id, old.search_document); "
+                f'INSERT INTO {fts}(rowid, search_document) VALUES (new.id, new.search_document); END'
+            )
+            cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def uninstall_sqlite_search(connection):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for table in SEARCH_TABLES:
+            fts = f'{table}_search'
+            for trigger in ('insert', 'delete', 'update'):
+                cursor.execute(f'DROP TRIGGER IF EXISTS {fts}_{trigger}')
+            cursor.execute(f'DROP TABLE IF EXISTS {fts}')
@@ -0,0 +1,127 @@
+"""
+Deterministic data generator used to seed large volumes for benchmarks
+"""
+import random
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.utils import timezone
+
+from .models import Invoice, InvoiceLineItem, Product, PurchaseOrder, PurchaseOrderLineItem
+
+INVOICE_STATUSES = ['draft', 'sent', 'sent', 'paid', 'paid', 'paid', 'cancelled', 'overdue']
+
+
+class DataGenerator:
+    """
+    Seeds products and invoices with bulk inserts. The same seed always
+    produces the same rows, so benchmark runs are comparable.
+    """
+
+    def __init__(self, seed=42, batch_size=5000, days=730, customers=5000):
+        self.random = random.Random(seed)
+        self.batch_size = batch_size
+        self.days = days
+        self.customers = customers
+        self.end_date = timezone.now().date()
+        self._product_ids = []
+        self._product_seq = Product.objects.filter(sku__startswith='BENCH-').count()
+        self._invoice_seq = Invoice.objects.filter(invoice_number__startswith='BENCH-').count()
+        self._order_seq = PurchaseOrder.objects.filter(order_number__startswith='BENCH-').count()
+
+    def _batches(self, count):
+        while count > 0:
+            size = min(count, self.batch_size)
+            yield size
+            count -= size
+
+    def products(self, count):
+        """Create `count` products and return how many were created"""
+        for size in self._batches(count):
+            batch = []
+            for _ in range(size):
+                self._product_seq += 1
+                batch.append(Product(
+                    name=f'Benchmark Product {self._product_seq}',
+                    sku=f'BENCH-{self._product_seq:08d}',
+                    unit_price=Decimal(self.random.randint(100, 100000)) / 100,
+                    stock_quantity=self.random.randint(0, 500),
+                ))
+            Product.objects.bulk_create(batch)
+        self._product_ids = []
+        return count
+
+    def _products(self):
+        if not self._product_ids:
+            self._product_ids = list(Product.objects.values_list('pk', flat=True))
+            if not self._product_ids:
+                self.products(100)
+                self._product_ids = list(Product.objects.values_list('pk', flat=True))
+        return self._product_ids
+
+    def invoices(self, count, lines_per_invoice=1):
+        """Create `count` invoices with `lines_per_invoice` line items each"""
+        product_ids = self._products()
+        lines_per_invoice = min(lines_per_invoice, len(product_ids))
+        tz = timezone.get_current_timezone()
+        for size in self._batches(count):
+            invoices = []
+            for _ in range(size):
+                self._invoice_seq += 1
+                customer = self.random.randrange(self.customers)
+                invoice_date = self.end_date - timedelta(days=self.random.randrange(self.days))
+                invoices.append(Invoice(
+                    invoice_number=f'BENCH-{self._invoice_seq:010d}',
+                    customer_name=f'Customer {customer}',
+                    customer_email=f'customer{customer}@example.com',
+                    billing_address=f'{customer} Benchmark Street',
+                    invoice_date=timezone.make_aware(datetime.combine(invoice_date, time(12)), tz),
+                    due_date=invoice_date + timedelta(days=30),
+                    status=self.random.choice(INVOICE_STATUSES),
+                ))
+            numbers = [invoice.invoice_number for invoice in invoices]
+            Invoice.objects.bulk_create(invoices)
+            # Not every backend returns primary keys from bulk inserts
+            invoice_ids = Invoice.objects.filter(invoice_number__in=numbers).values_list('pk', flat=True)
+            line_items = []
+            for invoice_id in invoice_ids:
+                for product_id in self.random.sample(product_ids, lines_per_invoice):
+                    line_items.append(InvoiceLineItem(
+                        invoice_id=invoice_id,
+                        product_id=product_id,
+                        quantity=self.random.randint(1, 20),
+                        price_each=Decimal(self.random.randint(100, 100000)) / 100,
+                    ))
+            InvoiceLineItem.objects.bulk_create(line_items, batch_size=self.batch_size)
+        return count
+
+    def purchase_orders(self, count, lines_per_order=1, vendors=200):
+        """Create `count` purchase orders with `lines_per_order` line items each"""
+        product_ids = self._products()
+        lines_per_order = min(lines_per_order, len(product_ids))
+        tz = timezone.get_current_timezone()
+        for size in self._batches(count):
+            orders = []
+            for _ in range(size):
+                self._order_seq += 1
+                order_date = self.end_date - timedelta(days=self.random.randrange(self.days))
+                orders.append(PurchaseOrder(
+                    order_number=f'BENCH-{self._order_seq:010d}',
+                    vendor_name=f'Vendor {self.random.randrange(vendors)}',
+                    order_date=timezone.make_aware(datetime.combine(order_date, time(9)), tz),
+                    status=self.random.choice(['pending', 'ordered', 'received', 'received']),
+                ))
+            numbers = [order.order_number for order in orders]
+            PurchaseOrder.objects.bulk_create(orders)
+            order_ids = PurchaseOrder.objects.filter(order_number__in=numbers).values_list('pk', flat=True)
+            line_items = []
+            for order_id in order_ids:
+                for product_id in self.random.sample(product_ids, lines_per_order):
+                    line_items.append(PurchaseOrderLineItem(
+                        purchase_order_id=order_id,
+                        product_id=product_id,
+                        quantity=self.random.randint(10, 200),
+                        cost_per_unit=Decimal(self.random.randint(50, 50000)) / 100,
+                    ))
+            PurchaseOrderLineItem.objects.bulk_create(line_items, batch_size=self.batch_size)
+        return count
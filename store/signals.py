@@ -0,0 +1,154 @@
+import weakref
+
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_migrate, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .cache import bump_model_version
+from .inventory import release_reservations
+from . import profiling
+from .models import (
+    InventoryMovement,
+    Invoice,
+    InvoiceLineItem,
+    Product,
+    PurchaseOrder,
+    PurchaseOrderLineItem,
+    RollupDirtyDay,
+    StockReservation,
+    StoreCounter,
+)
+from .search import install_sqlite_search
+
+COUNTED_MODELS = {
+    Product: 'product_count',
+    PurchaseOrder: 'purchase_order_count',
+    Invoice: 'invoice_count',
+}
+
+# The value counter of each document and the stored total it adds up
+VALUE_COUNTERS = {
+    PurchaseOrder: ('total_purchase_value', 'total_cost'),
+    Invoice: ('total_invoice_value', 'total_amount'),
+}
+
+# Parents whose totals a delete in progress has already refreshed, by the delete's origin
+_refreshed_parents = weakref.WeakKeyDictionary()
+
+
+def _deletes_parents(parent_model, origin):
+    """Whether the delete was started on the parent documents, which go with their line items"""
+    return isinstance(origin, parent_model) or (isinstance(origin, QuerySet) and origin.model is parent_model)
+
+
+@receiver(pre_delete, sender=InvoiceLineItem)
+@receiver(pre_delete, sender=PurchaseOrderLineItem)
+def forget_refreshed_parent(sender, instance, origin=None, **kwargs):
+    """A delete is starting: the parents of its line items haven't been refreshed by it yet"""
+    # The collector sends every pre_delete before it deletes anything, so a
+    # repeated delete from the same origin refreshes its parents again
+    if origin is not None and origin in _refreshed_parents:
+        _refreshed_parents[origin].discard(getattr(instance, f'{sender.parent_field}_id'))
+
+
+@receiver(post_delete, sender=InvoiceLineItem)
+@receiver(post_delete, sender=PurchaseOrderLineItem)
+def refresh_parent_totals_on_delete(sender, instance, using, origin=None, **kwargs):
+    """Keep the parent document's stored totals in sync when line items are deleted"""
+    parent_model = sender._meta.get_field(sender.parent_field).related_model
+    if _deletes_parents(parent_model, origin):
+        return
+    parent_id = getattr(instance, f'{sender.parent_field}_id')
+    # The collector deletes all the line items before sending post_delete, so one
+    # refresh per parent covers every line item it lost in this delete
+    refreshed = _refreshed_parents.setdefault(origin, set()) if origin is not None else set()
+    if parent_id in refreshed:
+        return
+    refreshed.add(parent_id)
+    # Deletions run inside the collector's transaction, including cascades and queryset deletes
+    parent_model.objects.using(using).filter(pk=parent_id).refresh_totals()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=PurchaseOrder)
+@receiver(post_save, sender=Invoice)
+def count_created(sender, instance, created, using, raw=False, **kwargs):
+    """Increment the home page counter for a newly created row"""
+    if created and not raw:
+        StoreCounter.objects.adjust(using=using, **{COUNTED_MODELS[sender]: 1})
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=PurchaseOrder)
+@receiver(post_delete, sender=Invoice)
+def count_deleted(sender, instance, using, **kwargs):
+    """Decrement the home page counters for a deleted row"""
+    deltas = {COUNTED_MODELS[sender]: -1}
+    if sender in VALUE_COUNTERS:
+        # Its line items went with it without refreshing its totals, so subtract the stored total
+        counter, field = VALUE_COUNTERS[sender]
+        deltas[counter] = -getattr(instance, field)
+    StoreCounter.objects.adjust(using=using, **deltas)
+
+
+@receiver(pre_delete, sender=PurchaseOrder)
+@receiver(pre_delete, sender=Invoice)
+def load_stored_total(sender, instance, using, origin=None, **kwargs):
+    """Read the stored total of a document deleted on its own, whose instance may predate it"""
+    # Documents deleted through a queryset or a cascade were just read by the collector
+    if origin is instance and StoreCounter.objects.enabled():
+        instance.refresh_from_db(using=using, fields=[VALUE_COUNTERS[sender][1]])
+
+
+@receiver(post_delete, sender=PurchaseOrder)
+@receiver(post_delete, sender=Invoice)
+def mark_rollup_day_on_delete(sender, instance, using, **kwargs):
+    """Flag the deleted document's day for the daily rollups"""
+    day = getattr(instance, sender.rollup_date_field)
+    RollupDirtyDay.objects.mark(sender.rollup_kind, [timezone.localdate(day)], using=using)
+
+
+@receiver(post_save, sender=Product)
+def record_opening_stock(sender, instance, created, using, raw=False, **kwargs):
+    """Start a new product's ledger with the stock it was created with"""
+    if created and not raw and instance.stock_quantity:
+        InventoryMovement.objects.using(using).create(
+            product=instance, quantity=instance.stock_quantity, reason='opening', created_at=instance.created_at
+        )
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=PurchaseOrder)
+@receiver(post_save, sender=PurchaseOrderLineItem)
+@receiver(post_save, sender=Invoice)
+@receiver(post_save, sender=InvoiceLineItem)
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=PurchaseOrder)
+@receiver(post_delete, sender=PurchaseOrderLineItem)
+@receiver(post_delete, sender=Invoice)
+@receiver(post_delete, sender=InvoiceLineItem)
+def bump_version_on_write(sender, using, **kwargs):
+    """Invalidate the cached reports that read the written table"""
+    bump_model_version(sender, using=using)
+
+
+@receiver(pre_delete, sender=Invoice)
+def release_reservations_on_delete(sender, instance, **kwargs):
+    """Return the stock held by an invoice before its reservations are deleted with it"""
+    release_reservations(StockReservation.objects.filter(invoice=instance, status='reserved'))
+
+
+@receiver(post_migrate)
+def reinstall_search_triggers(sender, using, **kwargs):
+    """Migrations that rebuild a table on SQLite drop its search triggers; put them back"""
+    if sender.name == 'store':
+        install_sqlite_search(connections[using])
+
+
+@receiver(connection_created)
+def install_query_profiling(sender, connection, **kwargs):
+    """Let ProfilingMiddleware time the queries run on new connections"""
+    profiling.install(connection)
@@ -0,0 +1,98 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, DecimalField, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from .models import Invoice, Product, PurchaseOrder, StoreCounter
+
+
+def _table_totals(queryset, **aggregates):
+    """
+    Aggregate over the whole queryset as a single row. Unlike aggregate() the result
+    stays a queryset, so it can be nested as a scalar Subquery in another query.
+    """
+    return queryset.order_by().annotate(_row=Value(1)).values('_row').annotate(**aggregates)
+
+
+def _scalar(queryset, **aggregates):
+    """A whole-table aggregate as a scalar subquery"""
+    (name,) = aggregates
+    return Subquery(_table_totals(queryset, **aggregates).values(name))
+
+
+class StoreStats:
+    """
+    Statistics shown on the public home page, computed in a single round trip.
+    With STORE_STATS_USE_COUNTERS the counts and totals are read from the counters
+    table instead of scanning the invoices and purchase orders.
+    """
+    LOW_STOCK_THRESHOLD = 10
+    INTEGER_STATS = (
+        'product_count',
+        'purchase_order_count',
+        'invoice_count',
+        'overdue_invoices_count',
+        'low_stock_products_count',
+    )
+
+    def __init__(self, use_counters=None):
+        if use_counters is None:
+            use_counters = getattr(settings, 'STORE_STATS_USE_COUNTERS', False)
+        self.use_counters = use_counters
+
+    def _live_counts(self):
+        """The statistics that depend on invoice statuses or stock levels, as indexed counts"""
+        return {
+            'overdue_invoices_count': _scalar(
+                Invoice.objects.filter(status='overdue'),
+                count=Count('id'),
+            ),
+            'low_stock_products_count': _scalar(
+                Product.objects.filter(stock_quantity__lt=self.LOW_STOCK_THRESHOLD),
+                count=Count('id'),
+            ),
+        }
+
+    def _counters_query(self):
+        counters = {
+            name: Coalesce(Sum('value', filter=Q(name=name)), Value(0), output_field=DecimalField())
+            for name in StoreCounter.COUNTER_NAMES
+        }
+        return _table_totals(StoreCounter.objects.all(), **counters).annotate(**self._live_counts())
+
+    def _full_query(self):
+        money = DecimalField()
+        return _table_totals(
+            Product.objects.all(),
+            product_count=Count('id'),
+        ).annotate(
+            purchase_order_count=_scalar(PurchaseOrder.objects.all(), count=Count('id')),
+            total_purchase_value=_scalar(
+                PurchaseOrder.objects.all(),
+                total=Coalesce(Sum('total_cost'), Value(0), output_field=money),
+            ),
+            invoice_count=_scalar(Invoice.objects.all(), count=Count('id')),
+            total_invoice_value=_scalar(
+                Invoice.objects.all(),
+                total=Coalesce(Sum('total_amount'), Value(0), output_field=money),
+            ),
+            **self._live_counts()
+        )
+
+    def get(self):
+        """Return the home page statistics as a dict"""
+        query = self._counters_query() if self.use_counters else self._full_query()
+        stats = query.values(
+            *StoreCounter.COUNTER_NAMES, 'overdue_invoices_count', 'low_stock_products_count'
+        ).get()
+        for name in self.INTEGER_STATS:
+            stats[name] = int(stats[name] or 0)
+        return stats
+
+    def rebuild_counters(self):
+        """Recompute the counters table from the source tables"""
+        stats = StoreStats(use_counters=False).get()
+        with transaction.atomic():
+            for name in StoreCounter.COUNTER_NAMES:
+                StoreCounter.objects.update_or_create(name=name, defaults={'value': stats[name]})
+        return stats
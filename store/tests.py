@@ -1,3 +1,763 @@
-from django.test import TestCase
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import openpyxl
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import IntegrityError, connection, connections
+from django.db.models import Avg, Count, DecimalField, F, Sum
+from django.db.models.sql import compiler
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import api, dashboard, exports, profiling, queries
+from .cache import StillComputing, get_or_compute, stats, versioned_key
+from .exports import InvoiceWorkbook, iter_product_csv
+from .imports import ProductImporter
+from .ingest import ingest_invoices
+from .inventory import InsufficientStock, reserve_stock, with_retry
+from .jobs import MAX_ATTEMPTS, STALE_AFTER, _selected, claim_next_job, run_job
+from .plans import run_checks
+from .rollups import refresh_rollups
+from .models import (
+    InventoryMovement, Invoice, InvoiceLineItem, InvoiceStatusChange, Job, Product, PurchaseOrder, PurchaseOrderLineItem, StockReservation,
+    StoreCounter,
+)
+from .seeding import DataGenerator
+from .transitions import source_statuses, transition_invoices
+
+
+class ChangelistQueryCountTests(TestCase):
+    """The store changelists run a fixed number of queries however many rows they show"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+        cls.generator = DataGenerator(seed=1, days=30)
+        cls.generator.products(10)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def get_changelist(self, model_name):
+        response = self.client.get(reverse(f'admin:store_{model_name}_changelist'))
+        self.assertEqual(response.status_code, 200)
+
+    def assert_changelist_queries(self, model_name, expected, add_rows):
+        add_rows(3)
+        with CaptureQueriesContext(connection) as few:
+            self.get_changelist(model_name)
+        add_rows(40)
+        # Session, user, count, page keys, page rows, and the date hierarchy where there is one
+        with self.assertNumQueries(expected):
+            self.get_changelist(model_name)
+        self.assertEqual(len(few.captured_queries), expected)
+
+    def test_invoice_changelist(self):
+        self.assert_changelist_queries('invoice', 7, lambda count: self.generator.invoices(count, lines_per_invoice=3))
+
+    def test_purchase_order_changelist(self):
+        self.assert_changelist_queries(
+            'purchaseorder', 7, lambda count: self.generator.purchase_orders(count, lines_per_order=3)
+        )
+
+    def test_product_changelist(self):
+        self.assert_changelist_queries('product', 5, self.generator.products)
+
+
+class GetOrComputeTests(SimpleTestCase):
+    """Stampede protection: concurrent callers share one computation"""
+    key = 'test:get_or_compute'
+
+    def setUp(self):
+        cache.clear()
+        stats.reset()
+        self.computes = 0
+        self.lock = threading.Lock()
+
+    def slow_compute(self, value, seconds=0.3):
+        def compute():
+            with self.lock:
+                self.computes += 1
+            time.sleep(seconds)
+            return value
+        return compute
+
+    def run_concurrently(self, func, callers=8):
+        barrier = threading.Barrier(callers)
+        results = []
+
+        def call():
+            barrier.wait()
+            result = func()
+            with self.lock:
+                results.append(result)
+        threads = [threading.Thread(target=call) for _ in range(callers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_concurrent_misses_compute_once(self):
+        results = self.run_concurrently(lambda: get_or_compute(self.key, self.slow_compute('new')))
+        self.assertEqual(self.computes, 1)
+        self.assertEqual(results, ['new'] * 8)
+
+    def test_concurrent_expiry_serves_stale_while_one_refreshes(self):
+        cache.set(self.key, {'value': 'old', 'expires': time.time() - 1, 'delta': 0.01}, 600)
+        results = self.run_concurrently(lambda: get_or_compute(self.key, self.slow_compute('new')))
+        self.assertEqual(self.computes, 1)
+        self.assertEqual(results.count('new'), 1)
+        self.assertEqual(results.count('old'), 7)
+        self.assertEqual(stats.snapshot()['stale_hits'], 7)
+        self.assertEqual(get_or_compute(self.key, self.slow_compute('newer')), 'new')
+
+    def test_versioned_values_do_not_expire(self):
+        self.assertEqual(get_or_compute(self.key, self.slow_compute('old', seconds=0), ttl=None), 'old')
+        with mock.patch('store.cache.time.time', return_value=time.time() + 24 * 60 * 60):
+            self.assertEqual(get_or_compute(self.key, self.slow_compute('new', seconds=0), ttl=None), 'old')
+        self.assertEqual(self.computes, 1)
+
+    def test_abandoned_lock_expires(self):
+        # A caller that died mid-computation leaves its lock until lock_timeout
+        cache.add(f'{self.key}:lock', True, 1)
+        start = time.monotonic()
+        value = get_or_compute(self.key, self.slow_compute('new', seconds=0), wait_timeout=5)
+        self.assertEqual(value, 'new')
+        self.assertEqual(self.computes, 1)
+        self.assertLess(time.monotonic() - start, 4)
+
+    def test_waiter_computes_after_wait_timeout(self):
+        cache.add(f'{self.key}:lock', True, 60)
+        value = get_or_compute(self.key, self.slow_compute('new', seconds=0), wait_timeout=0.2)
+        self.assertEqual(value, 'new')
+        self.assertEqual(self.computes, 1)
+
+    def test_waiter_gives_up_without_compute_after_wait(self):
+        cache.add(f'{self.key}:lock', True, 60)
+        with self.assertRaises(StillComputing):
+            get_or_compute(self.key, self.slow_compute('new', seconds=0), wait_timeout=0.2, compute_after_wait=False)
+        self.assertEqual(self.computes, 0)
+
+    def test_waiter_gets_the_value_computed_meanwhile(self):
+        cache.add(f'{self.key}:lock', True, 60)
+        timer = threading.Timer(0.1, lambda: cache.set(self.key, {'value': 'theirs', 'expires': time.time() + 60, 'delta': 0}, 60))
+        timer.start()
+        value = get_or_compute(self.key, self.slow_compute('mine', seconds=0), wait_timeout=2, compute_after_wait=False)
+        timer.join()
+        self.assertEqual(value, 'theirs')
+        self.assertEqual(self.computes, 0)
+
+
+class VersionedKeyTests(TestCase):
+    """Model versions live in the database, so every process builds the same keys"""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_versions_are_shared(self):
+        key = versioned_key('report', Invoice, Product)
+        # Another process's cache knows nothing of this one's, but the versions are the same
+        cache.clear()
+        self.assertEqual(versioned_key('report', Invoice, Product), key)
+
+    def test_committed_write_changes_the_key(self):
+        key = versioned_key('report', Invoice, Product)
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(name='New', sku='NEW-1', unit_price=1)
+        changed = versioned_key('report', Invoice, Product)
+        self.assertNotEqual(changed, key)
+        self.assertEqual(changed.split(':')[1], key.split(':')[1])
+
+    def test_uncommitted_write_keeps_the_key(self):
+        key = versioned_key('report', Product)
+        with self.captureOnCommitCallbacks() as callbacks:
+            Product.objects.create(name='New', sku='NEW-1', unit_price=1)
+        # The bump waits for the commit, which never happens in a TestCase
+        self.assertTrue(callbacks)
+        self.assertEqual(versioned_key('report', Product), key)
+
+
+@override_settings(STORE_STATS_USE_COUNTERS=True)
+class StoreCounterTests(TestCase):
+    """The shared home page counters are updated after the write commits, not inside it"""
+
+    def count(self):
+        return StoreCounter.objects.get(name='product_count').value
+
+    def test_counted_after_commit(self):
+        before = self.count()
+        with self.captureOnCommitCallbacks() as callbacks:
+            with CaptureQueriesContext(connection) as captured:
+                Product.objects.create(name='New', sku='NEW-1', unit_price=1)
+            self.assertFalse([query for query in captured.captured_queries if 'store_storecounter' in query['sql']])
+            self.assertEqual(self.count(), before)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.count(), before + 1)
+
+
+@override_settings(STORE_STATS_USE_COUNTERS=True)
+class LineItemDeleteTests(TestCase):
+    """Deleting line items refreshes each parent's totals once, and not at all when the parent goes too"""
+
+    @classmethod
+    def setUpTestData(cls):
+        generator = DataGenerator(seed=6, days=30)
+        generator.products(5)
+        generator.invoices(3, lines_per_invoice=4)
+
+    def invoice_updates(self, captured):
+        return [query for query in captured.captured_queries if query['sql'].startswith('UPDATE "store_invoice"')]
+
+    def test_parent_delete_skips_the_refresh(self):
+        invoice = Invoice.objects.order_by('pk').first()
+        value = StoreCounter.objects.get(name='total_invoice_value').value
+        with self.captureOnCommitCallbacks(execute=True):
+            with CaptureQueriesContext(connection) as captured:
+                invoice.delete()
+        self.assertEqual(self.invoice_updates(captured), [])
+        self.assertEqual(StoreCounter.objects.get(name='total_invoice_value').value, value - invoice.total_amount)
+
+    def test_one_refresh_per_parent(self):
+        invoices = list(Invoice.objects.order_by('pk')[:2])
+        lines = InvoiceLineItem.objects.filter(invoice__in=invoices)
+        with CaptureQueriesContext(connection) as captured:
+            lines.delete()
+        self.assertEqual(len(self.invoice_updates(captured)), 2)
+        self.assertEqual(set(Invoice.objects.filter(pk__in=[invoice.pk for invoice in invoices]).values_list('total_amount', flat=True)), {0})
+        # Deleting from the same queryset again refreshes the parents again
+        InvoiceLineItem.objects.create(invoice=invoices[0], product=Product.objects.first(), quantity=1, price_each=3)
+        lines.delete()
+        self.assertEqual(Invoice.objects.get(pk=invoices[0].pk).total_amount, 0)
+
+
+class ReportAggregateTests(TestCase):
+    """The rewritten reports agree with the plain ORM aggregates over the line items"""
+
+    @classmethod
+    def setUpTestData(cls):
+        generator = DataGenerator(seed=2, days=90, customers=20)
+        generator.products(15)
+        generator.invoices(60, lines_per_invoice=4)
+        generator.purchase_orders(25, lines_per_order=3)
+        refresh_rollups()
+
+    def setUp(self):
+        cache.clear()
+
+    def line_total(self, quantity, price):
+        return Sum(F(quantity) * F(price), output_field=DecimalField())
+
+    def assertAmountsEqual(self, actual, expected):
+        self.assertEqual(
+            {key: Decimal(value or 0).quantize(Decimal('0.01')) for key, value in actual.items()},
+            {key: Decimal(value or 0).quantize(Decimal('0.01')) for key, value in expected.items()},
+        )
+
+    def test_product_sales(self):
+        rows = list(queries.get_product_sales_analysis())
+        naive = Product.objects.annotate(
+            quantity_sold=Sum('invoicelineitem__quantity'),
+            total_revenue=self.line_total('invoicelineitem__quantity', 'invoicelineitem__price_each'),
+        ).filter(quantity_sold__gt=0)
+        self.assertTrue(rows)
+        self.assertEqual({row.pk: row.quantity_sold for row in rows}, {row.pk: row.quantity_sold for row in naive})
+        self.assertAmountsEqual({row.pk: row.total_revenue for row in rows}, {row.pk: row.total_revenue for row in naive})
+
+    def test_reads_wait_for_a_refresh(self):
+        before = {row.pk: row.quantity_sold for row in queries.get_product_sales_analysis()}
+        DataGenerator(seed=3, days=90, customers=20).invoices(5, lines_per_invoice=4)
+        self.assertEqual({row.pk: row.quantity_sold for row in queries.get_product_sales_analysis()}, before)
+        self.assertGreater(refresh_rollups(), 0)
+        self.assertNotEqual({row.pk: row.quantity_sold for row in queries.get_product_sales_analysis()}, before)
+        self.assertEqual(refresh_rollups(), 0)
+
+    def test_profit_margin_averages(self):
+        rows = list(queries.get_product_profit_margin())
+        self.assertTrue(rows)
+        purchase = dict(PurchaseOrderLineItem.objects.values('product').annotate(average=Avg('cost_per_unit')).values_list('product', 'average'))
+        sales = dict(InvoiceLineItem.objects.values('product').annotate(average=Avg('price_each')).values_list('product', 'average'))
+        self.assertEqual({row.pk for row in rows}, set(purchase) & set(sales))
+        self.assertAmountsEqual({row.pk: row.avg_purchase_price for row in rows}, {row.pk: purchase[row.pk] for row in rows})
+        self.assertAmountsEqual({row.pk: row.avg_sales_price for row in rows}, {row.pk: sales[row.pk] for row in rows})
+
+    def test_vendor_purchase_summary(self):
+        rows = {row['vendor_name']: row for row in queries.get_vendor_purchase_summary()}
+        orders = dict(PurchaseOrder.objects.values('vendor_name').annotate(count=Count('id')).values_list('vendor_name', 'count'))
+        spent = dict(PurchaseOrderLineItem.objects.values('purchase_order__vendor_name').annotate(
+            total=self.line_total('quantity', 'cost_per_unit')
+        ).values_list('purchase_order__vendor_name', 'total'))
+        self.assertTrue(rows)
+        self.assertEqual({vendor: row['order_count'] for vendor, row in rows.items()}, orders)
+        self.assertAmountsEqual({vendor: row['total_spent'] for vendor, row in rows.items()}, spent)
+
+    def test_customers_by_revenue(self):
+        rows = {(row['customer_name'], row['customer_email']): row for row in queries.get_customers_by_revenue()}
+        invoices = Invoice.objects.values_list('customer_name', 'customer_email')
+        counts = {key: 0 for key in invoices}
+        for key in invoices:
+            counts[key] += 1
+        spent = {
+            (row['invoice__customer_name'], row['invoice__customer_email']): row['total']
+            for row in InvoiceLineItem.objects.values('invoice__customer_name', 'invoice__customer_email').annotate(
+                total=self.line_total('quantity', 'price_each')
+            )
+        }
+        self.assertTrue(rows)
+        self.assertEqual({key: row['invoice_count'] for key, row in rows.items()}, counts)
+        self.assertAmountsEqual({key: row['total_spent'] for key, row in rows.items()}, spent)
+
+    def test_invoice_status_totals(self):
+        spent = {
+            row['invoice__status']: row['total']
+            for row in InvoiceLineItem.objects.values('invoice__status').annotate(total=self.line_total('quantity', 'price_each'))
+        }
+        counts = dict(Invoice.objects.values('status').annotate(count=Count('id')).values_list('status', 'count'))
+        for rows, total in [
+            (queries.get_invoices_by_status_with_totals(), 'total_amount'),
+            (queries.get_invoice_status_summary(), 'status_total'),
+        ]:
+            self.assertEqual({row['status']: row['count'] for row in rows}, counts)
+            self.assertAmountsEqual({row['status']: row[total] for row in rows}, spent)
+
+
+class ReportETagTests(TestCase):
+    """A report's ETag and cached body follow its resolved parameters, defaults included"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+        self.url = reverse('store:api_report', args=['monthly-sales'])
+
+    def test_default_year_changes_the_etag(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.json()['parameters'], {'year': timezone.now().year})
+        next_year = timezone.now().year + 1
+        with mock.patch.dict(api.REPORTS['monthly-sales'].defaults, {'year': lambda: next_year}):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['parameters'], {'year': next_year})
+
+    def test_unchanged_report_is_not_modified(self):
+        response = self.client.get(self.url)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_same_etag_in_every_worker(self):
+        etag = self.client.get(self.url)['ETag']
+        # A worker with an empty cache of its own
+        cache.clear()
+        self.assertEqual(self.client.get(self.url)['ETag'], etag)
+
+    def test_committed_write_changes_the_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Invoice.objects.create(
+                invoice_number='ETAG-1', customer_name='Customer', customer_email='customer@example.com',
+                billing_address='1 Street', due_date=timezone.localdate(),
+            )
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class TransitionTests(TestCase):
+    """Set-based transitions move exactly the eligible invoices, a batch at a time"""
+
+    @classmethod
+    def setUpTestData(cls):
+        generator = DataGenerator(seed=3, days=30)
+        generator.products(5)
+        generator.invoices(40)
+        cls.product = Product.objects.order_by('pk').first()
+
+    def test_cancel_in_batches(self):
+        eligible = set(Invoice.objects.filter(status__in=source_statuses('cancelled')).values_list('pk', flat=True))
+        untouched = dict(Invoice.objects.exclude(pk__in=eligible).values_list('pk', 'status'))
+        for invoice in Invoice.objects.filter(pk__in=eligible):
+            reserve_stock([(self.product.pk, 1)], invoice)
+        stock = Product.objects.get(pk=self.product.pk).stock_quantity
+
+        with CaptureQueriesContext(connection) as captured:
+            moved = transition_invoices(Invoice.objects.all(), 'cancelled', batch_size=7)
+
+        self.assertEqual(moved, len(eligible))
+        self.assertEqual(set(Invoice.objects.filter(status='cancelled').values_list('pk', flat=True)), eligible | {
+            pk for pk, status in untouched.items() if status == 'cancelled'
+        })
+        self.assertEqual(dict(Invoice.objects.exclude(pk__in=eligible).values_list('pk', 'status')), untouched)
+        self.assertEqual(InvoiceStatusChange.objects.filter(to_status='cancelled').count(), moved)
+        self.assertFalse(StockReservation.objects.filter(status='reserved').exists())
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock_quantity, stock + moved)
+        # The invoices are updated by key, not found again through the history table
+        updates = [query['sql'] for query in captured.captured_queries if query['sql'].startswith('UPDATE "store_invoice"')]
+        self.assertEqual(len(updates), -(-moved // 7))
+        self.assertFalse([sql for sql in updates if 'store_invoicestatuschange' in sql])
+
+
+@override_settings(STORE_DASHBOARD_WORKERS=0)
+class InlineDashboardTests(TestCase):
+    """With no pool, the dashboard's reports run on the request's connection, and only read"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+        generator = DataGenerator(seed=4, days=30)
+        generator.products(5)
+        generator.invoices(20, lines_per_invoice=2)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def test_reports_see_the_open_transaction(self):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(reverse('store:dashboard'))
+        self.assertEqual(response.status_code, 200)
+        summary = response.context['invoice_summary']
+        self.assertEqual(sum(row['count'] for row in summary), 20)
+        statements = [query['sql'] for query in captured.captured_queries]
+        self.assertIn('store_dailyproductsales', ' '.join(statements))
+        # Besides creating the cache version counters the first time, nothing is written
+        writes = [sql for sql in statements if sql.startswith(('INSERT', 'UPDATE', 'DELETE')) and 'store_modelversion' not in sql]
+        self.assertEqual(writes, [])
+
+
+@override_settings(STORE_DASHBOARD_WORKERS=0)
+class SlowDashboardReportTests(TransactionTestCase):
+    """Without a pool, a slow report still gives way to a placeholder when its timeout is up"""
+
+    def setUp(self):
+        cache.clear()
+        user = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(user)
+
+    def test_placeholder_within_the_timeout(self):
+        def slow():
+            time.sleep(1)
+            return []
+
+        slow_report = dashboard.DashboardReport(slow, (Product,), timeout=0.2)
+        with mock.patch.dict(dashboard.DASHBOARD_REPORTS, {'top_products': slow_report}):
+            start = time.monotonic()
+            response = self.client.get(reverse('store:dashboard'))
+            elapsed = time.monotonic() - start
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['top_products'].placeholder)
+        self.assertEqual(response.context['invoice_summary'], [])
+        self.assertLess(elapsed, 0.9)
+
+
+class ExportJobTests(TestCase):
+    """Export jobs store the changelist's filters, not its rows, and the worker rebuilds the query"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+        DataGenerator(seed=5).products(50)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+
+    def test_select_across_exports_the_filtered_rows(self):
+        url = reverse('admin:store_product_changelist') + '?stock_status=in&q=Benchmark'
+        expected = list(Product.objects.filter(stock_quantity__gt=10).order_by('pk').values_list('pk', flat=True))
+        self.client.post(url, {
+            'action': 'export_to_csv', 'select_across': '1', 'index': '0', '_selected_action': expected[:1],
+        })
+        job = Job.objects.get()
+        self.assertEqual(job.params['changelist'], 'stock_status=in&q=Benchmark')
+        self.assertNotIn('pks', job.params)
+        # Rows added after the job was queued aren't part of it
+        Product.objects.create(name='Benchmark Late', sku='LATE-1', unit_price=1, stock_quantity=100)
+        self.assertEqual(list(_selected(Product, job).values_list('pk', flat=True)), expected)
+
+        run_job(job.pk)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'done', job.error)
+        self.assertEqual((job.progress, job.total), (len(expected), len(expected)))
+        with job.result_file.open() as output:
+            self.assertEqual(len(output.read().decode().splitlines()), len(expected) + 1)
+
+    def test_ticked_rows_within_the_filter(self):
+        url = reverse('admin:store_product_changelist') + '?stock_status=in'
+        ticked = list(Product.objects.filter(stock_quantity__gt=10).order_by('pk').values_list('pk', flat=True)[:3])
+        self.client.post(url, {'action': 'export_to_csv', 'index': '0', '_selected_action': ticked})
+        self.assertEqual(list(_selected(Product, Job.objects.get()).values_list('pk', flat=True)), ticked)
+
+
+class JobQueueTests(TestCase):
+    """Jobs whose worker died are picked up again, a limited number of times"""
+
+    def stale_job(self, attempts):
+        long_ago = timezone.now() - timedelta(seconds=STALE_AFTER + 1)
+        return Job.objects.create(kind='dashboard_report', status='running', started_at=long_ago,
+                                  heartbeat_at=long_ago, attempts=attempts)
+
+    def test_stale_job_is_claimed_again(self):
+        job = self.stale_job(attempts=1)
+        Job.objects.create(kind='dashboard_report', status='running', started_at=timezone.now(), heartbeat_at=timezone.now())
+        claimed = claim_next_job()
+        self.assertEqual(claimed.pk, job.pk)
+        self.assertEqual((claimed.status, claimed.attempts), ('running', 2))
+        self.assertIsNone(claim_next_job())
+
+    def test_stale_job_fails_after_its_last_attempt(self):
+        job = self.stale_job(attempts=MAX_ATTEMPTS)
+        self.assertIsNone(claim_next_job())
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+
+
+class InvoiceAdminStockTests(TestCase):
+    """The invoice form reports a shortage instead of saving, and a lost race saves nothing"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+        cls.product = Product.objects.create(name='Widget', sku='W-1', unit_price=5, stock_quantity=3)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def post(self, quantity):
+        return self.client.post(reverse('admin:store_invoice_add'), {
+            'invoice_number': 'INV-ADMIN-1', 'customer_name': 'Ada', 'customer_email': 'ada@example.com',
+            'billing_address': '1 Main St', 'invoice_date_0': '2026-01-05', 'invoice_date_1': '10:00:00',
+            'due_date': '2026-02-05', 'status': 'sent',
+            'line_items-TOTAL_FORMS': '1', 'line_items-INITIAL_FORMS': '0',
+            'line_items-0-product': self.product.pk, 'line_items-0-quantity': quantity, 'line_items-0-price_each': '5.00',
+            'status_changes-TOTAL_FORMS': '0', 'status_changes-INITIAL_FORMS': '0',
+        })
+
+    def test_shortage_is_a_form_error(self):
+        response = self.post(4)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Insufficient stock for: W-1 (only 3 available)')
+        self.assertFalse(Invoice.objects.exists())
+
+    def test_stock_taken_while_saving_is_rolled_back(self):
+        calls = []
+
+        def taken_once(invoice):
+            calls.append(invoice.pk)
+            if len(calls) == 1:
+                raise InsufficientStock({self.product.pk: 2})
+            return reserve_stock([(self.product.pk, 2)], invoice)
+
+        with mock.patch('store.admin.sync_invoice_reservations', side_effect=taken_once):
+            response = self.post(2)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(Invoice.objects.count(), 1)
+        self.assertEqual(StockReservation.objects.get().quantity, 2)
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock_quantity, 1)
+
+
+class IngestStockTests(TestCase):
+    """Ingested invoices without enough stock are never inserted, and a lost insert race is retried"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(name='Widget', sku='W-1', unit_price=5, stock_quantity=3)
+
+    def record(self, number, quantity):
+        return {
+            'invoice_number': number, 'customer_name': 'Ada', 'customer_email': 'ada@example.com',
+            'billing_address': '1 Main St', 'due_date': '2026-02-05', 'line_items': [{'sku': 'W-1', 'quantity': quantity}],
+        }
+
+    def test_short_invoice_is_not_inserted(self):
+        with CaptureQueriesContext(connection) as ctx:
+            result = ingest_invoices([self.record('WEB-1', 2), self.record('WEB-2', 2)])
+        self.assertEqual(result.created, ['WEB-1'])
+        self.assertIn('WEB-2', result.errors)
+        self.assertFalse(any(q['sql'].startswith('DELETE') for q in ctx.captured_queries))
+        self.assertEqual(list(Invoice.objects.values_list('invoice_number', flat=True)), ['WEB-1'])
+        self.assertEqual(StockReservation.objects.get().quantity, 2)
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock_quantity, 1)
+
+    def test_insert_race_is_retried(self):
+        bulk_create = Invoice.objects.bulk_create
+        calls = []
+
+        def raced(invoices):
+            calls.append(len(invoices))
+            if len(calls) == 1:
+                # Another request inserted one of the numbers between the check and the insert
+                raise IntegrityError('UNIQUE constraint failed: store_invoice.invoice_number')
+            return bulk_create(invoices)
+
+        with mock.patch.object(Invoice.objects, 'bulk_create', side_effect=raced):
+            result = ingest_invoices([self.record('WEB-1', 1), self.record('WEB-2', 1)])
+        self.assertEqual(calls, [2, 2])
+        self.assertEqual(result.created, ['WEB-1', 'WEB-2'])
+        # The first attempt's stock was rolled back with its savepoint
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock_quantity, 1)
+        self.assertEqual(StockReservation.objects.count(), 2)
+        self.assertEqual(InventoryMovement.objects.filter(reason='reservation').count(), 2)
+
+
+class ParallelReservationTests(TransactionTestCase):
+    """Reservations from concurrent threads never oversell, and the ledger matches the stock"""
+    stock = 10
+
+    def reserve(self, items):
+        # Each thread has its own connection, so the reservations really do contend
+        try:
+            with_retry(reserve_stock, items, attempts=20)
+            return True
+        except InsufficientStock:
+            return False
+        finally:
+            connections.close_all()
+
+    def test_no_oversell(self):
+        products = [
+            Product.objects.create(name=f'Hot {n}', sku=f'HOT-{n}', unit_price=1, stock_quantity=self.stock)
+            for n in range(3)
+        ]
+        # Six times as many units asked for as there are in stock
+        baskets = [[(products[n % 3].pk, 1), (products[(n + 1) % 3].pk, 2)] for n in range(60)]
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            reserved = sum(pool.map(self.reserve, baskets))
+
+        self.assertGreater(reserved, 0)
+        self.assertLess(reserved, len(baskets))
+        self.assertEqual(StockReservation.objects.count(), reserved * 2)
+        for product in products:
+            product.refresh_from_db()
+            held = StockReservation.objects.filter(product=product).aggregate(total=Sum('quantity'))['total'] or 0
+            moved = InventoryMovement.objects.filter(product=product).aggregate(total=Sum('quantity'))['total'] or 0
+            self.assertGreaterEqual(product.stock_quantity, 0)
+            self.assertEqual(product.stock_quantity + held, self.stock)
+            # The opening balance less every reservation
+            self.assertEqual(moved, product.stock_quantity)
+
+
+class QueryPlanTests(TestCase):
+    """The hot queries are served by the indexes built for them (see store.plans)"""
+
+    def test_plans_use_their_indexes(self):
+        for check, expected, plan, passed in run_checks():
+            with self.subTest(check.label):
+                self.assertTrue(expected, f'No index on ({", ".join(check.columns)})')
+                self.assertTrue(passed, f'Expected an index from {", ".join(sorted(expected))}:\n{plan}')
+
+
+class StreamingTests(TestCase):
+    """The product CSV export works through the rows a chunk at a time instead of loading them all"""
+
+    @classmethod
+    def setUpTestData(cls):
+        DataGenerator(seed=6, days=30).products(25)
+
+    def fetched_chunks(self):
+        """Patch the SQL compiler to record the size of each chunk of rows fetched by iterator()"""
+        chunks = []
+        cursor_iter = compiler.cursor_iter
+
+        def recording_cursor_iter(*args, **kwargs):
+            for rows in cursor_iter(*args, **kwargs):
+                chunks.append(len(rows))
+                yield rows
+        self.enterContext(mock.patch.object(compiler, 'cursor_iter', recording_cursor_iter))
+        return chunks
+
+    def test_product_csv_is_fetched_in_chunks(self):
+        chunks = self.fetched_chunks()
+        with self.assertNumQueries(1):
+            lines = iter_product_csv(Product.objects.order_by('pk'), chunk_size=10)
+            next(lines), next(lines)
+            # The first row is written before the rest of the table is read
+            self.assertEqual(chunks, [10])
+            self.assertEqual(len(list(lines)), 24)
+        self.assertEqual(chunks, [10, 10, 5])
+
+
+class ProductImportTests(TestCase):
+    """Catalog imports read and upsert their rows a chunk at a time"""
+
+    def test_upserts_in_chunks(self):
+        read = []
+
+        def rows():
+            for number in range(25):
+                read.append(number)
+                yield number + 2, {'name': f'Imported {number}', 'sku': f'IMP-{number}', 'unit_price': '1.00'}
+        read_at_first_chunk = []
+        importer = ProductImporter(chunk_size=10)
+        with CaptureQueriesContext(connection) as captured:
+            result = importer.run(rows(), progress=lambda result, done=False: read_at_first_chunk.append(len(read)))
+        self.assertEqual(result.created, 25)
+        self.assertEqual(read_at_first_chunk[0], 10)
+        upserts = [query for query in captured.captured_queries if query['sql'].startswith('INSERT INTO "store_product"')]
+        self.assertEqual(len(upserts), 3)
+
+
+class InvoiceWorkbookTests(TestCase):
+    """The XLSX export streams its invoices and keeps the number of sheets bounded"""
+
+    @classmethod
+    def setUpTestData(cls):
+        generator = DataGenerator(seed=7, days=30)
+        generator.products(10)
+        generator.invoices(25, lines_per_invoice=2)
+
+    def test_built_in_chunks(self):
+        workbook = InvoiceWorkbook(chunk_size=10)
+        # The invoices in one query, and their line items and products in one more per chunk of 10
+        with self.assertNumQueries(1 + 3):
+            workbook.add_flat_sheet(Invoice.objects.order_by('pk'))
+        workbook.save().close()
+
+    def sheet_names(self, layout):
+        output = exports.export_invoices_xlsx(Invoice.objects.order_by('pk'), layout=layout)
+        with output:
+            workbook = openpyxl.load_workbook(output, read_only=True)
+            names = workbook.sheetnames
+            workbook.close()
+        return names
+
+    def test_one_sheet_per_invoice_up_to_the_limit(self):
+        with mock.patch.object(exports, 'MAX_INVOICE_SHEETS', 25):
+            self.assertEqual(len(self.sheet_names('sheets')), 25)
+
+    def test_flat_sheet_past_the_limit(self):
+        with mock.patch.object(exports, 'MAX_INVOICE_SHEETS', 24):
+            self.assertEqual(self.sheet_names('sheets'), ['Invoices'])
+
+
+class PerformancePageTests(TestCase):
+    """The request performance page is served by the admin, under its namespace"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+
+    def test_staff_only(self):
+        url = reverse('admin:store_performance')
+        self.assertRedirects(self.client.get(url), f"{reverse('admin:login')}?next={url}")
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_clear(self):
+        profiling.window.add({'at': time.time(), 'endpoint': 'GET /', 'duration_ms': 1, 'queries': 1, 'sql_ms': 1, 'duplicates': []})
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('admin:store_performance'))
+        self.assertRedirects(response, reverse('admin:store_performance'))
+        self.assertEqual(profiling.window.recent(), [])
@@ -0,0 +1,98 @@
+"""
+Set-based invoice status transitions.
+
+A transition moves the selected invoices with one UPDATE per batch, however many
+there are, with the history written in bulk and the stock reservations committed
+or released to match the new status.
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from .inventory import release_reservations
+from .models import Invoice, InvoiceStatusChange, StockReservation
+
+# The statuses an invoice may move to from each status
+TRANSITIONS = {
+    'draft': {'sent', 'paid', 'cancelled', 'overdue'},
+    'sent': {'paid', 'cancelled', 'overdue'},
+    'overdue': {'sent', 'paid', 'cancelled'},
+    'paid': set(),
+    'cancelled': set(),
+}
+
+
+class InvalidTransition(Exception):
+    """Raised for a target status no invoice can move to"""
+
+
+def source_statuses(to_status):
+    """The statuses that may transition to `to_status`"""
+    sources = sorted(status for status, targets in TRANSITIONS.items() if to_status in targets)
+    if not sources:
+        raise InvalidTransition(f"Invoices can't be moved to '{to_status}'.")
+    return sources
+
+
+def record_status_change(invoice, from_status, user=None, source=''):
+    """Record a status change made to a single invoice outside transition_invoices()"""
+    return InvoiceStatusChange.objects.create(
+        invoice=invoice, from_status=from_status, to_status=invoice.status, changed_by=user, source=source
+    )
+
+
+def _move(history, to_status, now):
+    """Write a batch's history and move its invoices, with their stock reservations"""
+    InvoiceStatusChange.objects.bulk_create(history)
+    batch = [change.invoice_id for change in history]
+    Invoice.objects.filter(pk__in=batch).update(status=to_status, updated_at=now)
+    reservations = StockReservation.objects.filter(invoice__in=batch, status='reserved')
+    if to_status == 'paid':
+        reservations.update(status='committed', updated_at=now)
+    elif to_status == 'cancelled':
+        release_reservations(reservations.values_list('pk', flat=True))
+
+
+@transaction.atomic
+def transition_invoices(queryset, to_status, user=None, source='', batch_size=2000):
+    """
+    Move every invoice in `queryset` that is allowed to make the transition to
+    `to_status` and return how many moved. Invoices already in `to_status`, or in a
+    status that can't move there, are left alone.
+
+    The rows are locked and read a batch at a time in primary key order; each batch's
+    history is written in bulk and its invoices changed by one UPDATE on their keys.
+    Moving to 'paid' commits the invoices' stock reservations and moving to
+    'cancelled' returns their reserved stock.
+    """
+    now = timezone.now()
+    eligible = queryset.filter(status__in=source_statuses(to_status)).select_for_update().order_by('pk')
+    moved = 0
+    last = None
+    while True:
+        batch = eligible if last is None else eligible.filter(pk__gt=last)
+        rows = list(batch.values_list('pk', 'status')[:batch_size])
+        if not rows:
+            return moved
+        _move([
+            InvoiceStatusChange(
+                invoice_id=invoice_id, from_status=from_status, to_status=to_status,
+                changed_by=user, source=source, changed_at=now,
+            )
+            for invoice_id, from_status in rows
+        ], to_status, now)
+        moved += len(rows)
+        last = rows[-1][0]
+
+
+def past_due_invoices(today=None):
+    """Draft and sent invoices whose due date has passed"""
+    today = today or timezone.localdate()
+    return Invoice.objects.filter(status__in=['draft', 'sent'], due_date__lt=today)
+
+
+def mark_overdue_invoices(today=None):
+    """
+    Move past-due invoices to 'overdue' and return how many moved. Served by the
+    (status, due_date) index; run it daily with `manage.py mark_overdue_invoices`.
+    """
+    return transition_invoices(past_due_invoices(today), 'overdue', source='overdue sweep')
@@ -1,9 +1,16 @@
 from django.urls import path
-from . import views
+from . import api, views
 
 app_name = 'store'
 
 urlpatterns = [
     path('', views.home, name='home'),
     path('dashboard/', views.dashboard, name='dashboard'),
+    path('dashboard/report/', views.dashboard_report, name='dashboard_report'),
+    path('jobs/<int:pk>/download/', views.job_download, name='job_download'),
+    path('api/invoices/ingest/', views.invoice_ingest, name='invoice_ingest'),
+    path('api/v1/reports/', api.report_index, name='api_reports'),
+    path('api/v1/reports/<slug:name>/', api.report_detail, name='api_report'),
+    path('api/v1/products/', api.product_list, name='api_products'),
+    path('api/v1/invoices/', api.invoice_list, name='api_invoices'),
 ] 
\ No newline at end of file
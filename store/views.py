@@ -1,86 +1,98 @@
-from django.shortcuts import render
-from django.db.models import Sum, F, DecimalField
+import hmac
+import json
+import os
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.shortcuts import get_object_or_404, redirect, render
 from django.contrib.admin.views.decorators import staff_member_required
-from django.core.cache import cache
-from django.views.decorators.cache import cache_page
+from django.http import FileResponse, Http404, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 
-from .models import Product, PurchaseOrder, Invoice
-from . import queries
+from .dashboard import get_dashboard_reports
+from .ingest import MAX_BATCH_SIZE, ingest_invoices
+from .jobs import enqueue
+from .models import Job
+from .stats import StoreStats
 
 # Create your views here.
 def home(request):
     """
     Home page view for the e-commerce store
     """
-    # Get some basic statistics
-    product_count = Product.objects.count()
-    purchase_order_count = PurchaseOrder.objects.count()
-    invoice_count = Invoice.objects.count()
-    
-    # Get the total value of all invoices
-    total_invoice_value = Invoice.objects.annotate(
-        total=Sum(F('line_items__quantity') * F('line_items__price_each'), 
-                 output_field=DecimalField())
-    ).aggregate(Sum('total'))['total__sum'] or 0
-    
-    # Get the total value of all purchase orders
-    total_purchase_value = PurchaseOrder.objects.annotate(
-        total=Sum(F('line_items__quantity') * F('line_items__cost_per_unit'), 
-                 output_field=DecimalField())
-    ).aggregate(Sum('total'))['total__sum'] or 0
-    
-    # Get overdue invoices
-    overdue_invoices_count = queries.get_overdue_invoices().count()
-    
-    # Get low stock products
-    low_stock_products_count = queries.get_low_stock_products().count()
+    # All statistics come from a single query (see StoreStats)
+    stats = StoreStats().get()
     
     context = {
         'title': 'Welcome to Our E-commerce Management System',
-        'product_count': product_count,
-        'purchase_order_count': purchase_order_count,
-        'invoice_count': invoice_count,
-        'total_invoice_value': total_invoice_value,
-        'total_purchase_value': total_purchase_value,
-        'overdue_invoices_count': overdue_invoices_count,
-        'low_stock_products_count': low_stock_products_count
+        **stats
     }
     return render(request, 'store/home.html', context)
 
 @staff_member_required
-def dashboard(request):
+async def dashboard(request):
     """
     Admin dashboard with detailed statistics
     """
-    # Try to get dashboard data from cache
-    cache_key = 'dashboard_data'
-    dashboard_data = cache.get(cache_key)
-    
-    if dashboard_data is None:
-        # Only run expensive queries if cache is empty
-        # Limit data retrieval to what's necessary
-        top_products = list(queries.get_product_sales_analysis()[:5])
-        vendor_summary = list(queries.get_vendor_purchase_summary()[:5])
-        invoice_summary = list(queries.get_invoice_status_summary())
-        top_customers = list(queries.get_customers_by_revenue()[:5])
-        product_margins = list(queries.get_product_profit_margin()[:5])
-        
-        # Store in cache for 5 minutes
-        dashboard_data = {
-            'top_products': top_products,
-            'vendor_summary': vendor_summary,
-            'invoice_summary': invoice_summary,
-            'top_customers': top_customers,
-            'product_margins': product_margins
-        }
-        cache.set(cache_key, dashboard_data, 300)  # 5 minutes
+    # The reports run concurrently and each is cached until a table it reads changes
+    reports = await get_dashboard_reports()
     
     context = {
         'title': 'Admin Dashboard',
-        'top_products': dashboard_data['top_products'],
-        'vendor_summary': dashboard_data['vendor_summary'],
-        'invoice_summary': dashboard_data['invoice_summary'],
-        'top_customers': dashboard_data['top_customers'],
-        'product_margins': dashboard_data['product_margins']
+        'top_products': reports['top_products'],
+        'vendor_summary': reports['vendor_summary'],
+        'invoice_summary': reports['invoice_summary'],
+        'top_customers': reports['top_customers'],
+        'product_margins': reports['product_margins']
     }
-    return render(request, 'store/dashboard.html', context)
+    # Rendering reads the session user and runs the context processors, which are sync
+    return await sync_to_async(render)(request, 'store/dashboard.html', context)
+
+@staff_member_required
+@require_POST
+def dashboard_report(request):
+    """
+    Queue a full (not top-5) dashboard report to be built by a background worker
+    """
+    enqueue('dashboard_report', user=request.user)
+    return redirect('admin:store_job_changelist')
+
+@staff_member_required
+def job_download(request, pk):
+    """
+    Download the result file of a finished background job
+    """
+    job = get_object_or_404(Job, pk=pk, status='done')
+    if not job.result_file:
+        raise Http404("This job has no result file.")
+    return FileResponse(job.result_file.open('rb'), as_attachment=True, filename=os.path.basename(job.result_file.name))
+
+def _has_ingest_token(request):
+    token = getattr(settings, 'STORE_INGEST_TOKEN', '')
+    header = request.headers.get('Authorization', '')
+    return bool(token) and hmac.compare_digest(header, f'Bearer {token}')
+
+@csrf_exempt
+@require_POST
+def invoice_ingest(request):
+    """
+    Create a batch of invoices pushed by the storefront. The body is a JSON list of
+    invoices (or {"invoices": [...]}) with their line items; see store.ingest.
+    Invoice numbers that already exist are reported as existing, so retries are safe.
+    """
+    # Called server to server with a bearer token; there is no session, hence no CSRF check
+    if not _has_ingest_token(request):
+        return JsonResponse({'error': 'Invalid or missing API token.'}, status=401)
+    try:
+        payload = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'error': 'The request body must be JSON.'}, status=400)
+    records = payload.get('invoices') if isinstance(payload, dict) else payload
+    if not isinstance(records, list):
+        return JsonResponse({'error': 'Expected a list of invoices.'}, status=400)
+    if len(records) > MAX_BATCH_SIZE:
+        return JsonResponse({'error': f'At most {MAX_BATCH_SIZE} invoices per request.'}, status=413)
+
+    result = ingest_invoices(records)
+    return JsonResponse(result.as_dict(), status=201 if result.created else 200)
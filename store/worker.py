@@ -0,0 +1,19 @@
+"""
+Entry points for background job worker processes. Worker processes are spawned
+fresh, so this module must not import models at import time.
+"""
+import django
+
+
+def init_worker():
+    django.setup()
+
+
+def execute(job_id):
+    from django.db import connections
+    from .jobs import run_job
+
+    try:
+        return run_job(job_id)
+    finally:
+        connections.close_all()